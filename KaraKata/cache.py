@@ -0,0 +1,69 @@
+"""in-process caches shared by the apps"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalLRUCache:
+    """in-process cache with least recently used eviction and per entry expiry
+
+    it has the get/get_many/set/set_many/add/delete/clear subset of Django's cache API
+    that the response and user caches use, so any Django cache can stand in for it.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires at or None, value)
+
+    def _live(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, timeout):
+        self.entries[key] = (None if timeout is None else time.monotonic() + timeout, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._live(key, time.monotonic())
+        return default if entry is None else entry[1]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self.lock:
+            found = {key: self._live(key, now) for key in keys}
+        return {key: entry[1] for key, entry in found.items() if entry is not None}
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self._store(key, value, timeout)
+
+    def set_many(self, data, timeout=None):
+        with self.lock:
+            for key, value in data.items():
+                self._store(key, value, timeout)
+        return []
+
+    def add(self, key, value, timeout=None):
+        with self.lock:
+            if self._live(key, time.monotonic()) is not None:
+                return False
+            self._store(key, value, timeout)
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
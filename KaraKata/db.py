@@ -0,0 +1,186 @@
+"""read replica routing
+
+views opt in with ReplicaReadMixin, which marks their safe actions as replica
+reads for the current request. ReplicaRouter sends those reads to a healthy
+alias from DATABASE_REPLICAS and everything else to the primary. once a
+request writes, its later reads stay on the primary, and
+ReplicaRoutingMiddleware sets a cookie that keeps the client's next requests
+there for MAX_LAG seconds, so nobody reads past their own write on a lagging
+replica. commands, tasks and reads inside a transaction always use the primary.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.http import http_date
+
+logger = logging.getLogger('karakata.db')
+
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+def config():
+    return {'ALIASES': [], 'MAX_LAG': 5, 'HEALTH_CHECK_INTERVAL': 30, **getattr(settings, 'DATABASE_REPLICAS', {})}
+
+
+class RoutingState:
+    def __init__(self, pinned=False):
+        self.pinned = pinned  # the client wrote within MAX_LAG
+        self.wrote = False
+        self.replica_reads = False
+        self.used_replica = False
+
+
+_state = ContextVar('db_routing', default=None)
+
+
+@contextmanager
+def routing_state(state):
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """lets the reads in the block go to a replica, unless the request is pinned to the primary"""
+    state = _state.get()
+    if state is None:
+        with routing_state(RoutingState()) as state:
+            state.replica_reads = enabled
+            yield
+        return
+    previous, state.replica_reads = state.replica_reads, enabled
+    try:
+        yield
+    finally:
+        state.replica_reads = previous
+
+
+class ReplicaHealth:
+    """whether each replica answered its last check, checks are at most HEALTH_CHECK_INTERVAL apart"""
+
+    def __init__(self):
+        self.checked = {}  # alias -> (checked at, healthy)
+
+    def is_healthy(self, alias):
+        checked_at, healthy = self.checked.get(alias, (None, False))
+        now = time.monotonic()
+        if checked_at is None or now - checked_at >= config()['HEALTH_CHECK_INTERVAL']:
+            healthy = self.check(alias)
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+    def check(self, alias):
+        try:
+            # the migrations table is there once the replica has the schema, not just a connection
+            with connections[alias].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM django_migrations LIMIT 1")
+            return True
+        except DatabaseError:
+            logger.warning("replica %s failed its health check, reads go to the primary", alias, exc_info=True)
+            connections[alias].close()
+            return False
+
+    def reset(self):
+        self.checked.clear()
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        # every other read is explicit too, the default would follow the hinted instance onto a replica
+        if state is None or not state.replica_reads or state.pinned or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = [alias for alias in config()['ALIASES'] if health.is_healthy(alias)]
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        state.used_replica = True
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the primary's rows, an object read from one can point at one from another
+        databases = {DEFAULT_DB_ALIAS, *config()['ALIASES']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema from the primary, aliases mirroring another in
+        # tests are replicas too, even while DATABASE_REPLICAS does not list them
+        mirrored = settings.DATABASES.get(db, {}).get('TEST', {}).get('MIRROR')
+        return db not in config()['ALIASES'] and not mirrored
+
+
+class ReplicaRoutingMiddleware:
+    """tracks the routing state of each request and pins clients that wrote to the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with routing_state(self.state_for(request)) as state:
+            response = self.get_response(request)
+        return self.pin(response, state)
+
+    async def __acall__(self, request):
+        # sync_to_async copies the context, so the ORM threads see the state
+        with routing_state(self.state_for(request)) as state:
+            response = await self.get_response(request)
+        return self.pin(response, state)
+
+    def state_for(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        return RoutingState(pinned)
+
+    def pin(self, response, state):
+        if state.wrote:
+            seconds = config()['MAX_LAG']
+            until = time.time() + seconds
+            response.set_cookie(PRIMARY_COOKIE, f'{until:.3f}', max_age=seconds, expires=http_date(until), httponly=True, samesite='Lax')
+        return response
+
+
+def used_replica():
+    """whether the current request read from a replica, its data may be up to MAX_LAG seconds old"""
+    state = _state.get()
+    return state is not None and state.used_replica
+
+
+class ReplicaReadMixin:
+    """sends the reads of the listed viewset actions, or methods on plain views, to a replica"""
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        action = getattr(self, 'action_map', {}).get(method, method)
+        with replica_reads(action in self.replica_actions):
+            return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('karakata.queries')
+
+
+class QueryRecorder:
+    """execute wrapper that records every query run while it is installed
+
+    the fingerprint is the SQL with its placeholders, before params are bound,
+    so the same statement run for many rows (an N+1) shows up as a duplicate.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    def record(self):
+        """installs the recorder on every configured database"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+    @property
+    def duplicates(self):
+        return {sql: n for sql, n in self.fingerprints.items() if n > 1}
+
+
+class QueryStatsMiddleware:
+    """per request query count, SQL time and duplicate queries
+
+    sent as X-Query-* response headers when DEBUG is on (or QUERY_STATS_HEADERS is
+    set) and logged as one JSON line to the karakata.queries logger otherwise.
+    it runs sync or async to match the stack, so it never pushes async views onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.headers = getattr(settings, 'QUERY_STATS_HEADERS', settings.DEBUG)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.record():
+            response = self.get_response(request)
+        return self.report(request, response, recorder, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        # the async ORM runs queries on the connections of this context, so the wrappers see them
+        with recorder.record():
+            response = await self.get_response(request)
+        return self.report(request, response, recorder, time.perf_counter() - start)
+
+    def report(self, request, response, recorder, elapsed):
+        duplicates = recorder.duplicates
+        if self.headers:
+            response['X-Query-Count'] = str(recorder.count)
+            response['X-Query-Time-Ms'] = f"{recorder.duration * 1000:.2f}"
+            response['X-Query-Duplicates'] = str(sum(n - 1 for n in duplicates.values()))
+        else:
+            logger.info(json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 2),
+                'query_count': recorder.count,
+                'query_time_ms': round(recorder.duration * 1000, 2),
+                # the worst offenders only, a full list can be huge
+                'duplicate_queries': [
+                    {'sql': sql[:200], 'count': n}
+                    for sql, n in Counter(duplicates).most_common(5)
+                ],
+            }))
+        return response
@@ -43,9 +43,12 @@ INSTALLED_APPS = [
     'shipping',
     'django_filters',
     'django_extensions',
+    'taskqueue',
 ]
 
 MIDDLEWARE = [
+    'KaraKata.middleware.QueryStatsMiddleware',
+    'KaraKata.db.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,7 +85,41 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # sqlite has no row locks, IMMEDIATE makes atomic blocks take the write lock up front
+        # so concurrent stock updates queue on the busy timeout instead of failing
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # connections are kept for a minute and pinged before a request reuses them
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        # a file backed test db lets the concurrency tests open one connection per thread
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # a local stand-in for a read replica, filled from db.sqlite3 by sync_sqlite_replicas
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['KaraKata.db.ReplicaRouter']
+
+# replica aliases that take the reads of ReplicaReadMixin views, empty sends everything
+# to the primary. MAX_LAG is how far they may trail it in seconds, HEALTH_CHECK_INTERVAL
+# how often each is checked before it is used
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'MAX_LAG': 5,
+    'HEALTH_CHECK_INTERVAL': 30,
 }
 
 
@@ -130,9 +167,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Rest framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
-    'DEDAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -148,9 +185,67 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# users are built from access token claims younger than CLAIMS_MAX_AGE seconds,
+# otherwise read through a cache of MAX_ENTRIES users kept for TIMEOUT seconds
+JWT_USER_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 300,
+    'CLAIMS_MAX_AGE': 900,
+}
+
 # for custom user modekl
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 # media
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# product list and detail response cache, see products.cache. set CACHE_ALIAS
+# to one of CACHES instead of BACKEND to share it between processes
+PRODUCT_CACHE = {
+    'BACKEND': 'KaraKata.cache.LocalLRUCache',
+    'OPTIONS': {'max_entries': 10000},
+    'TIMEOUT': 300,
+}
+
+# threads making resized copies of product images, 0 makes them in the calling thread
+PRODUCT_IMAGE_WORKERS = 2
+
+# cart stock holds, see products.holds. TTL is how long a cart line holds its units,
+# ORDER_TTL how long an unpaid order does after checkout
+STOCK_HOLDS = {
+    'TTL': 900,
+    'ORDER_TTL': 1800,
+    'SWEEP_BATCH_SIZE': 1000,
+}
+
+# Idempotency-Key replays of checkout and payment, see products.idempotency.
+# TTL is how long a key and its stored response are kept
+IDEMPOTENCY = {
+    'TTL': 86400,
+    'PURGE_BATCH_SIZE': 1000,
+}
+
+# payment gateway client, see products.payments
+PAYMENT_GATEWAY = {
+    'BACKEND': 'products.payments.FakeGateway',
+    'OPTIONS': {},
+}
+
+# mails are sent by the run_tasks worker
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# query stats middleware, X-Query-* headers in debug, karakata.queries log lines otherwise
+QUERY_STATS_HEADERS = DEBUG
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'karakata.queries': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'karakata.tasks': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
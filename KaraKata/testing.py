@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+
+from .middleware import QueryRecorder
+
+
+class QueryBudgetMixin:
+    """TestCase mixin for holding code to a query budget with assertQueryBudget
+
+    a failure prints the statements run, repeated ones first, which is
+    usually enough to spot the N+1.
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        recorder = QueryRecorder()
+        with recorder.record():
+            yield recorder
+        if recorder.count > budget:
+            self.fail(self.budget_report(recorder, budget))
+
+    def budget_report(self, recorder, budget):
+        lines = [f"{recorder.count} queries run, budget is {budget}"]
+        for sql, n in recorder.fingerprints.most_common():
+            lines.append(f"  {n} x {sql[:200]}")
+        return '\n'.join(lines)
+
+
+class EndpointQueryBudgetMixin(QueryBudgetMixin):
+    """QueryBudgetMixin that also GETs a table of endpoints
+
+    subclasses list their endpoints in query_budgets as
+    (name, client attribute, url, budget) and get one subtest per endpoint,
+    the url is formatted with self so it can use ids from setUp.
+    """
+    query_budgets = []
+
+    def test_query_budgets(self):
+        # an empty table would pass while checking nothing
+        self.assertTrue(self.query_budgets, f"{type(self).__name__} lists no query_budgets")
+        for name, client, url, budget in self.query_budgets:
+            with self.subTest(endpoint=name):
+                with self.assertQueryBudget(budget):
+                    response = getattr(self, client).get(url.format(self=self))
+                self.assertEqual(response.status_code, 200, response.content[:500])
+                self.assertIn('X-Query-Count', response)
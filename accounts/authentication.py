@@ -0,0 +1,99 @@
+"""JWT authentication that mostly does without a user query
+
+access tokens carry the user's email, role and is_staff. while those claims
+are younger than CLAIMS_MAX_AGE, and the user was not saved in this process
+since they were issued, the user is built from them without a query. older
+tokens, tokens without the claims and recently saved users are looked up
+through a small in-process cache that expires after TIMEOUT and is cleared
+for a user whenever they are saved.
+"""
+import time
+
+from django.conf import settings
+from django.db import router
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from KaraKata.cache import LocalLRUCache
+
+# a user built from these claims has only them, id and is_active loaded, the rest load on first access
+CLAIMS = ('email', 'role', 'is_staff')
+
+
+def add_user_claims(token, user):
+    """puts the claims a request needs into token, they carry over to refreshed access tokens"""
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    token['claims_at'] = round(time.time(), 3)
+    return token
+
+
+def config():
+    return {'MAX_ENTRIES': 10000, 'TIMEOUT': 300, 'CLAIMS_MAX_AGE': 900, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+class UserCache:
+    """field values of recently authenticated users and when each was last saved"""
+
+    def __init__(self):
+        self.cache = LocalLRUCache(config()['MAX_ENTRIES'])
+
+    def get(self, user_id):
+        return self.cache.get(f'user:{user_id}')
+
+    def set(self, user_id, values):
+        self.cache.set(f'user:{user_id}', values, config()['TIMEOUT'])
+
+    def saved_at(self, user_id):
+        return self.cache.get(f'saved:{user_id}', 0)
+
+    def invalidate(self, user_id):
+        self.cache.delete(f'user:{user_id}')
+        # claims older than CLAIMS_MAX_AGE are not trusted anyway, no need to remember longer
+        self.cache.set(f'saved:{user_id}', time.time(), config()['CLAIMS_MAX_AGE'])
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication building the user from token claims or a cache instead of a query per request"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # the revoke check compares the stored password, only the database has it
+            return super().get_user(validated_token)
+
+        user = self.user_from_claims(validated_token, user_id) or self.user_from_cache(user_id)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+    def user_from_claims(self, token, user_id):
+        claims_at = token.get('claims_at')
+        if claims_at is None or any(claim not in token for claim in CLAIMS):
+            return None
+        if claims_at < time.time() - config()['CLAIMS_MAX_AGE'] or user_cache.saved_at(user_id) >= claims_at:
+            return None
+        # tokens are only issued to active users
+        loaded = {'id': user_id, 'is_active': True, **{claim: token[claim] for claim in CLAIMS}}
+        # from_db takes partial values in the model's field order
+        fields = [f.attname for f in self.user_model._meta.concrete_fields if f.attname in loaded]
+        return self.user_model.from_db(router.db_for_read(self.user_model), fields, [loaded[name] for name in fields])
+
+    def user_from_cache(self, user_id):
+        fields = [f.attname for f in self.user_model._meta.concrete_fields]
+        values = user_cache.get(user_id)
+        if values is None:
+            values = self.user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(*fields).first()
+            if values is None:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            user_cache.set(user_id, values)
+        # a fresh instance per request, cached values are shared between threads
+        return self.user_model.from_db(router.db_for_read(self.user_model), fields, values)
@@ -2,12 +2,18 @@
 from rest_framework import serializers
 from .models import CustomUser
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import add_user_claims
 
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
   """handles login using jwt and obtaon jwt token with role"""
   username_field = 'email'
 
+  @classmethod
+  def get_token(cls, user):
+    # lets CachedJWTAuthentication build the user without a query
+    return add_user_claims(super().get_token(user), user)
+
   def validate(self, attrs):
     data = super().validate(attrs)
     data['role'] = self.user.role
@@ -1,3 +1,71 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from KaraKata.testing import QueryBudgetMixin
+from .models import CustomUser
+
+
+class AuthQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """login and registration stay within their query budgets"""
+
+    def setUp(self):
+        CustomUser.objects.create_user('vendor@example.com', 'a-strong-pass', role='vendor')
+        self.client = APIClient()
+
+    def test_login(self):
+        with self.assertQueryBudget(1):
+            response = self.client.post('/api/login/', {'email': 'vendor@example.com', 'password': 'a-strong-pass'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['role'], 'vendor')
+
+    def test_register(self):
+        with self.assertQueryBudget(2): # email uniqueness check, insert
+            response = self.client.post('/api/register/', {'email': 'new@example.com', 'password': 'a-strong-pass', 'role': 'customer'})
+        self.assertEqual(response.status_code, 201)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    """authenticated requests build the user from token claims or the user cache"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('vendor@example.com', 'a-strong-pass', role='vendor')
+        self.client = APIClient()
+
+    def user_queries(self, token, url='/api/addresses/'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return [q for q in ctx.captured_queries if 'accounts_customuser' in q['sql']]
+
+    def login(self):
+        return self.client.post('/api/login/', {'email': 'vendor@example.com', 'password': 'a-strong-pass'}).data['access']
+
+    def test_claims_spare_the_user_query(self):
+        token = self.login()
+        self.assertEqual(self.user_queries(token), [])
+        response = self.client.post('/api/products/', {'name': 'Phone', 'description': 'New phone', 'price': '1.00'},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['vendor'], self.user.id)
+
+    def test_tokens_without_claims_use_the_cache(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(len(self.user_queries(token)), 1)
+        self.assertEqual(self.user_queries(token), [])
+
+    def test_saving_the_user_outdates_claims_and_cache(self):
+        token = self.login()
+        self.user.role = 'customer'
+        self.user.save()
+        self.assertEqual(len(self.user_queries(token)), 1)
+        response = self.client.post('/api/products/', {'name': 'Phone', 'description': 'New phone', 'price': '1.00'},
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/addresses/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,176 @@
+"""async twins of the read heavy endpoints and of the payment calls
+
+under ASGI these run on the event loop: the ORM calls are awaited and the
+gateway calls use its async client, so a request waiting on the database or
+on the gateway holds no worker thread. serialization only ever sees rows and
+instances read up front, a lazy relation would query from the event loop and
+raise SynchronousOnlyOperation. the product list takes the filters that need
+no query to validate, search and the response cache stay on the sync views.
+a payment started with an Idempotency-Key runs in a thread, see products.idempotency.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from KaraKata.db import replica_reads
+from . import idempotency
+from .models import Cart, Category, Order, Product
+from .pagination import KeysetPagination
+from .payments import PaymentDeclined, get_gateway
+from .serializers import CartSerializer, CategorySerializer, LeanOrderSerializer, ProductSerializer
+from .stock import InsufficientStock
+from .views import claim_payment, start_payment, user_carts
+
+
+def async_api(methods, authenticated=False):
+    """wraps an async view returning (data, status) or (data, status, headers) into a JSON view shaped like the DRF ones"""
+
+    def decorate(view):
+        # token authenticated like the DRF views, which are csrf exempt as well
+        @csrf_exempt
+        @require_http_methods(methods)
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+            try:
+                if authenticated:
+                    # the authenticators may read the user cache or the database
+                    user = await sync_to_async(lambda: request.user)()
+                    if not user.is_authenticated:
+                        raise NotAuthenticated()
+                data, code, *headers = await view(request, *args, **kwargs)
+            except APIException as error:
+                data = error.detail if isinstance(error.detail, (dict, list)) else {'detail': error.detail}
+                code, headers = error.status_code, ()
+            # DRF's encoder, so amounts come out as they do from the sync views
+            return JsonResponse(data, status=code, safe=False, encoder=JSONEncoder, headers=headers[0] if headers else None)
+        return wrapper
+    return decorate
+
+
+def serializer_context(request):
+    return {'request': request, 'schedule_variants': False}
+
+
+class ProductListParams(serializers.Serializer):
+    category = serializers.IntegerField(required=False)
+    vendor = serializers.IntegerField(required=False)
+    min_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    max_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    ordering = serializers.ChoiceField(choices=['price', '-price', 'created_at', '-created_at'], required=False)
+
+
+@async_api(['GET'])
+async def product_list(request):
+    params = ProductListParams(data=request.query_params.dict())
+    if not params.is_valid():
+        raise ValidationError(params.errors)
+    filters = params.validated_data
+    queryset = Product.objects.all()
+    for name, lookup in (('category', 'category_id'), ('vendor', 'vendor_id'), ('min_price', 'price__gte'), ('max_price', 'price__lte')):
+        if name in filters:
+            queryset = queryset.filter(**{lookup: filters[name]})
+    if 'ordering' in filters:
+        queryset = queryset.order_by(filters['ordering'])
+
+    paginator = KeysetPagination()
+    with replica_reads():
+        page = await paginator.apaginate_queryset(queryset, request)
+    data = ProductSerializer(page, many=True, context=serializer_context(request)).data
+    return {'next': paginator.get_next_link(), 'results': data}, status.HTTP_200_OK
+
+
+@async_api(['GET'])
+async def product_detail(request, pk):
+    try:
+        with replica_reads():
+            product = await Product.objects.aget(pk=pk)
+    except Product.DoesNotExist:
+        raise NotFound()
+    return ProductSerializer(product, context=serializer_context(request)).data, status.HTTP_200_OK
+
+
+@async_api(['GET'])
+async def category_list(request):
+    with replica_reads():
+        categories = [category async for category in Category.objects.select_related('summary').order_by('path')]
+    return CategorySerializer(categories, many=True, context=serializer_context(request)).data, status.HTTP_200_OK
+
+
+@async_api(['GET'], authenticated=True)
+async def cart_detail(request, pk):
+    try:
+        # the prefetch runs inside aget, on the same thread as the cart query
+        cart = await user_carts(request.user).aget(pk=pk)
+    except Cart.DoesNotExist:
+        raise NotFound()
+    return CartSerializer(cart, context=serializer_context(request)).data, status.HTTP_200_OK
+
+
+@async_api(['GET'], authenticated=True)
+async def order_history(request):
+    queryset = Order.objects.filter(user=request.user).values(*LeanOrderSerializer.columns())
+    paginator = KeysetPagination()
+    with replica_reads():
+        page = await paginator.apaginate_queryset(queryset, request)
+        data = await LeanOrderSerializer(request).ato_representation(page)
+    return {'next': paginator.get_next_link(), 'results': data}, status.HTTP_200_OK
+
+
+@async_api(['POST'], authenticated=True)
+async def init_payment(request, order_id):
+    key = request.headers.get(idempotency.HEADER)
+    if key:
+        # claiming the key, the gateway call and storing the response share one
+        # transaction, which only runs in sync code, duplicates wait on the key
+        callback_url = request.build_absolute_uri(reverse('async_verify_payment', args=[order_id]))
+        data, code, replayed = await sync_to_async(idempotency.run_once)(request, key, lambda: start_payment(request, order_id, callback_url))
+        return data, code, {idempotency.REPLAYED_HEADER: 'true'} if replayed else {}
+
+    try:
+        order = await Order.objects.aget(id=order_id, user=request.user)
+    except Order.DoesNotExist:
+        return {'error': 'Order not found'}, status.HTTP_404_NOT_FOUND
+    if order.is_paid:
+        return {'message': 'Order already paid'}, status.HTTP_400_BAD_REQUEST
+
+    callback_url = request.build_absolute_uri(reverse('async_verify_payment', args=[order.id]))
+    payment = await get_gateway().ainitialize(order, callback_url)
+    order.payment_reference = payment['reference']
+    await order.asave(update_fields=['payment_reference'])
+    return {"message": "Payment initialized succesfully", "reference": payment['reference'], "amount": order.total,
+            "callback_url": callback_url, "authorization_url": payment['authorization_url']}, status.HTTP_200_OK
+
+
+@async_api(['GET'], authenticated=True)
+async def verify_payment(request, order_id):
+    try:
+        order = await Order.objects.aget(id=order_id, user=request.user)
+    except Order.DoesNotExist:
+        return {'error': 'Order not found'}, status.HTTP_404_NOT_FOUND
+
+    reference = request.query_params.get('reference', order.payment_reference)
+    if not order.payment_reference or reference != order.payment_reference:
+        return {'error': 'Invalid payment reference'}, status.HTTP_400_BAD_REQUEST
+    try:
+        await get_gateway().averify(reference)
+    except PaymentDeclined:
+        return {'error': 'Payment was not successful'}, status.HTTP_402_PAYMENT_REQUIRED
+
+    try:
+        # the claim is one transaction, and those only run in sync code
+        claimed = await sync_to_async(claim_payment)(order, reference)
+    except InsufficientStock:
+        return {'error': 'Insufficient stock to fulfil this order'}, status.HTTP_409_CONFLICT
+    if not claimed:
+        return {'message': 'Payment already verified'}, status.HTTP_200_OK
+    return {'message': 'Payment verified successfully'}, status.HTTP_200_OK
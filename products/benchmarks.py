@@ -0,0 +1,352 @@
+"""load scenarios for the API hot paths
+
+each scenario is a function of (session, rng) that makes the requests one
+virtual user would make, the session times every request under a label and
+reads the query count from the X-Query-Count header of the query stats
+middleware. sessions talk to Django's test client in process, or to a running
+server over HTTP, so the same scenarios run offline either way. the ASGI
+comparison drives the ASGI application from one event loop instead, the way
+an ASGI server would, to set the sync views against their async twins.
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from rest_framework.test import APIClient
+
+from .models import Cart
+
+SEARCH_TERMS = ['phone', 'lap', 'charger', 'head', 'camera speaker', 'watch', 'tab']
+
+
+class ClientTransport:
+    """requests through Django's test client, no server needed"""
+
+    def __init__(self):
+        # any host that passes ALLOWED_HOSTS, django allows localhost when the list is empty
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.client = APIClient(HTTP_HOST=host)
+
+    def send(self, method, path, data=None, token=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        response = getattr(self.client, method.lower())(path, data, format='json', **headers)
+        body = response.json() if response.get('Content-Type', '').startswith('application/json') else None
+        return response.status_code, body, response.get('X-Query-Count')
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpTransport:
+    """requests to a running server, e.g. manage.py runserver or uvicorn"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, path, data=None, token=None):
+        body = json.dumps(data).encode() if data is not None and method != 'GET' else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if token:
+            request.add_header('Authorization', f'Bearer {token}')
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, raw, queries = response.status, response.read(), response.headers.get('X-Query-Count')
+        except urllib.error.HTTPError as error:
+            status, raw, queries = error.code, error.read(), error.headers.get('X-Query-Count')
+        try:
+            return status, json.loads(raw or b'null'), queries
+        except ValueError:
+            return status, None, queries
+
+    def close(self):
+        pass
+
+
+class AsgiTransport:
+    """requests straight into the ASGI application, awaited from the caller's event loop"""
+
+    def __init__(self, application=None):
+        if application is None:
+            from KaraKata.asgi import application
+        self.application = application
+        self.host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+
+    async def send(self, method, path, data=None, token=None):
+        path, _, query = path.partition('?')
+        body = json.dumps(data).encode() if data is not None else b''
+        headers = [(b'host', self.host.encode()), (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        if token:
+            headers.append((b'authorization', f'Bearer {token}'.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+            'headers': headers, 'client': ('127.0.0.1', 0), 'server': (self.host, 80),
+        }
+        sent = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # the client stays connected, django stops listening once the response is sent
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        response = {'body': []}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+            elif message['type'] == 'http.response.body':
+                response['body'].append(message.get('body', b''))
+
+        await self.application(scope, receive, send)
+        raw = b''.join(response['body'])
+        try:
+            parsed = json.loads(raw or b'null') if response['headers'].get('content-type', '').startswith('application/json') else None
+        except ValueError:
+            parsed = None
+        return response['status'], parsed, response['headers'].get('x-query-count')
+
+
+class Session:
+    """one virtual user, records the latency of every request it makes"""
+
+    def __init__(self, transport, recorder, token=None):
+        self.transport = transport
+        self.recorder = recorder
+        self.token = token
+
+    def request(self, label, method, path, data=None):
+        start = time.perf_counter()
+        status, body, queries = self.transport.send(method, path, data, self.token)
+        self.recorder.add(label, time.perf_counter() - start, status, queries)
+        return status, body
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)  # label -> [(seconds, status, queries)]
+
+    def add(self, label, seconds, status, queries):
+        with self.lock:
+            self.samples[label].append((seconds, status, int(queries) if queries is not None else None))
+
+    def summary(self, wall_seconds):
+        report = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] * 1000 for s in samples)
+            queries = [s[2] for s in samples if s[2] is not None]
+            report[label] = {
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[1] >= 400),
+                'rps': round(len(samples) / wall_seconds, 2) if wall_seconds else None,
+                'mean_ms': round(sum(latencies) / len(latencies), 2),
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            }
+        return report
+
+
+def percentile(sorted_values, pct):
+    """nearest rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def results(body):
+    """rows of a paginated or plain list response"""
+    return body['results'] if isinstance(body, dict) else body or []
+
+
+# scenarios
+
+def product_browse(session, rng):
+    status, body = session.request('product list', 'GET', '/api/products/')
+    rows = results(body)
+    if rows:
+        session.request('product detail', 'GET', f"/api/products/{rng.choice(rows)['id']}/")
+    ordering = rng.choice(['price', '-price', 'created_at'])
+    session.request('product list ordered', 'GET', f'/api/products/?ordering={ordering}&min_price=10')
+
+
+def product_search(session, rng):
+    session.request('product search', 'GET', f'/api/products/?search={rng.choice(SEARCH_TERMS)}')
+
+
+def cart_add(session, rng):
+    product = rng.choice(session.products)
+    session.request('cart add', 'POST', '/api/cart/add/', {'product': product, 'quantity': 1})
+
+
+def cart_batch(session, rng):
+    # an offline cart synced in one request
+    operations = [{'op': 'set', 'product': product, 'quantity': 1} for product in rng.sample(session.products, 10)]
+    session.request('cart batch', 'POST', '/api/cart/batch/', {'operations': operations})
+
+
+def checkout(session, rng):
+    for product in rng.sample(session.products, 3):
+        session.request('cart add', 'POST', '/api/cart/add/', {'product': product, 'quantity': 1})
+    status, body = session.request('checkout', 'POST', '/api/orders/checkout/', {'shipping_address_id': session.address})
+    return body.get('id') if status == 201 else None
+
+
+def payment_verify(session, rng):
+    order_id = checkout(session, rng)
+    if order_id is None:
+        return
+    status, body = session.request('init payment', 'POST', f'/api/{order_id}/init-payment/')
+    if status == 200:
+        session.request('verify payment', 'GET', f"/api/{order_id}/verify-payment/?reference={body['reference']}")
+
+
+def vendor_dashboard(session, rng):
+    status, body = session.request('vendor dashboard', 'GET', '/api/vendor-dashboard/')
+    if status == 200 and body.get('next'):
+        path = body['next'].split('://', 1)[-1]
+        session.request('vendor dashboard next page', 'GET', path[path.index('/'):])
+
+
+# scenario name -> (function, role of the virtual users)
+SCENARIOS = {
+    'product_browse': (product_browse, None),
+    'product_search': (product_search, None),
+    'cart_add': (cart_add, 'customer'),
+    'cart_batch': (cart_batch, 'customer'),
+    'checkout': (checkout, 'customer'),
+    'payment_verify': (payment_verify, 'customer'),
+    'vendor_dashboard': (vendor_dashboard, 'vendor'),
+}
+
+
+def login(transport, email, password):
+    status, body, _ = transport.send('POST', '/api/login/', {'email': email, 'password': password})
+    if status != 200:
+        raise RuntimeError(f"login as {email} failed with {status}, seed the database with seed_marketplace first")
+    return body['access']
+
+
+def run_scenario(name, make_transport, users, iterations, concurrency, seed=0):
+    """runs iterations of a scenario spread over concurrency threads
+
+    users maps a role to a list of (email, password), each thread logs in as
+    its own user so carts and orders do not collide. returns the summary and
+    the wall time.
+    """
+    func, role = SCENARIOS[name]
+    recorder = Recorder()
+
+    sessions = []
+    for worker in range(concurrency):
+        transport = make_transport()
+        token = None
+        if role:
+            email, password = users[role][worker % len(users[role])]
+            token = login(transport, email, password)
+        session = Session(transport, recorder, token)
+        if role == 'customer':
+            status, body, _ = transport.send('GET', '/api/products/?page_size=100', token=token)
+            session.products = [row['id'] for row in results(body) if row['stock'] > 0]
+            status, body, _ = transport.send('GET', '/api/addresses/', token=token)
+            session.address = results(body)[0]['id']
+        sessions.append(session)
+
+    def work(worker, session):
+        rng = random.Random(seed * 1000 + worker)
+        try:
+            for _ in range(worker, iterations, concurrency):
+                func(session, rng)
+        finally:
+            session.transport.close()
+
+    threads = [threading.Thread(target=work, args=(i, s)) for i, s in enumerate(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    return recorder.summary(wall), wall
+
+
+async def run_requests(transport, recorder, label, requests, total, concurrency):
+    """total requests from concurrency virtual users at once, requests is a list of (method, path, data, token) to cycle"""
+
+    async def user(worker):
+        for n in range(worker, total, concurrency):
+            method, path, data, token = requests[n % len(requests)]
+            start = time.perf_counter()
+            status, body, queries = await transport.send(method, path, data, token)
+            recorder.add(label, time.perf_counter() - start, status, queries)
+
+    await asyncio.gather(*(user(worker) for worker in range(min(concurrency, total))))
+
+
+def compare_asgi(pairs, total, concurrency, transport=None):
+    """runs each sync view and its async twin under the same load through the ASGI application
+
+    pairs maps a label to (sync requests, async requests). returns
+    {label: {'sync': summary row, 'async': summary row}}.
+    """
+    transport = transport or AsgiTransport()
+    report = {}
+    for label, variants in pairs.items():
+        report[label] = {}
+        for variant, requests in zip(('sync', 'async'), variants):
+            recorder = Recorder()
+            start = time.perf_counter()
+            asyncio.run(run_requests(transport, recorder, label, requests, total, concurrency))
+            report[label][variant] = recorder.summary(time.perf_counter() - start)[label]
+    return report
+
+
+def run_flash_sale(product_id, cart_ids, concurrency):
+    """every cart tries to hold one unit of the product at once, spread over concurrency threads
+
+    returns the summary, with a 'held' and a 'sold out' row, and the wall time.
+    """
+    from .holds import hold
+
+    recorder = Recorder()
+    start = threading.Barrier(concurrency)
+
+    def buyer(worker):
+        start.wait()
+        try:
+            for cart_id in cart_ids[worker::concurrency]:
+                began = time.perf_counter()
+                try:
+                    short = hold(Cart(pk=cart_id), {product_id: 1})
+                except DatabaseError:
+                    recorder.add('error', time.perf_counter() - began, 500, None)
+                    continue
+                recorder.add('sold out' if short else 'held', time.perf_counter() - began, 200, None)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=buyer, args=(i,)) for i in range(concurrency)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - began
+    return recorder.summary(wall), wall
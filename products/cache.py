@@ -0,0 +1,225 @@
+"""read-through response cache for the product list and detail endpoints
+
+every entry remembers the version tokens it was built under: the catalogue
+or category scope it was listed from and the products it shows. a write only
+replaces the tokens of the product it touched and of its category, so entries
+that never showed that product stay valid. a missing token is created fresh,
+which makes an evicted token invalidate its entries instead of reviving them.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+
+from KaraKata.db import config as replica_config, used_replica
+
+# every entry depends on ALL, unfiltered lists on CATALOGUE as well
+ALL = 'all'
+CATALOGUE = 'catalogue'
+# the category tree and its product figures
+CATEGORIES = 'categories'
+
+
+def new_token():
+    return os.urandom(8).hex()
+
+
+class ResponseCache:
+    """response data stored with the version tokens it depends on"""
+
+    def __init__(self, backend, timeout=300, prefix='products'):
+        self.backend = backend
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def version_key(self, scope):
+        return f'{self.prefix}:v:{scope}'
+
+    def versions(self, scopes):
+        """current token of every scope, creating the missing ones"""
+        keys = {self.version_key(scope): scope for scope in scopes}
+        found = self.backend.get_many(list(keys))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            for key in missing:
+                self.backend.add(key, new_token(), None)
+            # another process may have added the token first
+            found.update(self.backend.get_many(missing))
+        return {keys[key]: token for key, token in found.items()}
+
+    def bump(self, scopes):
+        self.backend.set_many({self.version_key(scope): new_token() for scope in scopes}, None)
+
+    def get(self, key):
+        """(etag, data) stored under key if none of its scopes moved since, else None"""
+        entry = self.backend.get(f'{self.prefix}:r:{key}')
+        if entry is None:
+            return None
+        depends, etag, data = entry
+        if self.versions(depends) != depends:
+            return None
+        return etag, data
+
+    def set(self, key, data, depends, timeout=None):
+        """stores data under key, depends maps each scope to the token read before the data was built"""
+        etag = '"%s"' % hashlib.sha1(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+        self.backend.set(f'{self.prefix}:r:{key}', (depends, etag, data), self.timeout if timeout is None else timeout)
+        return etag
+
+    def clear(self):
+        self.backend.clear()
+
+
+_cache = None
+
+
+def get_response_cache():
+    """the ResponseCache configured by the PRODUCT_CACHE setting
+
+    BACKEND is the dotted path of a cache class built with OPTIONS, or
+    CACHE_ALIAS names one of the CACHES to share entries between processes.
+    """
+    global _cache
+    if _cache is None:
+        config = getattr(settings, 'PRODUCT_CACHE', {})
+        if 'CACHE_ALIAS' in config:
+            backend = caches[config['CACHE_ALIAS']]
+        else:
+            backend = import_string(config.get('BACKEND', 'KaraKata.cache.LocalLRUCache'))(**config.get('OPTIONS', {}))
+        _cache = ResponseCache(backend, config.get('TIMEOUT', 300))
+    return _cache
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def category_scope(category_id):
+    return f'category:{category_id}'
+
+
+def invalidate(scopes):
+    """bumps scopes now and again on commit
+
+    a request reading between the write and the commit caches the old rows
+    under the new tokens, the second bump drops that entry.
+    """
+    scopes = list(scopes)
+    cache = get_response_cache()
+    cache.bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: cache.bump(scopes))
+
+
+def invalidate_products(products):
+    """after products were created, changed or deleted
+
+    the product's own token drops every entry showing it. the category and
+    catalogue tokens drop the lists it may have just entered, lists it left
+    still showed it and went with its own token.
+    """
+    scopes = {CATALOGUE}
+    for product in products:
+        scopes.add(product_scope(product.id))
+        scopes.add(category_scope(product.category_id))
+    invalidate(scopes)
+
+
+def invalidate_product_ids(product_ids):
+    """after a change that cannot move a product between lists, like a stock update"""
+    invalidate(product_scope(pid) for pid in product_ids)
+
+
+def invalidate_categories():
+    """after the category tree or a category's product figures changed"""
+    invalidate([CATEGORIES])
+
+
+def invalidate_all():
+    """after bulk writes that skip the product signals"""
+    invalidate([ALL])
+
+
+class CachedResponseMixin:
+    """serves list and retrieve from the ResponseCache with ETag revalidation
+
+    product responses do not depend on who asks, so every caller shares the
+    entries. a matching If-None-Match gets a 304 from the stored etag without
+    touching the database or the serializer. the scope hooks default to the
+    product scopes, other viewsets override them.
+    """
+    # sent with every cached response when set, lets shared caches keep them too
+    cache_control = None
+
+    def list(self, request, *args, **kwargs):
+        key = self.response_cache_key(request, 'list', self.cache_query_params())
+        return self.cached_response(key, self.list_cache_scopes(request), super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        key = self.response_cache_key(request, f'detail:{pk}', ())
+        return self.cached_response(key, self.detail_cache_scopes(pk), super().retrieve, request, *args, **kwargs)
+
+    def list_cache_scopes(self, request):
+        category = request.query_params.get('category')
+        return [ALL, category_scope(category) if category else CATALOGUE]
+
+    def detail_cache_scopes(self, pk):
+        return [ALL, product_scope(pk)]
+
+    def row_cache_scopes(self, data):
+        """scopes of the rows a response shows"""
+        return [product_scope(row['id']) for row in data.get('results', [data])]
+
+    def cache_query_params(self):
+        """the query params that change a list response, the rest are left out of the key"""
+        params = {self.paginator.cursor_query_param, self.paginator.page_size_query_param}
+        if self.filterset_class is not None:
+            params.update(self.filterset_class.base_filters)
+        for backend in self.filter_backends:
+            params.update(getattr(backend, name) for name in ('search_param', 'ordering_param') if hasattr(backend, name))
+        return params
+
+    def response_cache_key(self, request, name, query_params):
+        params = sorted(
+            (param, value)
+            for param, values in request.query_params.lists() if param in query_params
+            for value in values if value != ''
+        )
+        # the host goes in too, next links and image urls are absolute
+        raw = json.dumps([request.scheme, request.get_host(), request.path, params])
+        return f"{name}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+    def cached_response(self, key, scopes, render, request, *args, **kwargs):
+        cache = get_response_cache()
+        hit = cache.get(key)
+        if hit is not None:
+            etag, data = hit
+            return self.conditional_response(request, etag, data, 'HIT')
+
+        # tokens are read before the queries run so a write racing the build is not missed
+        depends = cache.versions(scopes)
+        response = render(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        depends.update(cache.versions(self.row_cache_scopes(response.data)))
+        # a lagging replica can miss a write whose tokens were already bumped, so its entries only live as long as the lag
+        etag = cache.set(key, response.data, depends, replica_config()['MAX_LAG'] if used_replica() else None)
+        return self.conditional_response(request, etag, response.data, 'MISS')
+
+    def conditional_response(self, request, etag, data, state):
+        headers = {'ETag': etag, 'X-Cache': state}
+        if self.cache_control:
+            headers['Cache-Control'] = self.cache_control
+        client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in client_etags or '*' in client_etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
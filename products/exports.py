@@ -0,0 +1,118 @@
+"""streaming exports of a vendor's orders, order items and product sales
+
+rows come from .values() querysets read with iterator(), so memory stays flat
+however long the history, and the header is sent before the query runs.
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+
+from .models import OrderItem
+
+CHUNK_SIZE = 2000
+# rows per yielded piece of output, one per row would make the response crawl
+ROWS_PER_WRITE = 500
+
+CENTS = Decimal('0.01')
+
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def vendor_items(vendor_email, start=None, end=None):
+    """the vendor's order lines, optionally only of orders placed in [start, end)"""
+    items = OrderItem.objects.filter(vendor=vendor_email)
+    if start is not None:
+        items = items.filter(order__created_at__gte=start)
+    if end is not None:
+        items = items.filter(order__created_at__lt=end)
+    return items
+
+
+def order_rows(items):
+    """one row per order with the vendor's share of it, cancelled lines left out of the figures"""
+    active = ~Q(status='cancelled')
+    return (
+        items.values(
+            'order_id', created_at=F('order__created_at'), customer=F('order__user__email'),
+            order_status=F('order__status'), is_paid=F('order__is_paid'), paid_at=F('order__paid_at'),
+        )
+        .annotate(lines=Count('id', filter=active), units=Sum('quantity', filter=active, default=0), subtotal=Sum(LINE_TOTAL, filter=active, default=0))
+        .order_by('order__created_at', 'order')
+    )
+
+
+def item_rows(items):
+    """one row per order line"""
+    return items.values(
+        'id', 'order_id', 'product_id', 'quantity', 'price', 'status',
+        created_at=F('order__created_at'), is_paid=F('order__is_paid'), product_name=F('product__name'), line_total=LINE_TOTAL,
+    ).order_by('id')
+
+
+def sales_rows(items):
+    """one row per product with paid units and revenue, cancelled lines sold nothing"""
+    return (
+        items.filter(order__is_paid=True).exclude(status='cancelled')
+        .values('product_id', product_name=F('product__name'))
+        .annotate(orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum(LINE_TOTAL))
+        .order_by('product_id')
+    )
+
+
+EXPORTS = {
+    'orders': (order_rows, ['order_id', 'created_at', 'customer', 'order_status', 'is_paid', 'paid_at', 'lines', 'units', 'subtotal']),
+    'items': (item_rows, ['id', 'order_id', 'created_at', 'is_paid', 'product_id', 'product_name', 'quantity', 'price', 'line_total', 'status']),
+    'sales': (sales_rows, ['product_id', 'product_name', 'orders', 'units', 'revenue']),
+}
+
+
+def cells(columns, row):
+    # sqlite hands back computed amounts unquantized, 200 instead of 200.00
+    return [row[column].quantize(CENTS) if isinstance(row[column], Decimal) else row[column] for column in columns]
+
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(columns)
+    yield flush()
+    for n, row in enumerate(rows, 1):
+        writer.writerow(cells(columns, row))
+        if n % ROWS_PER_WRITE == 0:
+            yield flush()
+    yield flush()
+
+
+def ndjson_lines(columns, rows):
+    buffer = []
+    for row in rows:
+        buffer.append(json.dumps(dict(zip(columns, cells(columns, row))), cls=DjangoJSONEncoder))
+        if len(buffer) == ROWS_PER_WRITE:
+            yield '\n'.join(buffer) + '\n'
+            buffer = []
+    if buffer:
+        yield '\n'.join(buffer) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+
+def export_lines(kind, fmt, queryset):
+    """the output of an export, lazily, the query only starts after the first piece is taken"""
+    build, columns = EXPORTS[kind]
+    write, _ = FORMATS[fmt]
+    return write(columns, build(queryset).iterator(chunk_size=CHUNK_SIZE))
@@ -0,0 +1,112 @@
+"""soft stock holds for carts and unpaid orders
+
+adding a product to a cart, or raising its line, holds the units for TTL
+seconds so two buyers can not both count on the last ones. a hold is one
+StockHold row per cart or order and product. the available stock of a product
+is its stock minus the holds not yet expired, one aggregate over the
+(product, expires_at, quantity) index. holds stop counting the moment they
+expire, the sweeper only deletes them to keep the table small. checkout moves
+a cart's holds to its order and the payment turns them into the sale.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockHold
+
+
+def config():
+    return {'TTL': 900, 'ORDER_TTL': 1800, 'SWEEP_BATCH_SIZE': 1000, **getattr(settings, 'STOCK_HOLDS', {})}
+
+
+def held(condition=Q(), now=None):
+    """units held of the product OuterRef('id') points at by the active holds matching condition"""
+    holds = (
+        StockHold.objects.filter(condition, product_id=OuterRef('id'), expires_at__gt=now or timezone.now())
+        .values('product_id').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(holds, output_field=IntegerField()), 0)
+
+
+def available(product_ids):
+    """{product_id: stock less the units held}, in one query"""
+    return dict(Product.objects.filter(id__in=list(product_ids)).annotate(free=F('stock') - held()).values_list('id', 'free'))
+
+
+def hold(cart, quantities, shrinking=()):
+    """sets the cart's holds to {product_id: quantity}, 0 drops one, returns the product ids that did not fit
+
+    a line only needs free stock for the units its active hold does not cover
+    yet. the product rows are locked in id order while the holds are summed,
+    so two carts can not both take the last units. when a line does not fit
+    nothing is written, except that lines listed in shrinking never fail, a
+    cart line going down keeps whatever hold it still has.
+    """
+    if not quantities:
+        return []
+    now = timezone.now()
+    mine = Q(cart=cart)
+    figures = Product.objects.filter(id__in=sorted(quantities)).order_by('id').annotate(others=held(~mine, now), mine=held(mine, now))
+    # sold out lines are turned away on a plain read, so in a flash sale only
+    # the buyers that may still get units queue for the write lock
+    short = sorted(
+        product_id for product_id, stock, others, current in figures.values_list('id', 'stock', 'others', 'mine')
+        if product_id not in shrinking and quantities[product_id] > max(current, stock - others)
+    )
+    if short:
+        return short
+    with transaction.atomic():
+        rows = figures.select_for_update().values_list('id', 'stock', 'others', 'mine')
+        expires_at = now + timedelta(seconds=config()['TTL'])
+        short, writes, drops = [], [], []
+        found = set()
+        for product_id, stock, others, current in rows:
+            found.add(product_id)
+            quantity = quantities[product_id]
+            if quantity == 0:
+                drops.append(product_id)
+            elif quantity == current:
+                continue
+            elif quantity < current or quantity <= stock - others:
+                writes.append(StockHold(cart=cart, product_id=product_id, quantity=quantity, expires_at=expires_at))
+            elif product_id not in shrinking:
+                short.append(product_id)
+        short += [product_id for product_id in quantities if product_id not in found]
+        if short:
+            return sorted(short)
+        if drops:
+            StockHold.objects.filter(cart=cart, product_id__in=drops).delete()
+        StockHold.objects.bulk_create(writes, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity', 'expires_at'])
+    return []
+
+
+def check_out(cart, order):
+    """moves the cart's active holds to order, for ORDER_TTL seconds from now"""
+    now = timezone.now()
+    StockHold.objects.filter(cart=cart, expires_at__gt=now).update(
+        cart=None, order=order, expires_at=now + timedelta(seconds=config()['ORDER_TTL']))
+
+
+def release(order, product_ids=None):
+    """drops the holds of an order that was paid or cancelled, or of its cancelled lines of product_ids"""
+    order_holds = StockHold.objects.filter(order=order)
+    if product_ids is not None:
+        order_holds = order_holds.filter(product_id__in=list(product_ids))
+    order_holds.delete()
+
+
+def sweep(batch_size=None):
+    """deletes the expired holds a batch at a time, returns how many went"""
+    batch_size = batch_size or config()['SWEEP_BATCH_SIZE']
+    now = timezone.now()
+    swept = 0
+    while True:
+        # short batches keep each delete, and the lock it takes, brief
+        ids = list(StockHold.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return swept
+        swept += StockHold.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,131 @@
+"""Idempotency-Key replays for the endpoints mobile clients retry
+
+a POST sent with an Idempotency-Key header claims an IdempotencyKey row for
+(user, key) in the same transaction as the view, the response is stored on it
+and later requests with the key get it back without the view running again.
+a duplicate sent while the first is still running blocks on the unique row
+until that one commits, then replays it, or takes the key over if it rolled
+back. a key reused for a different request is refused. keys live for TTL
+seconds, purge() deletes them afterwards.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def config():
+    return {'TTL': 86400, 'PURGE_BATCH_SIZE': 1000, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def fingerprint(request):
+    """sha256 of what makes two requests the same one"""
+    digest = hashlib.sha256()
+    for part in (request.method.encode(), request.get_full_path().encode(), request.body):
+        digest.update(part)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def claim(user, key, signature):
+    """(row, True) when the key is free to run the view under, (stored row, False) when it was used
+
+    must run in a transaction, the row stays locked until it ends.
+    """
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=config()['TTL'])
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=signature, expires_at=expires_at), True
+    except IntegrityError:
+        pass
+    # the insert waited for the first request to commit, its row is read locked
+    entry = IdempotencyKey.objects.select_for_update().get(user=user, key=key)
+    if entry.expires_at > now:
+        return entry, False
+    # an expired key not purged yet counts as a new one
+    entry.fingerprint, entry.status_code, entry.body, entry.expires_at = signature, None, '', expires_at
+    entry.save(update_fields=['fingerprint', 'status_code', 'body', 'expires_at'])
+    return entry, True
+
+
+def replayed(response):
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def run_once(request, key, run):
+    """(data, status, replayed) of run(), which returns (data, status), or of its first run under key
+
+    the key is claimed, run() called and its result stored in one transaction.
+    async views call this through sync_to_async, with a sync run().
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        return {'error': f'{HEADER} is longer than {MAX_KEY_LENGTH} characters'}, status.HTTP_400_BAD_REQUEST, False
+    signature = fingerprint(request)
+    with transaction.atomic():
+        entry, fresh = claim(request.user, key, signature)
+        if not fresh:
+            if entry.fingerprint != signature:
+                return {'error': f'{HEADER} was already used for a different request'}, status.HTTP_422_UNPROCESSABLE_ENTITY, False
+            return json.loads(entry.body), entry.status_code, True
+
+        data, code = run()
+        if code >= 500:
+            entry.delete()
+        else:
+            entry.status_code = code
+            entry.body = json.dumps(data, cls=JSONEncoder)
+            entry.save(update_fields=['status_code', 'body'])
+    return data, code, False
+
+
+def idempotent(handler):
+    """makes a DRF handler method replay its first response to requests repeating its Idempotency-Key
+
+    requests without the header run as before. server errors are not stored,
+    the key is given back so the client can retry with it.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+
+        responses = []
+
+        def run():
+            responses.append(handler(view, request, *args, **kwargs))
+            return responses[0].data, responses[0].status_code
+
+        data, code, was_replayed = run_once(request, key, run)
+        if responses:
+            return responses[0]
+        response = Response(data, status=code)
+        return replayed(response) if was_replayed else response
+    return wrapper
+
+
+def purge(batch_size=None):
+    """deletes the expired keys a batch at a time, returns how many went"""
+    batch_size = batch_size or config()['PURGE_BATCH_SIZE']
+    now = timezone.now()
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,149 @@
+"""resized derivatives of Product.image
+
+every upload gets a thumbnail, card and zoom size in WebP, and AVIF as well
+when Pillow was built with it. derivatives are named after the sha256 of the
+source bytes, so they can be cached forever and two uploads of the same file
+share them. they are made in a thread pool after the upload commits, or the
+first time a product is serialized without them, never in the request thread.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+# name -> longest side in pixels, images are never scaled up
+VARIANTS = {
+    'thumbnail': 160,
+    'card': 480,
+    'zoom': 1600,
+}
+
+VARIANT_DIR = 'products/variants'
+
+
+def formats():
+    """(format, extension, save options) Pillow can write here"""
+    available = [('WEBP', 'webp', {'quality': 80, 'method': 4})]
+    if features.check('avif'):
+        available.append(('AVIF', 'avif', {'quality': 50}))
+    return available
+
+
+def is_current(product):
+    """whether product.image_variants were made from its current image"""
+    return bool(product.image) and product.image_variants.get('source') == product.image.name
+
+
+def render_variants(source):
+    """{variant: {extension: storage name}} for the image stored under source"""
+    with default_storage.open(source, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    variants = {}
+    for variant, size in VARIANTS.items():
+        resized = None
+        variants[variant] = {}
+        for fmt, extension, options in formats():
+            name = f'{VARIANT_DIR}/{digest}-{variant}.{extension}'
+            if not default_storage.exists(name):
+                if resized is None:
+                    resized = image.copy()
+                    resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+                out = BytesIO()
+                resized.save(out, fmt, **options)
+                name = default_storage.save(name, ContentFile(out.getvalue()))
+            variants[variant][extension] = name
+    return variants
+
+
+def build_variants(product_id, source):
+    """makes the derivatives of source and records them on the product if it still has that image"""
+    from .cache import invalidate_product_ids
+    from .models import Product
+
+    variants = render_variants(source)
+    updated = Product.objects.filter(pk=product_id, image=source).update(image_variants={'source': source, 'variants': variants})
+    if updated:
+        # the update skips the product signals
+        invalidate_product_ids([product_id])
+    return variants
+
+
+class VariantPool:
+    """thread pool that builds derivatives once per (product, image) at a time
+
+    PRODUCT_IMAGE_WORKERS sets the pool size, 0 builds in the calling thread,
+    which the tests and the backfill command use.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.executor = None
+
+    def submit(self, product_id, source):
+        key = (product_id, source)
+        with self.lock:
+            if key in self.pending:
+                return
+            self.pending.add(key)
+        workers = getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2)
+        if not workers:
+            self.run(key)
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='product-images')
+        self.executor.submit(self.run_in_worker, key)
+
+    def run(self, key):
+        try:
+            build_variants(*key)
+        except Exception:
+            logger.exception("building image variants of product %s from %s failed", *key)
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def run_in_worker(self, key):
+        try:
+            self.run(key)
+        finally:
+            connections.close_all()
+
+
+pool = VariantPool()
+
+
+def schedule(product):
+    """queues the derivatives of product.image once the current transaction commits"""
+    if not product.image or is_current(product):
+        return
+    product_id, source = product.pk, product.image.name
+    transaction.on_commit(lambda: pool.submit(product_id, source))
+
+
+def variant_urls(product, build_url=None, schedule_missing=True):
+    """{variant: {extension: url}}, empty until the derivatives of the current image exist"""
+    if not is_current(product):
+        if schedule_missing:
+            schedule(product)
+        return {}
+    build_url = build_url or (lambda url: url)
+    return {
+        variant: {extension: build_url(default_storage.url(name)) for extension, name in names.items()}
+        for variant, names in product.image_variants['variants'].items()
+    }
@@ -0,0 +1,239 @@
+"""bulk product import for vendors, from csv or ndjson
+
+rows are parsed lazily and handled a chunk at a time, so memory depends on the
+chunk size and not on the file. a row updates the vendor's product with the
+same sku, else the one with the same slug, else creates a product. each chunk
+costs a fixed number of queries: existing skus, existing slugs, slug
+allocation for new rows, then one upsert per key and one ledger insert for
+the stock changes.
+"""
+import csv
+import io
+import json
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from . import inventory, summaries
+from .cache import invalidate_products
+from .models import Category, Product
+from .search import get_search_index
+from .slugs import assign_slugs
+
+CHUNK_SIZE = 1000
+# errors kept in the report, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+COLUMNS = ['sku', 'slug', 'name', 'description', 'price', 'stock', 'category']
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'category']
+
+
+class ProductRowSerializer(serializers.Serializer):
+    """one import row, category is a category slug"""
+    sku = serializers.CharField(max_length=64, required=False, allow_blank=True, allow_null=True)
+    slug = serializers.SlugField(required=False, allow_blank=True, allow_null=True)
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(allow_blank=True, required=False, default='')
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock = serializers.IntegerField(min_value=0, required=False, default=0)
+    category = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+def parse_rows(stream, fmt):
+    """(line number, row dict or None if unreadable) for every row of a text stream
+
+    a file that is not utf-8, or csv quoting that breaks, can not be read any
+    further, the line where reading stopped is reported unreadable and the
+    rows before it are still imported.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except (UnicodeDecodeError, csv.Error):
+                yield reader.line_num + 1, None
+                return
+            yield reader.line_num, row
+    line_num = 0
+    try:
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        yield line_num + 1, None
+
+
+def text_stream(binary):
+    """a text view of an uploaded or opened binary file, read as it is iterated"""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []  # (line, errors), the first MAX_REPORTED_ERRORS only
+
+    def error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': [{'line': line, 'errors': errors} for line, errors in self.errors],
+        }
+
+
+class ProductImporter:
+    """upserts rows into one vendor's catalogue"""
+
+    def __init__(self, vendor, chunk_size=CHUNK_SIZE):
+        self.vendor = vendor
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+        self.categories = {}  # slug -> id, categories are few so they are kept for the whole import
+        # one instance validates every row, building the fields per row costs more than the checks
+        self.row_serializer = ProductRowSerializer()
+        self.touched_categories = set()
+
+    def run(self, rows):
+        chunk = []
+        for line, row in rows:
+            chunk.append((line, row))
+            if len(chunk) == self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        # once at the end, per chunk a big category would be aggregated over and over
+        summaries.refresh(self.touched_categories)
+        return self.report
+
+    def validate(self, chunk):
+        valid = {}
+        for line, row in chunk:
+            if row is None:
+                self.report.error(line, {'row': ['Could not be parsed']})
+                continue
+            try:
+                data = self.row_serializer.run_validation({key: value for key, value in row.items() if key in COLUMNS})
+            except serializers.ValidationError as error:
+                self.report.error(line, error.detail)
+                continue
+            # a row repeated within a chunk replaces the earlier one
+            key = ('sku', data['sku']) if data.get('sku') else ('slug', data['slug']) if data.get('slug') else ('line', line)
+            valid.pop(key, None)
+            valid[key] = (line, data)
+        return list(valid.values())
+
+    def resolve_categories(self, rows):
+        wanted = {data['category'] for _, data in rows if data.get('category')} - set(self.categories)
+        if wanted:
+            self.categories.update(Category.objects.filter(slug__in=wanted).values_list('slug', 'id'))
+        resolved = []
+        for line, data in rows:
+            slug = data.get('category')
+            if slug and slug not in self.categories:
+                self.report.error(line, {'category': [f'Unknown category {slug}']})
+                continue
+            resolved.append((line, data, self.categories.get(slug) if slug else None))
+        return resolved
+
+    def import_chunk(self, chunk):
+        rows = self.resolve_categories(self.validate(chunk))
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    created, updated, products, categories = self.write(rows)
+                    # bulk writes skip the product signals, and inside the block
+                    # the fts index takes one commit per chunk instead of one per row
+                    get_search_index().update(products)
+                    invalidate_products(products)
+                break
+            except IntegrityError:
+                # a concurrent write took one of the new slugs, the retry reads them again
+                if attempt:
+                    for line, _, _ in rows:
+                        self.report.error(line, {'row': ['Conflicted with a concurrent write, retry the import']})
+                    return
+        self.report.created += created
+        self.report.updated += updated
+        self.touched_categories |= categories
+
+    def write(self, rows):
+        skus = {data['sku'] for _, data, _ in rows if data.get('sku')}
+        slugs = {data['slug'] for _, data, _ in rows if data.get('slug')}
+        by_sku = {sku: (slug, category_id, stock) for sku, slug, category_id, stock in
+                  Product.objects.filter(vendor=self.vendor, sku__in=skus).values_list('sku', 'slug', 'category_id', 'stock')}
+        by_slug = {slug: (vendor_id, category_id, stock) for slug, vendor_id, category_id, stock in
+                   Product.objects.filter(slug__in=slugs).values_list('slug', 'vendor_id', 'category_id', 'stock')}
+
+        sku_upserts, slug_upserts, inserts = [], [], []
+        created = updated = 0
+        # the summaries of categories products entered and left
+        categories = set()
+        # slug -> stock before the import, for the ledger
+        previous_stock = {}
+        for line, data, category_id in rows:
+            product = Product(
+                vendor=self.vendor, sku=data.get('sku') or None, slug=data.get('slug') or '', name=data['name'],
+                description=data['description'], price=data['price'], stock=data['stock'], category_id=category_id,
+            )
+            if product.sku and product.sku in by_sku:
+                # slugs are urls, an update keeps the one the product has
+                product.slug, previous_category, previous_stock[product.slug] = by_sku[product.sku]
+                categories.add(previous_category)
+                sku_upserts.append(product)
+                updated += 1
+            elif product.slug and product.slug in by_slug:
+                vendor_id, previous_category, stock = by_slug[product.slug]
+                if vendor_id != self.vendor.id:
+                    self.report.error(line, {'slug': ['Slug belongs to another vendor']})
+                    continue
+                categories.add(previous_category)
+                previous_stock[product.slug] = stock
+                slug_upserts.append(product)
+                updated += 1
+            else:
+                inserts.append(product)
+                created += 1
+            categories.add(category_id)
+
+        assign_slugs(Product, inserts)
+        # the upserts still hold if the row appeared or changed key since the reads above
+        Product.objects.bulk_create(sku_upserts, update_conflicts=True, unique_fields=['vendor', 'sku'], update_fields=UPDATE_FIELDS)
+        Product.objects.bulk_create(slug_upserts, update_conflicts=True, unique_fields=['slug'], update_fields=UPDATE_FIELDS)
+        Product.objects.bulk_create(inserts)
+
+        written = Q(slug__in=[p.slug for p in sku_upserts + slug_upserts + inserts])
+        products = list(Product.objects.filter(written, vendor=self.vendor).only('id', 'slug', 'name', 'description', 'stock', 'category_id'))
+        inventory.record_vendor_changes({p.id: p.stock - previous_stock.get(p.slug, 0) for p in products})
+        return created, updated, products, categories
+
+
+def export_rows(vendor):
+    """the vendor's products in the import columns, ready for exports.FORMATS writers"""
+    rows = (
+        Product.objects.filter(vendor=vendor)
+        .values('sku', 'slug', 'name', 'description', 'price', 'stock', 'category__slug')
+        .order_by('id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    # an annotation can not be called category, that is the foreign key's name
+    for row in rows:
+        row['category'] = row.pop('category__slug')
+        yield row
@@ -0,0 +1,143 @@
+"""the inventory ledger, why Product.stock moved
+
+Product.stock stays the counter that reservations decrement, every change to
+it also appends an InventoryEvent in the same transaction, in bulk. the
+ledger stock of a product is the sum of its events. InventorySnapshot holds
+that sum up to an event id, so reads add the snapshot to the events after it,
+a short range of the (product, id) index that compact() keeps short, and never
+go through the whole history.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, PositiveIntegerField, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import summaries
+from .cache import invalidate_product_ids
+from .models import InventoryEvent, InventorySnapshot, Order, Product
+
+BATCH_SIZE = 1000
+# events younger than this stay out of snapshots, where ids are handed out
+# before commit a transaction still open may yet add one below the newest id
+SETTLE_SECONDS = 60
+
+# events a product's snapshot does not cover yet
+AFTER_SNAPSHOT = Q(product__inventory_snapshot__isnull=True) | Q(id__gt=F('product__inventory_snapshot__last_event_id'))
+
+
+def record(kind, changes, order=None):
+    """appends one event of kind per {product_id: signed quantity}, zero changes are skipped"""
+    return InventoryEvent.objects.bulk_create([
+        InventoryEvent(product_id=product_id, kind=kind, quantity=quantity, order=order)
+        for product_id, quantity in changes.items() if quantity
+    ], batch_size=BATCH_SIZE)
+
+
+def record_vendor_changes(changes):
+    """stock set by a vendor, {product_id: signed change}, added units are restocks and removed ones adjustments"""
+    return InventoryEvent.objects.bulk_create([
+        InventoryEvent(product_id=product_id, kind=InventoryEvent.RESTOCK if quantity > 0 else InventoryEvent.ADJUSTMENT, quantity=quantity)
+        for product_id, quantity in changes.items() if quantity
+    ], batch_size=BATCH_SIZE)
+
+
+def ledger_stock():
+    """expression for the ledger stock of each product of a Product queryset, its snapshot plus the events after it"""
+    pending = (
+        InventoryEvent.objects.filter(product_id=OuterRef('id'), id__gt=Coalesce(OuterRef('inventory_snapshot__last_event_id'), 0))
+        .values('product_id').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(F('inventory_snapshot__stock'), 0) + Coalesce(Subquery(pending, output_field=IntegerField()), 0)
+
+
+def stock_levels(product_ids):
+    """{product_id: ledger stock} in one query"""
+    return dict(Product.objects.filter(id__in=list(product_ids)).annotate(ledger=ledger_stock()).values_list('id', 'ledger'))
+
+
+def vendor_stock(vendor):
+    """units the ledger says the vendor holds over all of their products"""
+    snapshots = Product.objects.filter(vendor=vendor).aggregate(total=Coalesce(Sum('inventory_snapshot__stock'), 0))['total']
+    pending = InventoryEvent.objects.filter(AFTER_SNAPSHOT, product__vendor=vendor).aggregate(total=Coalesce(Sum('quantity'), 0))['total']
+    return snapshots + pending
+
+
+def compact(batch_size=BATCH_SIZE):
+    """moves every snapshot forward over the settled events after it, returns how many moved
+
+    a batch of products costs one grouped aggregate and one upsert, and the
+    events stay in the ledger, only what reads have to add up shrinks.
+    """
+    cutoff = timezone.now() - timedelta(seconds=SETTLE_SECONDS)
+    # newest events first on the primary key, only the unsettled tail is skipped
+    horizon = InventoryEvent.objects.filter(created_at__lte=cutoff).order_by('-id').values_list('id', flat=True).first()
+    if horizon is None:
+        return 0
+
+    moved = 0
+    last_id = 0
+    while True:
+        ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return moved
+        last_id = ids[-1]
+        with transaction.atomic():
+            rows = list(
+                InventoryEvent.objects.filter(AFTER_SNAPSHOT, product_id__in=ids, id__lte=horizon)
+                .values('product_id').annotate(change=Sum('quantity')).order_by()
+            )
+            if not rows:
+                continue
+            previous = dict(InventorySnapshot.objects.filter(product_id__in=[row['product_id'] for row in rows]).values_list('product_id', 'stock'))
+            now = timezone.now()
+            InventorySnapshot.objects.bulk_create([
+                InventorySnapshot(product_id=row['product_id'], stock=previous.get(row['product_id'], 0) + row['change'], last_event_id=horizon, taken_at=now)
+                for row in rows
+            ], update_conflicts=True, unique_fields=['product'], update_fields=['stock', 'last_event_id', 'taken_at'])
+        moved += len(rows)
+
+
+def drift(product_ids):
+    """{product_id: Product.stock minus the ledger stock} for the products where the two disagree"""
+    return {
+        product_id: difference for product_id, difference in
+        Product.objects.filter(id__in=list(product_ids)).annotate(difference=F('stock') - ledger_stock())
+        .exclude(difference=0).values_list('id', 'difference')
+    }
+
+
+def held_by_order(order_id):
+    """{product_id: units} the order took with its sales and has not given back"""
+    rows = (
+        InventoryEvent.objects.filter(order_id=order_id, kind__in=[InventoryEvent.SALE, InventoryEvent.CANCELLATION])
+        .values('product_id').annotate(held=-Sum('quantity')).order_by()
+    )
+    return {row['product_id']: row['held'] for row in rows if row['held'] > 0}
+
+
+def release_order_stock(order, product_ids=None):
+    """gives the stock a cancelled order, or its lines of product_ids, took back to the products, once
+
+    the order row is locked so two cancellations can not both find the units
+    still held. returns {product_id: units released}.
+    """
+    with transaction.atomic():
+        Order.objects.select_for_update().filter(pk=order.pk).values_list('pk').first()
+        held = held_by_order(order.pk)
+        if product_ids is not None:
+            held = {product_id: units for product_id, units in held.items() if product_id in product_ids}
+        if not held:
+            return {}
+        product_ids = sorted(held)
+        locked = Product.objects.select_for_update().filter(id__in=product_ids).order_by('id').values_list('stock', 'category_id')
+        emptied = {category_id for stock, category_id in locked if stock == 0}
+        Product.objects.filter(id__in=product_ids).update(stock=Case(
+            *[When(id=product_id, then=F('stock') + held[product_id]) for product_id in product_ids],
+            default=F('stock'), output_field=PositiveIntegerField()))
+        record(InventoryEvent.CANCELLATION, held, order=order)
+        invalidate_product_ids(product_ids)
+        # products back in stock count again in their category summaries
+        summaries.refresh(emptied)
+    return held
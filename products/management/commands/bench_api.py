@@ -0,0 +1,73 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.benchmarks import SCENARIOS, ClientTransport, HttpTransport, run_scenario
+
+
+class Command(BaseCommand):
+    help = "Runs load scenarios against the API and reports latency percentiles, throughput and queries per request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"any of {', '.join(SCENARIOS)}, all by default")
+        parser.add_argument('--iterations', type=int, default=200, help="scenario runs per scenario")
+        parser.add_argument('--concurrency', type=int, default=4, help="virtual users running in parallel")
+        parser.add_argument('--base-url', help="benchmark a running server instead of the in-process test client")
+        parser.add_argument('--prefix', default='seed', help="email prefix used by seed_marketplace")
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', help="also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+        base_url = options['base_url']
+        make_transport = (lambda: HttpTransport(base_url)) if base_url else ClientTransport
+        users = {
+            role: [(f"{options['prefix']}-{role}-{i}@example.com", options['password']) for i in range(options['concurrency'])]
+            for role in ('customer', 'vendor')
+        }
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'commit': self.commit(),
+            'python': platform.python_version(),
+            'target': base_url or 'test client',
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'scenarios': {},
+        }
+        for name in names:
+            try:
+                summary, wall = run_scenario(name, make_transport, users, options['iterations'], options['concurrency'], options['seed'])
+            except RuntimeError as error:
+                raise CommandError(str(error))
+            report['scenarios'][name] = {'wall_seconds': round(wall, 3), 'requests': summary}
+            self.print_summary(name, wall, summary)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"results written to {options['json_path']}")
+
+    def print_summary(self, name, wall, summary):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{name} ({wall:.1f}s)"))
+        self.stdout.write(f"  {'request':<28}{'n':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}")
+        for label, row in summary.items():
+            queries = '-' if row['queries_per_request'] is None else row['queries_per_request']
+            self.stdout.write(
+                f"  {label:<28}{row['requests']:>6}{row['errors']:>5}{row['rps']:>9}"
+                f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{queries:>9}"
+            )
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
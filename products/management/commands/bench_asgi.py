@@ -0,0 +1,69 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from accounts.serializers import CustomTokenObtainPairSerializer
+from products import payments
+from products.benchmarks import compare_asgi
+from products.models import Cart, Category, Order, Product
+
+
+class Command(BaseCommand):
+    help = ("Sends the same load to the sync views and their async twins through the ASGI application "
+            "and reports both side by side. the sync product and category reads are served from the response "
+            "cache after the first request, the async ones read the database every time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="requests per view")
+        parser.add_argument('--concurrency', type=int, default=500, help="requests in flight at once")
+        parser.add_argument('--gateway-latency', type=float, default=0.2,
+                            help="seconds the fake payment gateway takes per call, 0 keeps the configured gateway")
+        parser.add_argument('--prefix', default='seed', help="email prefix used by seed_marketplace")
+        parser.add_argument('--json', dest='json_path', help="also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        customers = list(CustomUser.objects.filter(email__startswith=f"{options['prefix']}-customer-"))
+        product = Product.objects.order_by('id').first()
+        if not customers or product is None or not Category.objects.exists():
+            raise CommandError("nothing to read, seed the database with seed_marketplace first")
+        if options['gateway_latency']:
+            payments._gateway = payments.FakeGateway(latency=options['gateway_latency'])
+
+        users = [self.virtual_user(customer) for customer in customers]
+        anonymous = lambda path: [('GET', path, None, None)]
+        per_user = lambda build: [build(user) for user in users]
+        pairs = {
+            'product list': (anonymous('/api/products/'), anonymous('/api/async/products/')),
+            'product detail': (anonymous(f'/api/products/{product.id}/'), anonymous(f'/api/async/products/{product.id}/')),
+            'category list': (anonymous('/api/categories/'), anonymous('/api/async/categories/')),
+            'cart': (per_user(lambda u: ('GET', f"/api/cart/{u['cart']}/", None, u['token'])),
+                     per_user(lambda u: ('GET', f"/api/async/cart/{u['cart']}/", None, u['token']))),
+            'order history': (per_user(lambda u: ('GET', '/api/orders/', None, u['token'])),
+                              per_user(lambda u: ('GET', '/api/async/orders/', None, u['token']))),
+            'init payment': (per_user(lambda u: ('POST', f"/api/{u['order']}/init-payment/", None, u['token'])),
+                             per_user(lambda u: ('POST', f"/api/async/{u['order']}/init-payment/", None, u['token']))),
+        }
+        report = compare_asgi(pairs, options['requests'], options['concurrency'])
+
+        self.stdout.write(f"  {'request':<16}{'view':<7}{'n':>6}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+        for label, variants in report.items():
+            for variant, row in variants.items():
+                self.stdout.write(
+                    f"  {label:<16}{variant:<7}{row['requests']:>6}{row['errors']:>5}{row['rps']:>9}"
+                    f"{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+                )
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'requests': options['requests'], 'concurrency': options['concurrency'],
+                           'gateway_latency': options['gateway_latency'], 'views': report}, f, indent=2)
+            self.stdout.write(f"results written to {options['json_path']}")
+
+    def virtual_user(self, customer):
+        """a token, a cart and an unpaid order to initialize payments for"""
+        cart, _ = Cart.objects.get_or_create(user=customer)
+        order = Order.objects.filter(user=customer, is_paid=False).order_by('id').first()
+        if order is None:
+            order = Order.objects.create(user=customer, total=0)
+        token = CustomTokenObtainPairSerializer.get_token(customer).access_token
+        return {'token': str(token), 'cart': cart.id, 'order': order.id}
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from accounts.models import CustomUser
+from products.benchmarks import run_flash_sale
+from products.holds import available
+from products.models import Cart, Product, StockHold
+
+
+class Command(BaseCommand):
+    help = ("Simulates a flash sale, buyers each holding one unit of a product with few units at the same time, "
+            "and checks that no more units are held than there are")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=10000)
+        parser.add_argument('--units', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=64, help="threads the buyers are spread over")
+        parser.add_argument('--prefix', default='flash', help="email prefix of the buyers and vendor, their previous run is removed")
+        parser.add_argument('--keep', action='store_true', help="keep the buyers, carts and product afterwards")
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        CustomUser.objects.filter(email__startswith=f'{prefix}-').delete()
+        vendor = CustomUser.objects.create(email=f'{prefix}-vendor@example.com', role='vendor', password='!')
+        product = Product.objects.create(vendor=vendor, name='Flash sale', description='', price=1, stock=options['units'])
+        buyers = CustomUser.objects.bulk_create([
+            CustomUser(email=f'{prefix}-buyer-{i}@example.com', role='customer', password='!') for i in range(options['buyers'])
+        ], batch_size=1000)
+        carts = Cart.objects.bulk_create([Cart(user=buyer) for buyer in buyers], batch_size=1000)
+
+        try:
+            summary, wall = run_flash_sale(product.id, [cart.id for cart in carts], options['concurrency'])
+            held = StockHold.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+            self.stdout.write(f"{options['buyers']} buyers on {options['units']} units over {options['concurrency']} threads in {wall:.1f}s")
+            self.stdout.write(f"  {'outcome':<12}{'n':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+            for label, row in summary.items():
+                self.stdout.write(f"  {label:<12}{row['requests']:>7}{row['rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}")
+            self.stdout.write(f"units held {held}, available {available([product.id])[product.id]}")
+            if held > options['units']:
+                self.stdout.write(self.style.ERROR(f"oversold by {held - options['units']}"))
+            else:
+                self.stdout.write(self.style.SUCCESS("not oversold"))
+        finally:
+            if not options['keep']:
+                CustomUser.objects.filter(email__startswith=f'{prefix}-').delete()
@@ -0,0 +1,79 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from accounts.models import CustomUser
+from products.models import Product
+from products.pagination import KeysetPagination
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares OFFSET and keyset paging of the product list at increasing depths"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help="keep the seeded products instead of rolling back")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['rows'])
+                self.run(options['rows'], options['page_size'], options['repeat'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("seeded rows rolled back")
+
+    def seed(self, rows, batch=5000):
+        vendor, _ = CustomUser.objects.get_or_create(email='bench-vendor@example.com', defaults={'role': 'vendor'})
+        start = time.perf_counter()
+        for offset in range(0, rows, batch):
+            Product.objects.bulk_create([
+                Product(vendor=vendor, name=f'Bench product {i}', slug=f'bench-product-{i}', description='', price=Decimal(i % 1000), stock=1)
+                for i in range(offset, min(offset + batch, rows))
+            ])
+        self.stdout.write(f"seeded {rows} products in {time.perf_counter() - start:.1f}s")
+
+    def run(self, rows, page_size, repeat):
+        paginator = KeysetPagination()
+        ordering = paginator.ordering
+        factory = APIRequestFactory()
+        queryset = Product.objects.all()
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>10} {'keyset ms':>10}")
+        page = 1
+        while (page - 1) * page_size < rows:
+            offset = (page - 1) * page_size
+
+            offset_ms = self.timed(lambda: list(queryset.order_by(*ordering)[offset:offset + page_size]), repeat)
+
+            # the cursor a client would hold after reading the previous page
+            params = {'page_size': page_size}
+            if offset:
+                previous = queryset.order_by(*ordering).values(*[term.lstrip('-') for term in ordering])[offset - 1]
+                paginator.ordering_fields = ordering
+                params['cursor'] = paginator.encode_cursor(paginator.get_position(previous))
+            request = Request(factory.get('/api/products/', params))
+            keyset_ms = self.timed(lambda: KeysetPagination().paginate_queryset(queryset, request), repeat)
+
+            self.stdout.write(f"{page:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+            page *= 10
+
+    def timed(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import Order
+from products.seed import seed_marketplace
+from products.serializers import LeanOrderSerializer, OrderSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compares OrderSerializer with the lean order listing serializer, in ms per 1,000 orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--keep', action='store_true', help="keep the seeded orders instead of rolling back")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                # a few heavy buyers, like the order history pages this is for
+                seed_marketplace(vendors=5, products_per_vendor=200, customers=10, cart_lines=0,
+                                 orders_per_customer=max(options['orders'] // 10, 1),
+                                 items_per_order=options['items_per_order'], prefix='bench-serializers')
+                self.run(options['repeat'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("seeded rows rolled back")
+
+    def run(self, repeat, page_size=100):
+        ids = list(Order.objects.filter(user__email__startswith='bench-serializers-').order_by('id').values_list('id', flat=True))
+        # serialized a page at a time like the order list, pages of 100 are the most the API serves
+        pages = [Order.objects.filter(id__in=ids[i:i + page_size]) for i in range(0, len(ids), page_size)]
+
+        def current():
+            for page in pages:
+                OrderSerializer(page.select_related('shipping_address').prefetch_related('items__product'), many=True).data
+
+        def current_serialize_only():
+            for page in loaded:
+                OrderSerializer(page, many=True).data
+
+        def lean():
+            for page in pages:
+                LeanOrderSerializer().to_representation(page.values(*LeanOrderSerializer.columns()))
+
+        loaded = [list(page.select_related('shipping_address').prefetch_related('items__product')) for page in pages]
+        self.stdout.write(f"{len(ids)} orders in pages of {page_size}, ms per 1,000 orders, best of {repeat}")
+        for name, func in [('OrderSerializer with queries', current), ('OrderSerializer objects loaded', current_serialize_only),
+                           ('LeanOrderSerializer with queries', lean)]:
+            self.stdout.write(f"  {name:<34}{self.timed(func, repeat) * 1000 / len(ids):>10.2f}")
+
+    def timed(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
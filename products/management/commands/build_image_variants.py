@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from products.images import build_variants, is_current
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Makes the resized copies of product images that are missing or were made from an older image"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        built = failed = 0
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('id', 'image', 'image_variants')
+        for product in products.iterator(chunk_size=options['batch_size']):
+            if is_current(product):
+                continue
+            try:
+                build_variants(product.pk, product.image.name)
+                built += 1
+            except Exception as error:
+                failed += 1
+                self.stderr.write(f"product {product.pk}: {error}")
+        self.stdout.write(self.style.SUCCESS(f"built variants for {built} products, {failed} failed"))
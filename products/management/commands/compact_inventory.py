@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import inventory
+
+
+class Command(BaseCommand):
+    help = "Moves inventory snapshots forward over the settled ledger events, run it periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=inventory.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        moved = inventory.compact(options['batch_size'])
+        self.stdout.write(f"moved {moved} inventory snapshots")
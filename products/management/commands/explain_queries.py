@@ -0,0 +1,107 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from products.models import Category, Order, OrderItem, Product, Cart, CartItem
+from shipping.models import ShippingAddress
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Runs the main endpoints and prints the query plan of every SELECT they issue, flagging full table scans"
+
+    # small lookup tables where a scan is expected
+    scan_allowed = {'products_category', 'django_content_type'}
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fail-on-scan', action='store_true', help="exit with an error when a full scan is found")
+
+    def handle(self, *args, **options):
+        scans = []
+        try:
+            with transaction.atomic():
+                for name, queries in self.run_endpoints():
+                    self.stdout.write(self.style.MIGRATE_HEADING(name))
+                    for sql in queries:
+                        plan = self.explain(sql)
+                        flagged = [line for line in plan if self.is_full_scan(line)]
+                        scans += [(name, line) for line in flagged]
+                        self.stdout.write(f"  {sql[:160]}")
+                        for line in plan:
+                            style = self.style.ERROR if line in flagged else str
+                            self.stdout.write(style(f"    {line}"))
+                raise Rollback
+        except Rollback:
+            pass
+
+        if scans:
+            self.stdout.write(self.style.WARNING(f"{len(scans)} full scan(s) found"))
+            if options['fail_on_scan']:
+                raise CommandError("full table scans: " + "; ".join(f"{name}: {line}" for name, line in scans))
+        else:
+            self.stdout.write(self.style.SUCCESS("no full scans"))
+
+    def seed(self):
+        vendor = CustomUser.objects.create_user('explain-vendor@example.com', 'pass', role='vendor')
+        customer = CustomUser.objects.create_user('explain-customer@example.com', 'pass')
+        category = Category.objects.create(name='Explain', slug='explain-category')
+        product = Product.objects.create(vendor=vendor, category=category, name='Explain product', description='plan', price=Decimal('10.00'), stock=5)
+        address = ShippingAddress.objects.create(user=customer, full_name='Explain', phone='0', address_line='1', city='Lagos', state='Lagos', is_default=True)
+        cart = Cart.objects.create(user=customer)
+        CartItem.objects.create(cart=cart, product=product, quantity=1, price=product.price)
+        order = Order.objects.create(user=customer, shipping_address=address, total=product.price, is_paid=True)
+        OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price, vendor=vendor.email)
+        return vendor, customer, category, product
+
+    def run_endpoints(self):
+        vendor, customer, category, product = self.seed()
+        # any host that passes ALLOWED_HOSTS, django allows localhost when the list is empty
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        anonymous, as_customer, as_vendor = (APIClient(HTTP_HOST=host) for _ in range(3))
+        as_customer.force_authenticate(customer)
+        as_vendor.force_authenticate(vendor)
+
+        endpoints = [
+            ('product list', anonymous, '/api/products/'),
+            ('product list by price', anonymous, '/api/products/?ordering=price'),
+            ('product list filtered', anonymous, f'/api/products/?category={category.id}&min_price=1&max_price=100'),
+            ('product list by vendor', anonymous, f'/api/products/?vendor={vendor.id}&ordering=-price'),
+            ('product search', anonymous, '/api/products/?search=expl'),
+            ('product detail', anonymous, f'/api/products/{product.id}/'),
+            ('cart', as_customer, '/api/cart/'),
+            ('order history', as_customer, '/api/orders/'),
+            ('vendor order items', as_vendor, '/api/order-items/'),
+            ('vendor dashboard', as_vendor, '/api/vendor-dashboard/'),
+            ('addresses', as_customer, '/api/addresses/'),
+        ]
+        for name, client, url in endpoints:
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"{name}: GET {url} returned {response.status_code}")
+            yield name, [q['sql'] for q in ctx.captured_queries if q['sql'].lstrip().upper().startswith('SELECT')]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                return [row[-1] for row in cursor.fetchall()]
+            cursor.execute(f"EXPLAIN {sql}")
+            return [row[0] for row in cursor.fetchall()]
+
+    def is_full_scan(self, line):
+        if connection.vendor == 'sqlite':
+            # "SCAN t" reads the whole table, "SCAN t USING INDEX" walks an index in
+            # order and stops at the LIMIT, virtual tables are the search index
+            if not line.startswith('SCAN ') or ' USING ' in line or 'VIRTUAL TABLE' in line:
+                return False
+            return line.split()[1] not in self.scan_allowed
+        return 'Seq Scan' in line and not any(table in line for table in self.scan_allowed)
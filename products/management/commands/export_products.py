@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.exports import FORMATS
+from products.imports import COLUMNS, export_rows
+
+
+class Command(BaseCommand):
+    help = "Writes a vendor's products as csv or ndjson in the format import_products reads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor', help="email of the vendor")
+        parser.add_argument('path', nargs='?', default='-', help="file to write, - for stdout")
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+
+    def handle(self, *args, **options):
+        try:
+            vendor = get_user_model().objects.get(email=options['vendor'], role='vendor')
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"no vendor {options['vendor']}")
+        write, _ = FORMATS[options['format']]
+        lines = write(COLUMNS, export_rows(vendor))
+        if options['path'] == '-':
+            for piece in lines:
+                self.stdout.write(piece, ending='')
+            return
+        with open(options['path'], 'w', newline='', encoding='utf-8') as out:
+            out.writelines(lines)
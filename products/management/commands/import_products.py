@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from products.imports import CHUNK_SIZE, ProductImporter, parse_rows, text_stream
+
+
+class Command(BaseCommand):
+    help = "Upserts a vendor's products from a csv or ndjson file, by sku, then by slug"
+
+    def add_arguments(self, parser):
+        parser.add_argument('vendor', help="email of the vendor the products belong to")
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="read from the file extension by default")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            vendor = get_user_model().objects.get(email=options['vendor'], role='vendor')
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"no vendor {options['vendor']}")
+        fmt = options['format'] or os.path.splitext(options['path'])[1].lstrip('.')
+        if fmt not in ('csv', 'ndjson'):
+            raise CommandError("pass --format, the extension is neither csv nor ndjson")
+
+        start = time.perf_counter()
+        with open(options['path'], 'rb') as f:
+            report = ProductImporter(vendor, options['chunk_size']).run(parse_rows(text_stream(f), fmt))
+        for line, errors in report.errors:
+            self.stderr.write(f"line {line}: {errors}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... {report.error_count - len(report.errors)} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"created {report.created}, updated {report.updated}, {report.error_count} rows failed "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
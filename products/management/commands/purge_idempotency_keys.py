@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products import idempotency
+
+
+class Command(BaseCommand):
+    help = "Deletes expired idempotency keys in batches, run it periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="keys deleted per statement, IDEMPOTENCY['PURGE_BATCH_SIZE'] by default")
+
+    def handle(self, *args, **options):
+        purged = idempotency.purge(options['batch_size'])
+        self.stdout.write(f"purged {purged} expired idempotency keys")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products import summaries
+from products.models import CategorySummary
+
+
+class Command(BaseCommand):
+    help = "Recomputes category paths and product summaries, needed after bulk writes that skip signals"
+
+    def handle(self, *args, **options):
+        summaries.rebuild()
+        self.stdout.write(f"rebuilt {CategorySummary.objects.count()} category summaries")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from products.search import get_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product search index, needed after bulk writes that skip signals"
+
+    def handle(self, *args, **options):
+        index = get_search_index()
+        index.rebuild()
+        self.stdout.write(f"rebuilt {type(index).__name__}")
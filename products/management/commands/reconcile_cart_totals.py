@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from products.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+    help = "Recomputes stored cart totals and item counts from the cart items and repairs any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="only report drifted carts")
+
+    def handle(self, *args, **options):
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+        actual_total = Coalesce(
+            Subquery(lines.annotate(s=Sum(F('quantity') * F('price'))).values('s')), 0,
+            output_field=DecimalField(max_digits=12, decimal_places=2))
+        actual_count = Coalesce(Subquery(lines.annotate(s=Sum('quantity')).values('s')), 0)
+
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(Cart.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+            with transaction.atomic():
+                drifted = list(
+                    Cart.objects.filter(id__in=ids)
+                    .annotate(actual_total=actual_total, actual_count=actual_count)
+                    .filter(~Q(total=F('actual_total')) | ~Q(item_count=F('actual_count')))
+                    .values_list('id', flat=True)
+                )
+                if drifted and not options['dry_run']:
+                    Cart.objects.filter(id__in=drifted).update(total=actual_total, item_count=actual_count)
+            repaired += len(drifted)
+            for cart_id in drifted:
+                self.stdout.write(f"cart {cart_id} drifted")
+
+        action = "found" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"checked {checked} carts, {action} {repaired}"))
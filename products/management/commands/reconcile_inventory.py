@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import inventory
+from products.models import InventoryEvent, Product
+
+
+class Command(BaseCommand):
+    help = ("Checks Product.stock against the inventory ledger in batches. the counter is what sales were "
+            "taken from, so drift is recorded in the ledger as an adjustment")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=inventory.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="only report drifted products")
+
+    def handle(self, *args, **options):
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+            with transaction.atomic():
+                # locked so a sale between the check and the adjustment can not be counted twice
+                list(Product.objects.select_for_update().filter(id__in=ids).values_list('id', flat=True))
+                drifted = inventory.drift(ids)
+                if drifted and not options['dry_run']:
+                    inventory.record(InventoryEvent.ADJUSTMENT, drifted)
+            repaired += len(drifted)
+            for product_id, difference in drifted.items():
+                self.stdout.write(f"product {product_id} drifted by {difference:+d}")
+
+        action = "found" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"checked {checked} products, {action} {repaired}"))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.seed import seed_marketplace
+
+
+class Command(BaseCommand):
+    help = "Seeds vendors, products, customers, carts and orders for benchmarks and local testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendors', type=int, default=20)
+        parser.add_argument('--products-per-vendor', type=int, default=500)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--cart-lines', type=int, default=5)
+        parser.add_argument('--orders-per-customer', type=int, default=20)
+        parser.add_argument('--items-per-order', type=int, default=4)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='seed', help="prefix of the seeded emails and slugs, users log in with 'password'")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        vendors, customers, products = seed_marketplace(
+            vendors=options['vendors'],
+            products_per_vendor=options['products_per_vendor'],
+            categories=options['categories'],
+            customers=options['customers'],
+            cart_lines=options['cart_lines'],
+            orders_per_customer=options['orders_per_customer'],
+            items_per_order=options['items_per_order'],
+            seed=options['seed'],
+            prefix=options['prefix'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"seeded {len(vendors)} vendors, {len(products)} products and {len(customers)} customers "
+            f"in {time.perf_counter() - start:.1f}s"
+        ))
+        self.stdout.write("products were bulk created, run rebuild_search_index if search is benchmarked")
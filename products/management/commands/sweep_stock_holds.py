@@ -0,0 +1,29 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from products import holds
+
+
+class Command(BaseCommand):
+    help = "Deletes expired stock holds in batches, once or every --interval seconds until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="holds deleted per statement, STOCK_HOLDS['SWEEP_BATCH_SIZE'] by default")
+        parser.add_argument('--interval', type=float, default=60.0, help="seconds between sweeps")
+        parser.add_argument('--once', action='store_true', help="sweep once and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"swept {holds.sweep(options['batch_size'])} expired holds")
+            return
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        self.stdout.write(f"sweeping expired holds every {options['interval']}s")
+        while not stop.is_set():
+            swept = holds.sweep(options['batch_size'])
+            if swept:
+                self.stdout.write(f"swept {swept} expired holds")
+            stop.wait(options['interval'])
@@ -0,0 +1,31 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = "Copies the sqlite primary into the sqlite replica aliases, a local stand-in for replication"
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help="replicas to fill, every DATABASE_REPLICAS alias by default")
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS['ALIASES']
+        if not aliases:
+            raise CommandError("no replicas, list them in DATABASE_REPLICAS['ALIASES'] or pass their aliases")
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            replica = connections[alias].settings_dict
+            if primary.vendor != 'sqlite' or replica['ENGINE'] != primary.settings_dict['ENGINE']:
+                raise CommandError(f"{alias}: only sqlite replicas can be copied")
+            connections[alias].close()
+            primary.ensure_connection()
+            target = sqlite3.connect(replica['NAME'])
+            try:
+                # the online backup api copies a consistent snapshot while the primary takes writes
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(f"copied {primary.settings_dict['NAME']} to {alias} ({replica['NAME']})")
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def create_fts_index(apps, schema_editor):
+    """FTS5 index over product name and description, sqlite only"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+            return
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts "
+            "USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            "INSERT INTO products_product_fts (rowid, name, description) "
+            "SELECT id, name, description FROM products_product"
+        )
+
+
+def drop_fts_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS products_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_index, drop_fts_index),
+    ]
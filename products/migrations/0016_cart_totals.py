@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-17 16:20
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('products', 'Cart')
+    CartItem = apps.get_model('products', 'CartItem')
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.update(
+        total=Coalesce(Subquery(lines.annotate(s=Sum(F('quantity') * F('price'))).values('s')), 0, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        item_count=Coalesce(Subquery(lines.annotate(s=Sum('quantity')).values('s')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q
+
+
+def backfill_tree_and_summaries(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    CategorySummary = apps.get_model('products', 'CategorySummary')
+    Product = apps.get_model('products', 'Product')
+    # every existing category is a root
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.path = f"{category.id:08d}/"
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+    figures = {
+        row.pop('category_id'): row
+        for row in Product.objects.exclude(category=None).values('category_id').annotate(
+            product_count=Count('id'), in_stock_count=Count('id', filter=Q(stock__gt=0)),
+            min_price=Min('price'), max_price=Max('price'),
+        ).order_by()
+    }
+    CategorySummary.objects.bulk_create(
+        [CategorySummary(category_id=category.id, **figures.get(category.id, {})) for category in categories], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategorySummary',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='products.category')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('in_stock_count', models.PositiveIntegerField(default=0)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='products.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_tree_and_summaries, migrations.RunPython.noop),
+    ]
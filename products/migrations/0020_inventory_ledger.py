@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_snapshots(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    InventorySnapshot = apps.get_model('products', 'InventorySnapshot')
+    # the stock counters are the opening balance, the ledger starts empty after them
+    InventorySnapshot.objects.bulk_create(
+        [InventorySnapshot(product_id=product_id, stock=stock) for product_id, stock in Product.objects.values_list('id', 'stock').iterator()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_category_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory_snapshot', serialize=False, to='products.product')),
+                ('stock', models.IntegerField(default=0)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('taken_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventoryEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('cancellation', 'Cancellation'), ('restock', 'Restock'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_events', to='products.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_events', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='inventory_product_id_idx')],
+            },
+        ),
+        migrations.RunPython(open_snapshots, migrations.RunPython.noop),
+    ]
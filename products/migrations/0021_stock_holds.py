@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('cart', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='products.cart')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='products.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at', 'quantity'], name='stockhold_product_expiry_idx'), models.Index(fields=['expires_at'], name='stockhold_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product'), name='stockhold_cart_product_uniq'), models.UniqueConstraint(fields=('order', 'product'), name='stockhold_order_product_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
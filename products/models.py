@@ -1,19 +1,68 @@
 from django.db import models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
-from django.utils.text import slugify
+from django.db import IntegrityError, transaction
+from .slugs import next_slug
 from shipping.models  import ShippingAddress
 
 
 
+# concurrent creates of the same name retry with a fresh suffix this many times
+SLUG_ATTEMPTS = 5
+# digits per category id in Category.path
+PATH_WIDTH = 8
+
+
+def subtree(path, field='path'):
+    """categories at or under path, as an index range instead of a LIKE"""
+    # ':' sorts right after the digits, so the range holds exactly the paths starting with path
+    return Q(**{f'{field}__gte': path, f'{field}__lt': f'{path}:'})
+
+
 class Category(models.Model):
     """Products categories"""
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='children', null=True, blank=True)
+    # ids from the root down, '00000001/00000004/', so a subtree is one range scan
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    def tree_path(self):
+        parent_path = Category.objects.values_list('path', flat=True).get(pk=self.parent_id) if self.parent_id else ''
+        return f"{parent_path}{self.pk:0{PATH_WIDTH}d}/"
+
+    def save(self, *args, **kwargs):
+        """keeps path and depth in step with parent, moving the whole subtree along"""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            path = self.tree_path()
+            if path == self.path:
+                return
+            depth = path.count('/') - 1
+            if self.path:
+                Category.objects.filter(subtree(self.path)).exclude(pk=self.pk).update(
+                    path=Concat(Value(path), Substr('path', len(self.path) + 1)),
+                    depth=F('depth') + depth - self.depth,
+                )
+            Category.objects.filter(pk=self.pk).update(path=path, depth=depth)
+            self.path, self.depth = path, depth
 
     def __str__(self):
         return self.name
 
 
+class CategorySummary(models.Model):
+    """product figures of a category's own products, kept by products.summaries"""
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    product_count = models.PositiveIntegerField(default=0)
+    in_stock_count = models.PositiveIntegerField(default=0)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
 class Product(models.Model):
     """Product model"""
     vendor = models.ForeignKey(
@@ -24,24 +73,46 @@ class Product(models.Model):
     )
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True, blank=True)
+    # the vendor's own reference, bulk imports upsert on it
+    sku = models.CharField(max_length=64, null=True, blank=True)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # {'source': image name, 'variants': {variant: {extension: name}}}, written by products.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     stock = models.PositiveIntegerField(default=0)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # keyset pagination seeks on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            # ?ordering=price and the ProductFilter price range
+            models.Index(fields=['price', '-created_at', '-id'], name='product_price_created_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+            models.Index(fields=['vendor', 'price'], name='product_vendor_price_idx'),
+        ]
+        constraints = [
+            # products without a sku are not constrained, nulls never collide
+            models.UniqueConstraint(fields=['vendor', 'sku'], name='product_vendor_sku_uniq'),
+        ]
+
     def save(self, *args, **kwargs):
         """creates slug for products before saving"""
-        if not self.slug:
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        if self.slug:
+            return super().save(*args, **kwargs)
+        for attempt in range(SLUG_ATTEMPTS):
+            self.slug = next_slug(Product, self.name)
+            try:
+                # savepoint so a lost race does not break the caller's transaction
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # another save took the same slug between our read and insert
+                if attempt == SLUG_ATTEMPTS - 1 or not Product.objects.filter(slug=self.slug).exists():
+                    self.slug = ''
+                    raise
 
     def __str__(self):
         """str reprentation of products"""
@@ -53,13 +124,16 @@ class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # kept in step with the cart items by adjust_totals, reconcile_cart_totals repairs drift
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user.email}'s cart"
 
-    @property
-    def total(self):
-        return sum(item.subtotal for item in self.items.all()) 
+    def adjust_totals(self, quantity, amount):
+        """adds quantity units worth amount to the stored totals in one UPDATE, negative to take away"""
+        Cart.objects.filter(pk=self.pk).update(total=F('total') + amount, item_count=F('item_count') + quantity)
     
 
 class CartItem(models.Model):
@@ -91,9 +165,20 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=30, default='paystack')
     payment_reference = models.CharField(max_length=100, null=True, blank=True)
     total = models.DecimalField(max_digits=10, decimal_places=2)
+    # follows the status of the items, see products.states
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     shipping_address = models.ForeignKey(ShippingAddress, on_delete=models.SET_NULL, null=True, blank=True)
     cancelled = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # order history is a keyset page of one user's orders
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_created_id_idx'),
+            # paid orders newest first, for the dashboards
+            models.Index(fields=['is_paid', 'created_at'], name='order_paid_created_idx'),
+            models.Index(fields=['status'], name='order_status_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} created by {self.user.email}"
 
@@ -106,6 +191,95 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     vendor = models.CharField(max_length=255, blank=True, null=True)
-    
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # vendor dashboard looks up a vendor's lines and groups them by order
+            models.Index(fields=['vendor', 'order'], name='orderitem_vendor_order_idx'),
+            models.Index(fields=['status'], name='orderitem_status_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.quantity} x {self.product.name}" 
\ No newline at end of file
+        return f"{self.quantity} x {self.product.name}" 
+
+class InventoryEvent(models.Model):
+    """one stock movement of a product, the ledger is only ever appended to
+
+    quantity is signed, the stock of a product is the sum of its events. see
+    products.inventory for how snapshots keep reads off the full history.
+    """
+    SALE = 'sale'
+    CANCELLATION = 'cancellation'
+    RESTOCK = 'restock'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = [(SALE, 'Sale'), (CANCELLATION, 'Cancellation'), (RESTOCK, 'Restock'), (ADJUSTMENT, 'Adjustment')]
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_events')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='inventory_events')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the events after a product's snapshot are a range of this index
+            models.Index(fields=['product', 'id'], name='inventory_product_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} of product {self.product_id}"
+
+
+class InventorySnapshot(models.Model):
+    """a product's stock summed over its events up to last_event_id, moved forward by products.inventory.compact"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='inventory_snapshot')
+    stock = models.IntegerField(default=0)
+    last_event_id = models.BigIntegerField(default=0)
+    taken_at = models.DateTimeField(auto_now=True)
+
+
+class StockHold(models.Model):
+    """units of a product set aside for a cart, or for the order it was checked out to, until expires_at
+
+    see products.holds, the available stock of a product is its stock minus the holds not yet expired.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, null=True, blank=True, related_name='holds')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # the held units of a product are summed from this index alone
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='stockhold_product_expiry_idx'),
+            # the sweeper deletes the expired ones oldest first
+            models.Index(fields=['expires_at'], name='stockhold_expiry_idx'),
+        ]
+        constraints = [
+            # a hold belongs to a cart or to an order, nulls never collide
+            models.UniqueConstraint(fields=['cart', 'product'], name='stockhold_cart_product_uniq'),
+            models.UniqueConstraint(fields=['order', 'product'], name='stockhold_order_product_uniq'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """the first response to a request sent with an Idempotency-Key header, replayed to its retries until expires_at"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # sha256 of the method, path and body, a key reused for another request is refused
+    fingerprint = models.CharField(max_length=64)
+    # empty until the first request has its response, its retries wait on the row lock meanwhile
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            # the purge job deletes the expired keys oldest first
+            models.Index(fields=['expires_at'], name='idempotency_expiry_idx'),
+        ]
@@ -0,0 +1,131 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """keyset (seek) pagination
+
+    the cursor holds the ordering values of the last row of a page and the
+    next page is read with WHERE (a, b) > (x, y) instead of OFFSET, so page N
+    costs the same as page 1 and no COUNT(*) is run.
+    """
+    page_size = api_settings.PAGE_SIZE or 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.page_rows(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views, the page is read with the async ORM"""
+        return self.page_rows([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering_fields = self.get_ordering(queryset)
+        queryset = queryset.order_by(*self.ordering_fields)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.seek(position))
+        # one extra row tells us whether there is a next page without counting
+        return queryset[:self.page_size + 1]
+
+    def page_rows(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = self.get_position(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        """ordering already put on the queryset (OrderingFilter, search rank) plus the tiebreak fields"""
+        requested = [term for term in queryset.query.order_by if isinstance(term, str) and term != '?']
+        used = [term.lstrip('-') for term in requested]
+        return tuple(requested) + tuple(term for term in self.ordering if term.lstrip('-') not in used)
+
+    def seek(self, position):
+        """WHERE clause matching rows strictly after position in the current ordering"""
+        condition = Q()
+        equal = Q()
+        for term, value in zip(self.ordering_fields, position):
+            field = term.lstrip('-')
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        # the redundant inclusive bound on the leading field lets the database
+        # turn the OR chain into an index range scan
+        first = self.ordering_fields[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': position[0]}) & condition
+
+    def get_position(self, row):
+        values = []
+        for term in self.ordering_fields:
+            field = term.lstrip('-')
+            value = row[field] if isinstance(row, dict) else getattr(row, field)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value) if value is not None else None)
+        return values
+
+    def encode_cursor(self, position):
+        payload = {'o': list(self.ordering_fields), 'p': position}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            ordering, position = payload['o'], payload['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor is only meaningful for the ordering it was issued under
+        if ordering != list(self.ordering_fields) or not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class OrderItemPagination(KeysetPagination):
+    """order items have no timestamp of their own, they are paged on id"""
+    ordering = ('-id',)
@@ -0,0 +1,74 @@
+"""payment gateway clients
+
+views talk to the gateway named by the PAYMENT_GATEWAY setting. FakeGateway
+is the only one so far, it answers locally so checkout and payment can be run
+and tested offline, a real client subclasses Gateway with the same two calls.
+the async views use the ainitialize/averify twins, a client without native
+async ones gets them run in a thread.
+"""
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class PaymentDeclined(Exception):
+    pass
+
+
+class Gateway:
+    async def ainitialize(self, order, callback_url):
+        # not thread sensitive, a blocking http call should not queue behind the ORM thread
+        return await sync_to_async(self.initialize, thread_sensitive=False)(order, callback_url)
+
+    async def averify(self, reference):
+        return await sync_to_async(self.verify, thread_sensitive=False)(reference)
+
+
+class FakeGateway(Gateway):
+    """gateway stand-in, every reference it is asked about succeeds unless listed in declined
+
+    latency seconds are slept on every call to mimic a remote API.
+    """
+
+    def __init__(self, latency=0, declined=()):
+        self.latency = latency
+        self.declined = set(declined)
+
+    def initialize(self, order, callback_url):
+        """starts a payment, returns the reference and where to send the customer"""
+        time.sleep(self.latency)
+        reference = f"txn_{order.id}_{timezone.now().timestamp()}"
+        return {'reference': reference, 'authorization_url': callback_url}
+
+    def verify(self, reference):
+        """raises PaymentDeclined unless the payment under reference went through"""
+        time.sleep(self.latency)
+        if reference in self.declined:
+            raise PaymentDeclined(reference)
+        return {'reference': reference, 'status': 'success'}
+
+    async def ainitialize(self, order, callback_url):
+        await asyncio.sleep(self.latency)
+        reference = f"txn_{order.id}_{timezone.now().timestamp()}"
+        return {'reference': reference, 'authorization_url': callback_url}
+
+    async def averify(self, reference):
+        await asyncio.sleep(self.latency)
+        if reference in self.declined:
+            raise PaymentDeclined(reference)
+        return {'reference': reference, 'status': 'success'}
+
+
+_gateway = None
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        config = getattr(settings, 'PAYMENT_GATEWAY', {})
+        _gateway = import_string(config.get('BACKEND', 'products.payments.FakeGateway'))(**config.get('OPTIONS', {}))
+    return _gateway
@@ -0,0 +1,214 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.db import connection
+from django.db.models import IntegerField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+
+from .models import Product
+
+FTS_TABLE = 'products_product_fts'
+NAME_WEIGHT = 10
+DESCRIPTION_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """lowercased word tokens of text"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class SqliteFtsIndex:
+    """product index kept in an sqlite FTS5 table, rowid is the product id"""
+
+    def update(self, products):
+        rows = [(p.id, p.name, p.description) for p in products]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)", rows)
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(pid,) for pid in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) "
+                f"SELECT id, name, description FROM {Product._meta.db_table}"
+            )
+
+    def search(self, query, limit, candidates=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        # every token must match, each one as a prefix
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        restrict, params = '', []
+        if candidates is not None:
+            # the filters are joined into the match, so the limit counts only products they let through
+            sql, params = candidates.order_by().values('id').query.sql_with_params()
+            restrict = f"AND rowid IN ({sql}) "
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s {restrict}"
+                f"ORDER BY bm25({FTS_TABLE}, {NAME_WEIGHT}.0, {DESCRIPTION_WEIGHT}.0), rowid DESC LIMIT %s",
+                [match, *params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MemoryIndex:
+    """in-process inverted index used when the database has no full text support
+
+    it is loaded from the database on first use and kept current by the product
+    signals of this process only.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.postings = defaultdict(dict)  # token -> {product id: weight}
+        self.documents = {}  # product id -> tokens
+        self.vocabulary = []  # sorted tokens, for prefix lookups
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self.lock:
+            if not self.loaded:
+                for pid, name, description in Product.objects.values_list('id', 'name', 'description').iterator(chunk_size=2000):
+                    self.add(pid, name, description)
+                self.loaded = True
+
+    def add(self, pid, name, description):
+        weights = Counter()
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        for token, weight in weights.items():
+            if token not in self.postings:
+                insort(self.vocabulary, token)
+            self.postings[token][pid] = weight
+        self.documents[pid] = list(weights)
+
+    def discard(self, pid):
+        for token in self.documents.pop(pid, []):
+            postings = self.postings[token]
+            postings.pop(pid, None)
+            if not postings:
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+
+    def update(self, products):
+        if not self.loaded:
+            return
+        with self.lock:
+            for p in products:
+                self.discard(p.id)
+                self.add(p.id, p.name, p.description)
+
+    def remove(self, product_ids):
+        if not self.loaded:
+            return
+        with self.lock:
+            for pid in product_ids:
+                self.discard(pid)
+
+    def rebuild(self):
+        with self.lock:
+            self.__init__()
+        self.ensure_loaded()
+
+    def prefix_scores(self, prefix):
+        scores = Counter()
+        position = bisect_left(self.vocabulary, prefix)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(prefix):
+            scores.update(self.postings[self.vocabulary[position]])
+            position += 1
+        return scores
+
+    def search(self, query, limit, candidates=None):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        self.ensure_loaded()
+        with self.lock:
+            scores = None
+            for token in tokens:
+                token_scores = self.prefix_scores(token)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    # every token must match
+                    scores = Counter({pid: score + token_scores[pid] for pid, score in scores.items() if pid in token_scores})
+                if not scores:
+                    return []
+        if candidates is not None:
+            allowed = set(candidates.filter(id__in=list(scores)).values_list('id', flat=True))
+            scores = {pid: score for pid, score in scores.items() if pid in allowed}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [pid for pid, _ in ranked[:limit]]
+
+
+_index = None
+
+
+def get_search_index():
+    """FTS5 on sqlite when the index table exists, the in-process index otherwise"""
+    global _index
+    if _index is None:
+        if connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+            _index = SqliteFtsIndex()
+        else:
+            _index = MemoryIndex()
+    return _index
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """?search= over product name and description, ranked by relevance
+
+    it narrows the queryset handed on by the other backends, so the
+    ProductFilter price, vendor and category filters still apply. the index
+    only ranks the products those filters let through, the hits cut at
+    max_results are all ones the page can show.
+    """
+    search_param = api_settings.SEARCH_PARAM
+    # deeper result pages are not useful for relevance search
+    max_results = 250
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        # an unfiltered catalogue needs no restriction
+        candidates = queryset if queryset.query.where else None
+        ids = get_search_index().search(query, self.max_results, candidates)
+        if not ids:
+            return queryset.none()
+        # a raw CASE costs nothing to build, the same ranking as Case(When(...)) took
+        # Django over 100ms to resolve for a full page of hits. the ids are ints
+        # from the index so they are inlined, the keyset seek repeats this
+        # expression and bound params would multiply with it
+        column = f'{connection.ops.quote_name(queryset.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        whens = ' '.join(f'WHEN {int(pid)} THEN {position}' for position, pid in enumerate(ids))
+        rank = RawSQL(f"CASE {column} {whens} END", [], output_field=IntegerField())
+        return queryset.filter(id__in=ids).annotate(search_rank=rank).order_by('search_rank')
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Full text search over product name and description',
+            'schema': {'type': 'string'},
+        }]
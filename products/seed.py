@@ -0,0 +1,88 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from accounts.models import CustomUser
+from shipping.models import ShippingAddress
+from . import inventory, summaries
+from .cache import invalidate_all
+from .models import Cart, CartItem, Category, Order, OrderItem, Product
+
+CITIES = [('Lagos', 'Lagos'), ('Ikeja', 'Lagos'), ('Abuja', 'FCT'), ('Ibadan', 'Oyo'), ('Kano', 'Kano'), ('Enugu', 'Enugu')]
+WORDS = ['phone', 'laptop', 'charger', 'headset', 'camera', 'speaker', 'watch', 'tablet', 'mouse', 'keyboard', 'monitor', 'router']
+
+
+@transaction.atomic
+def seed_marketplace(vendors=5, products_per_vendor=40, categories=8, customers=20, cart_lines=5,
+                     orders_per_customer=5, items_per_order=4, paid_ratio=0.7, seed=0, prefix='seed'):
+    """fills the database with a marketplace of the given size through the real models
+
+    everything is written with bulk_create so large volumes are quick, and the
+    random generator is seeded so two runs with the same arguments match.
+    returns the created vendors, customers and products.
+    """
+    rng = random.Random(seed)
+    password = make_password('password')
+
+    cats = Category.objects.bulk_create([Category(name=f'Category {i}', slug=f'{prefix}-category-{i}') for i in range(categories)])
+    vendor_users = CustomUser.objects.bulk_create([
+        CustomUser(email=f'{prefix}-vendor-{i}@example.com', role='vendor', password=password) for i in range(vendors)
+    ])
+    customer_users = CustomUser.objects.bulk_create([
+        CustomUser(email=f'{prefix}-customer-{i}@example.com', role='customer', password=password) for i in range(customers)
+    ])
+
+    products = Product.objects.bulk_create([
+        Product(
+            vendor=vendor,
+            category=rng.choice(cats) if cats else None,
+            name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {v}-{i}',
+            slug=f'{prefix}-product-{v}-{i}',
+            description=' '.join(rng.choice(WORDS) for _ in range(20)),
+            price=Decimal(rng.randint(500, 500000)) / 100,
+            stock=rng.randint(0, 500),
+        )
+        for v, vendor in enumerate(vendor_users)
+        for i in range(products_per_vendor)
+    ], batch_size=1000)
+    vendor_emails = {vendor.id: vendor.email for vendor in vendor_users}
+
+    addresses = ShippingAddress.objects.bulk_create([
+        ShippingAddress(user=customer, full_name=f'Customer {i}', phone=f'0800{i:07d}', address_line=f'{i} Market Road',
+                        city=city, state=state, is_default=True)
+        for i, customer in enumerate(customer_users)
+        for city, state in [rng.choice(CITIES)]
+    ])
+    carts = Cart.objects.bulk_create([Cart(user=customer) for customer in customer_users])
+
+    cart_items = []
+    for cart in carts:
+        lines = rng.sample(products, min(cart_lines, len(products)))
+        cart_items += [CartItem(cart=cart, product=p, quantity=rng.randint(1, 3), price=p.price) for p in lines]
+        cart.item_count = sum(item.quantity for item in cart_items[-len(lines):])
+        cart.total = sum(item.quantity * item.price for item in cart_items[-len(lines):])
+    CartItem.objects.bulk_create(cart_items, batch_size=1000)
+    Cart.objects.bulk_update(carts, ['total', 'item_count'], batch_size=1000)
+
+    orders, order_lines = [], []
+    for customer, address in zip(customer_users, addresses):
+        for _ in range(orders_per_customer):
+            lines = rng.sample(products, min(items_per_order, len(products)))
+            quantities = [rng.randint(1, 3) for _ in lines]
+            orders.append(Order(user=customer, shipping_address=address, is_paid=rng.random() < paid_ratio,
+                                total=sum(q * p.price for q, p in zip(quantities, lines))))
+            order_lines.append(list(zip(lines, quantities)))
+    orders = Order.objects.bulk_create(orders, batch_size=1000)
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=p, quantity=q, price=p.price, vendor=vendor_emails[p.vendor_id])
+        for order, lines in zip(orders, order_lines)
+        for p, q in lines
+    ], batch_size=1000)
+
+    # bulk_create skips the category and product signals
+    summaries.rebuild()
+    inventory.record_vendor_changes({product.id: product.stock for product in products})
+    invalidate_all()
+    return vendor_users, customer_users, products
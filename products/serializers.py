@@ -1,16 +1,30 @@
+from functools import cached_property
+
 from rest_framework import serializers
 from .models import Product, Cart, CartItem, OrderItem, Order, Category
 from shipping.serializers import ShippingSerializer
 from shipping.models import ShippingAddress
-from shipping.serializers import ShippingSerializer
+from .images import variant_urls
+from . import summaries
+
+# most operations one batch cart update may carry
+MAX_CART_OPERATIONS = 500
 
 class ProductSerializer(serializers.ModelSerializer):
     """turns products model to json"""
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
         fields = "__all__"
         read_only_fields = ['id', 'created_at', 'slug', 'vendor']
 
+    def get_image_variants(self, obj):
+        """urls of the resized copies of the image, empty while they are being made"""
+        request = self.context.get('request')
+        # async views can not queue the missing ones, that touches the database
+        return variant_urls(obj, request.build_absolute_uri if request else None, self.context.get('schedule_variants', True))
+
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -30,23 +44,60 @@ class CartItemSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     """Cart serializer"""
     items = CartItemSerializer(many=True, read_only=True) # nested serializer for items in cart
-    total = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['user', 'created_at', 'id', 'items', 'total']
-        read_only_fields = ['id', 'created_at', 'total', 'user']
-
-    def get_total(self, obj):
-        return obj.total
+        fields = ['user', 'created_at', 'id', 'items', 'total', 'item_count']
+        read_only_fields = ['id', 'created_at', 'total', 'item_count', 'user']
     
+class CartOperationSerializer(serializers.Serializer):
+    """one line of a batch cart update, set to 0 removes the line like remove does"""
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add':
+            attrs.setdefault('quantity', 1)
+            if attrs['quantity'] < 1:
+                raise serializers.ValidationError({'quantity': 'Quantity must be greater than 0'})
+        elif attrs['op'] == 'set' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'Quantity is required'})
+        elif attrs['op'] == 'remove':
+            # a quantity sent along with remove is ignored, the line goes
+            attrs['quantity'] = 0
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """a batch cart update, its operations are applied in order"""
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=MAX_CART_OPERATIONS)
+
+
+class ItemStatusSerializer(serializers.Serializer):
+    """order items moved to one status at once"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    status = serializers.ChoiceField(choices=OrderItem.STATUS_CHOICES)
+
+
+class DeliverySerializer(serializers.Serializer):
+    is_delivered = serializers.BooleanField()
+
+    def validate_is_delivered(self, value):
+        # a delivery can not be taken back
+        if not value:
+            raise serializers.ValidationError('is_delivered can only be set to true')
+        return value
+
+
 class OrderItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
-    status = serializers.CharField()
+    # statuses only move through products.states
+    status = serializers.CharField(read_only=True)
     
     class Meta:
         model = OrderItem
-        fields = ['id', 'product', 'quantity', 'price', 'status', 'vendor', 'is_delivered']
+        fields = ['id', 'product', 'quantity', 'price', 'status', 'vendor']
         read_only_fields = ['id', 'product', 'vendor']
 
 class VendorOrderItemSerializer(serializers.ModelSerializer):
@@ -55,17 +106,113 @@ class VendorOrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['id', 'product', 'quantity', 'price', 'status', 'vendor']
-        read_only_fields = ['id', 'product', 'vendor']
+        read_only_fields = ['id', 'product', 'status', 'vendor']
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
-    status = serializers.CharField()  # Display the status choice label
+    status = serializers.CharField(read_only=True)  # Display the status choice label
     shipping_address = ShippingSerializer(read_only=True)  # Use the ShippingSerializer for address details
 
     class Meta:
         model = Order
         fields = ['id', 'created_at', 'is_paid', 'status', 'total', 'items', 'shipping_address', 'cancelled']
-        read_only_fields = ['id', 'created_at', 'status']
+        # payment, cancellation and the total follow the payment views and products.states
+        read_only_fields = ['id', 'created_at', 'status', 'is_paid', 'total', 'cancelled']
+
+
+class FieldPlan:
+    """the fields of a serializer compiled once for .values() rows
+
+    each step is (output name, row column, to_representation), so rows are
+    formatted exactly like the serializer would without building a serializer
+    or bound fields per object. related fields read the pk that .values() gives.
+    """
+
+    def __init__(self, serializer_class, fields, prefix=''):
+        self.serializer_class = serializer_class
+        self.names = fields
+        self.prefix = prefix
+
+    @cached_property
+    def steps(self):
+        fields = self.serializer_class().fields
+        steps = []
+        for name in self.names:
+            field = fields[name]
+            convert = None if isinstance(field, serializers.RelatedField) else field.to_representation
+            steps.append((name, self.prefix + field.source, convert))
+        return steps
+
+    @property
+    def columns(self):
+        return [column for _, column, _ in self.steps]
+
+    def __call__(self, row):
+        data = {}
+        for name, column, convert in self.steps:
+            value = row[column]
+            data[name] = value if value is None or convert is None else convert(value)
+        return data
+
+
+class LeanOrderSerializer:
+    """order listings from two .values() queries instead of nested model serializers
+
+    same fields as OrderSerializer except that each item carries a compact
+    product summary. orders come with their address in one joined read and the
+    items with their product columns in another, the summary of each product is
+    built once per request and shared by every line that shows it.
+    """
+    order_plan = FieldPlan(OrderSerializer, ['id', 'created_at', 'is_paid', 'status', 'total', 'cancelled'])
+    address_plan = FieldPlan(ShippingSerializer, [f.name for f in ShippingAddress._meta.concrete_fields], prefix='shipping_address__')
+    item_plan = FieldPlan(OrderItemSerializer, ['id', 'quantity', 'price', 'status', 'vendor'])
+    product_plan = FieldPlan(ProductSerializer, ['id', 'name', 'slug', 'price'], prefix='product__')
+
+    def __init__(self, request=None):
+        # kept on the request so every listing it serializes shares the summaries
+        if request is not None:
+            self.products = request.__dict__.setdefault('_product_summaries', {})
+        else:
+            self.products = {}
+
+    @classmethod
+    def columns(cls):
+        """the .values() columns of the order rows"""
+        return cls.order_plan.columns + cls.address_plan.columns
+
+    def to_representation(self, rows):
+        orders, by_id = self.orders(rows)
+        self.add_items(by_id, self.item_rows(by_id))
+        return orders
+
+    async def ato_representation(self, rows):
+        """to_representation for async views, the items are read with the async ORM"""
+        orders, by_id = self.orders(rows)
+        self.add_items(by_id, [row async for row in self.item_rows(by_id)])
+        return orders
+
+    def orders(self, rows):
+        orders = []
+        by_id = {}
+        for row in rows:
+            order = self.order_plan(row)
+            order['items'] = []
+            order['shipping_address'] = None if row['shipping_address__id'] is None else self.address_plan(row)
+            by_id[row['id']] = order
+            orders.append(order)
+        return orders, by_id
+
+    def item_rows(self, by_id):
+        return OrderItem.objects.filter(order_id__in=list(by_id)).order_by('id').values('order_id', *self.item_plan.columns, *self.product_plan.columns)
+
+    def add_items(self, by_id, items):
+        for row in items:
+            item = self.item_plan(row)
+            product_id = row['product__id']
+            if product_id not in self.products:
+                self.products[product_id] = self.product_plan(row)
+            item['product'] = self.products[product_id]
+            by_id[row['order_id']]['items'].append(item)
 
 
 class VendorOrderSerializer(serializers.Serializer):
@@ -73,12 +220,44 @@ class VendorOrderSerializer(serializers.Serializer):
     customer = serializers.EmailField()
     created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
     order_status = serializers.CharField()
+    order_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    item_count = serializers.IntegerField()
     items = VendorOrderItemSerializer(many=True, read_only=True)
     shipping_address = ShippingSerializer()
 
+class CategoryListSerializer(serializers.ListSerializer):
+    """adds up the subtree figures of the whole list in memory, for lists holding whole subtrees"""
+
+    def to_representation(self, data):
+        categories = list(data.all() if hasattr(data, 'all') else data)
+        self._context['subtree'] = summaries.subtree_figures(categories)
+        return super().to_representation(categories)
+
+
 class CategorySerializer(serializers.ModelSerializer):
+    """a category with the figures of its own products and of its whole subtree
+
+    in a list the subtree figures come from CategoryListSerializer, a single
+    category has them added up with one query.
+    """
+    summary = serializers.SerializerMethodField()
+    subtree = serializers.SerializerMethodField()
+
     class Meta:
         model = Category
-        fields = "__all__"
+        fields = ['id', 'name', 'slug', 'parent', 'path', 'depth', 'summary', 'subtree']
+        list_serializer_class = CategoryListSerializer
+
+    def get_summary(self, obj):
+        return summaries.own_figures(obj)
+
+    def get_subtree(self, obj):
+        totals = self.context.get('subtree')
+        return totals[obj.id] if totals is not None else summaries.subtree_figures_of(obj)
+
+    def validate_parent(self, parent):
+        if parent is not None and self.instance is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError("A category can not be moved under itself.")
+        return parent
 
 
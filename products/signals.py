@@ -0,0 +1,45 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import inventory, summaries
+from .cache import invalidate_categories, invalidate_products
+from .images import schedule as schedule_image_variants
+from .models import Category, Product
+from .search import get_search_index
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous(sender, instance, update_fields=None, **kwargs):
+    """notes the category an existing product is leaving, its summary changes too, and the stock it had"""
+    instance._previous_category_id = None
+    instance._previous_stock = 0 if instance._state.adding else instance.stock
+    if instance._state.adding or (update_fields is not None and not {'category', 'stock'} & set(update_fields)):
+        return
+    previous = Product.objects.filter(pk=instance.pk).values_list('category_id', 'stock').first()
+    if previous is not None:
+        instance._previous_category_id, instance._previous_stock = previous
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """keeps the search index, response cache, category summaries, image variants and inventory ledger in step with product saves"""
+    get_search_index().update([instance])
+    invalidate_products([instance])
+    summaries.refresh({instance.category_id, getattr(instance, '_previous_category_id', None)})
+    # stock set through the model is the vendor's doing, the sales go through stock.reserve_stock
+    inventory.record_vendor_changes({instance.id: instance.stock - getattr(instance, '_previous_stock', instance.stock)})
+    schedule_image_variants(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """drops deleted products from the search index, response cache and category summaries"""
+    get_search_index().remove([instance.id])
+    invalidate_products([instance])
+    summaries.refresh([instance.category_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    invalidate_categories()
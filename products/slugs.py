@@ -0,0 +1,88 @@
+import re
+
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+# how many base slugs are looked up per query when assigning slugs in bulk
+BULK_BASE_BATCH = 200
+# leaves room for a -N suffix inside SlugField's 50 characters
+BASE_LENGTH = 40
+
+
+def base_slug(name):
+    return slugify(name)[:BASE_LENGTH].strip('-') or 'product'
+
+
+def variants(base):
+    """slugs equal to base or base-<anything>, as an index range instead of a LIKE"""
+    # '.' sorts right after '-', so the range holds exactly the base- prefixed slugs
+    return Q(slug=base) | Q(slug__gt=f'{base}-', slug__lt=f'{base}.')
+
+
+def suffix_of(slug, base):
+    """0 for the bare base slug, N for base-N, None for anything else"""
+    if slug == base:
+        return 0
+    prefix, _, number = slug.rpartition('-')
+    if prefix == base and number.isdigit():
+        return int(number)
+    return None
+
+
+def next_slug(model, name):
+    """next free slug for name in one query, by reading the highest base-N in use"""
+    base = base_slug(name)
+    numbered = Q(slug__regex=rf'^{re.escape(base)}-[0-9]+$')
+    highest = (
+        model.objects.filter(variants(base))
+        .filter(Q(slug=base) | numbered)
+        # longer suffixes are bigger numbers, then compare digit by digit
+        .order_by(Length('slug').desc(), '-slug')
+        .values_list('slug', flat=True)
+        .first()
+    )
+    if highest is None:
+        return base
+    return f"{base}-{suffix_of(highest, base) + 1}"
+
+
+def note_suffixes(slug, bases, highest):
+    """records slug against the highest suffix seen for each base in bases it belongs to"""
+    if slug in bases:
+        highest[slug] = max(highest.get(slug, -1), 0)
+    prefix, _, number = slug.rpartition('-')
+    if prefix in bases and number.isdigit():
+        highest[prefix] = max(highest.get(prefix, -1), int(number))
+
+
+def assign_slugs(model, objs):
+    """gives every obj without a slug a unique one, for bulk_create paths
+
+    existing slugs are read with one query per batch of base slugs, the rest is
+    worked out in memory so names repeated within objs get distinct suffixes.
+    """
+    pending = [obj for obj in objs if not obj.slug]
+    bases = sorted({base_slug(obj.name) for obj in pending})
+    highest = {}
+    for start in range(0, len(bases), BULK_BASE_BATCH):
+        chunk = bases[start:start + BULK_BASE_BATCH]
+        condition = Q()
+        for base in chunk:
+            condition |= variants(base)
+        chunk_bases = set(chunk)
+        for slug in model.objects.filter(condition).values_list('slug', flat=True).iterator():
+            note_suffixes(slug, chunk_bases, highest)
+
+    # slugs given explicitly in this batch are taken too
+    bases = set(bases)
+    for obj in objs:
+        if obj.slug:
+            note_suffixes(obj.slug, bases, highest)
+
+    for obj in pending:
+        base = base_slug(obj.name)
+        suffix = highest.get(base, -1) + 1
+        highest[base] = suffix
+        obj.slug = f"{base}-{suffix}" if suffix else base
+    return objs
@@ -0,0 +1,129 @@
+"""order and order item status transitions
+
+each StateMachine lists the statuses a row may move to from each status and
+the fields a move sets along with the status. a move is one conditional
+UPDATE ... WHERE status IN (statuses allowed to reach the target), rows not in
+one of those are left alone and the count tells how many moved, so a bulk
+request never reads the rows first. vendors move their order items, the status
+of an order follows from its items in one aggregate query.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Now
+
+from . import holds
+from .inventory import release_order_stock
+from .models import Order, OrderItem
+
+
+class StateMachine:
+    """allowed moves {status: statuses it may go to} and the fields {status: {field: value}} set on reaching one"""
+
+    def __init__(self, transitions, effects=None):
+        self.transitions = transitions
+        self.effects = effects or {}
+
+    def sources(self, target):
+        """the statuses a row can reach target from"""
+        return [source for source, targets in self.transitions.items() if target in targets]
+
+    def allows(self, source, target):
+        return target in self.transitions.get(source, ())
+
+    def move(self, queryset, target):
+        """moves the rows of queryset that are allowed to reach target, returns how many did"""
+        return queryset.filter(status__in=self.sources(target)).update(status=target, **self.effects.get(target, {}))
+
+
+ORDER_STATES = StateMachine({
+    # an order jumps as far as its items went
+    'pending': ('shipped', 'delivered', 'cancelled'),
+    'shipped': ('delivered',),
+}, {
+    'delivered': {'is_delivered': True, 'delivered_at': Now()},
+    'cancelled': {'cancelled': True},
+})
+
+ITEM_STATES = StateMachine({
+    'pending': ('processing', 'shipped', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+}, {
+    'delivered': {'delivered_at': Now()},
+})
+
+# the statuses of lines that still count towards sales and earnings
+ACTIVE_ITEM_STATUSES = [value for value, _ in OrderItem.STATUS_CHOICES if value != 'cancelled']
+
+
+def rolled_up(lines, cancelled, shipped, delivered):
+    """the status an order with these item counts is in, shipped counts the delivered ones too"""
+    if cancelled == lines:
+        return 'cancelled'
+    if delivered == lines - cancelled:
+        return 'delivered'
+    if shipped == lines - cancelled:
+        return 'shipped'
+    return 'pending'
+
+
+def roll_up(orders):
+    """moves each order of the queryset to the status its items are in, returns how many moved
+
+    the items of all the orders are counted in one grouped query, the orders
+    then move with one update per status they reach.
+    """
+    counts = (
+        orders.annotate(
+            lines=Count('items'),
+            cancelled_lines=Count('items', filter=Q(items__status='cancelled')),
+            shipped_lines=Count('items', filter=Q(items__status__in=['shipped', 'delivered'])),
+            delivered_lines=Count('items', filter=Q(items__status='delivered')),
+        )
+        .filter(lines__gt=0).values_list('id', 'lines', 'cancelled_lines', 'shipped_lines', 'delivered_lines')
+    )
+    by_status = {}
+    for order_id, *figures in counts:
+        by_status.setdefault(rolled_up(*figures), []).append(order_id)
+    by_status.pop('pending', None)
+    return sum(ORDER_STATES.move(Order.objects.filter(id__in=ids), target) for target, ids in by_status.items())
+
+
+def move_items(items, target):
+    """moves the order items of the queryset that may reach target, rolls their orders up, returns how many moved
+
+    cancelled lines give back the stock their payment took, or the units
+    their order still holds. an unpaid order is no longer charged for them,
+    the total of a paid one stays what was charged.
+    """
+    with transaction.atomic():
+        cancelling = {}
+        refunds = {}
+        if target == 'cancelled':
+            # the lines to cancel are locked so the stock of each is given back once
+            lines = items.filter(status__in=ITEM_STATES.sources(target)).select_for_update().values_list('order_id', 'product_id', 'quantity', 'price')
+            for order_id, product_id, quantity, price in lines:
+                cancelling.setdefault(order_id, set()).add(product_id)
+                refunds[order_id] = refunds.get(order_id, 0) + quantity * price
+        moved = ITEM_STATES.move(items, target)
+        for order in Order.objects.filter(id__in=list(cancelling)).order_by('id'):
+            release_order_stock(order, cancelling[order.id])
+            holds.release(order, cancelling[order.id])
+            Order.objects.filter(pk=order.pk, is_paid=False).update(total=F('total') - refunds[order.id])
+        roll_up(Order.objects.filter(id__in=items.values('order_id')))
+    return moved
+
+
+def cancel_order(order):
+    """cancels the order and all its items, returns False and changes nothing when a line has shipped"""
+    with transaction.atomic():
+        # lines already on their way keep the whole order from being cancelled
+        if order.items.filter(status__in=['shipped', 'delivered']).exists():
+            return False
+        move_items(order.items.all(), 'cancelled')
+        ORDER_STATES.move(Order.objects.filter(pk=order.pk), 'cancelled')
+        # a paid order gives back what its payment took, an unpaid one its holds,
+        # whatever the lines did not cover already
+        release_order_stock(order)
+        holds.release(order)
+    return True
@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Sum, When
+
+from . import holds, inventory
+from .cache import invalidate_product_ids
+from .models import InventoryEvent, Product
+from .summaries import sold_out
+
+
+class InsufficientStock(Exception):
+    """raised when a reservation would take a product's stock below zero"""
+
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f"Insufficient stock for products {product_ids}")
+
+
+def reserve_stock(quantities, order=None):
+    """decrements stock for {product_id: quantity} in one conditional UPDATE
+
+    rows are locked in product id order first so two orders sharing products
+    always lock them in the same sequence and cannot deadlock. the UPDATE only
+    matches rows with enough stock left over the holds of other carts and
+    orders, if any row is missed nothing is applied. the decrements go in the
+    inventory ledger as sales of order, whose holds they replace.
+    """
+    quantities = {product_id: qty for product_id, qty in quantities.items() if qty}
+    if not quantities:
+        return
+    product_ids = sorted(quantities)
+
+    with transaction.atomic():
+        # the order's own holds are part of what it may take
+        others = ~Q(order=order) if order is not None else Q()
+        locked = {
+            pid: (stock, category_id, held) for pid, stock, category_id, held in
+            Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+            .annotate(held=holds.held(others)).values_list('id', 'stock', 'category_id', 'held')
+        }
+
+        has_stock = Q()
+        decrements = []
+        for product_id in product_ids:
+            has_stock |= Q(id=product_id, stock__gte=quantities[product_id] + locked.get(product_id, (0, None, 0))[2])
+            decrements.append(When(id=product_id, then=F('stock') - quantities[product_id]))
+
+        updated = Product.objects.filter(has_stock).update(stock=Case(*decrements, default=F('stock'), output_field=PositiveIntegerField()))
+        if updated != len(product_ids):
+            # raising inside the atomic block rolls back the rows that did match
+            raise InsufficientStock([pid for pid in product_ids if pid not in locked or locked[pid][0] - locked[pid][2] < quantities[pid]] or product_ids)
+        inventory.record(InventoryEvent.SALE, {pid: -quantities[pid] for pid in product_ids}, order=order)
+        if order is not None:
+            holds.release(order)
+        # the UPDATE skips the product signals, cached responses still show the old stock
+        invalidate_product_ids(product_ids)
+        sold_out([locked[pid][1] for pid in product_ids if locked[pid][0] == quantities[pid]])
+
+
+def reserve_order_stock(order):
+    """decrements stock for every item of the order that was not cancelled"""
+    rows = order.items.exclude(status='cancelled').values('product_id').annotate(quantity=Sum('quantity'))
+    reserve_stock({row['product_id']: row['quantity'] for row in rows}, order=order)
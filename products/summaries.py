@@ -0,0 +1,103 @@
+"""stored product figures per category and their roll-up over the category tree
+
+CategorySummary holds the count, in-stock count and price range of every
+category's own products. a product save or delete refreshes the categories it
+was and is in with one grouped aggregate, a checkout that sells a product out
+only decrements in_stock_count. subtree figures are added up from the summary
+rows, for one category with a range scan on Category.path.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+from .cache import invalidate_categories
+from .models import Category, CategorySummary, PATH_WIDTH, Product, subtree
+
+FIELDS = ['product_count', 'in_stock_count', 'min_price', 'max_price']
+
+
+def refresh(category_ids):
+    """recomputes the summaries of category_ids from their products"""
+    category_ids = {cid for cid in category_ids if cid is not None}
+    if not category_ids:
+        return
+    figures = {
+        row.pop('category_id'): row
+        for row in Product.objects.filter(category_id__in=category_ids).values('category_id').annotate(
+            product_count=Count('id'), in_stock_count=Count('id', filter=Q(stock__gt=0)),
+            min_price=Min('price'), max_price=Max('price'),
+        ).order_by()
+    }
+    # a category deleted meanwhile would fail the foreign key
+    existing = Category.objects.filter(id__in=category_ids).values_list('id', flat=True)
+    CategorySummary.objects.bulk_create(
+        [CategorySummary(category_id=cid, **figures.get(cid, {})) for cid in existing],
+        update_conflicts=True, unique_fields=['category'], update_fields=FIELDS + ['updated_at'],
+    )
+    invalidate_categories()
+
+
+def sold_out(category_ids):
+    """after a stock update emptied products of category_ids, one id per product"""
+    for category_id, count in Counter(cid for cid in category_ids if cid is not None).items():
+        CategorySummary.objects.filter(category_id=category_id).update(in_stock_count=F('in_stock_count') - count)
+    if category_ids:
+        invalidate_categories()
+
+
+def rebuild():
+    """recomputes every path, depth and summary, after bulk writes that skip the models"""
+    categories = {c.id: c for c in Category.objects.only('id', 'parent_id', 'path', 'depth')}
+
+    def path_of(category):
+        parent = categories.get(category.parent_id)
+        return (path_of(parent) if parent else '') + f"{category.id:0{PATH_WIDTH}d}/"
+
+    changed = []
+    for category in categories.values():
+        path = path_of(category)
+        if path != category.path:
+            category.path, category.depth = path, path.count('/') - 1
+            changed.append(category)
+    Category.objects.bulk_update(changed, ['path', 'depth'], batch_size=500)
+    refresh(categories)
+
+
+def add(total, figures):
+    total['product_count'] += figures['product_count']
+    total['in_stock_count'] += figures['in_stock_count']
+    for field, pick in (('min_price', min), ('max_price', max)):
+        values = [v for v in (total[field], figures[field]) if v is not None]
+        total[field] = pick(values) if values else None
+
+
+def empty():
+    return dict.fromkeys(FIELDS, 0) | {'min_price': None, 'max_price': None}
+
+
+def own_figures(category):
+    summary = getattr(category, 'summary', None)
+    return {field: getattr(summary, field) for field in FIELDS} if summary else empty()
+
+
+def subtree_figures(categories):
+    """{category id: figures of it and everything under it} for categories holding whole subtrees"""
+    totals = {category.id: empty() for category in categories}
+    for category in categories:
+        figures = own_figures(category)
+        # the path lists the category and all of its ancestors
+        for ancestor in category.path.rstrip('/').split('/'):
+            total = totals.get(int(ancestor))
+            if total is not None:
+                add(total, figures)
+    return totals
+
+
+def subtree_figures_of(category):
+    """figures of category and everything under it, in one query"""
+    figures = CategorySummary.objects.filter(subtree(category.path, 'category__path')).aggregate(
+        product_count=Sum('product_count'), in_stock_count=Sum('in_stock_count'),
+        min_price=Min('min_price'), max_price=Max('max_price'),
+    )
+    return {field: value or 0 for field, value in figures.items() if field.endswith('count')} | {
+        'min_price': figures['min_price'], 'max_price': figures['max_price']}
@@ -0,0 +1,30 @@
+from collections import defaultdict
+
+from django.core.mail import send_mail, send_mass_mail
+
+from taskqueue.registry import task
+from .models import Order, OrderItem
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').get(id=order_id)
+    send_mail(f"Order {order.id} received", f"We received your order of {order.total}, pay to confirm it.", None, [order.user.email])
+
+
+@task
+def send_payment_receipt(order_id):
+    order = Order.objects.select_related('user').get(id=order_id)
+    send_mail(f"Payment for order {order.id}", f"Your payment of {order.total} was received.", None, [order.user.email])
+
+
+@task
+def notify_vendors(order_id, event):
+    """one mail per vendor listing their lines of the order, event is 'ordered' or 'paid'"""
+    lines = defaultdict(list)
+    for vendor, name, quantity in OrderItem.objects.filter(order_id=order_id).values_list('vendor', 'product__name', 'quantity').order_by('id'):
+        lines[vendor].append(f"{quantity} x {name}")
+    send_mass_mail([
+        (f"Order {order_id} {event}", '\n'.join(items), None, [vendor])
+        for vendor, items in lines.items() if vendor
+    ])
@@ -1,3 +1,1351 @@
-from django.test import TestCase
+import csv
+import json
+import math
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import ExitStack
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from KaraKata.cache import LocalLRUCache
+from KaraKata.db import PRIMARY_COOKIE, ReplicaRouter, health
+from KaraKata.testing import EndpointQueryBudgetMixin
+from accounts.models import CustomUser
+from accounts.serializers import CustomTokenObtainPairSerializer
+from shipping.models import ShippingAddress
+from .imports import ProductImporter, parse_rows
+from .cache import get_response_cache, invalidate_all
+from .models import Category, CategorySummary, IdempotencyKey, InventoryEvent, InventorySnapshot, Product, Cart, CartItem, Order, OrderItem, StockHold
+from .search import MemoryIndex, ProductSearchFilter, get_search_index
+from .serializers import LeanOrderSerializer, OrderSerializer
+from .seed import seed_marketplace
+from .slugs import assign_slugs
+from . import holds, idempotency, inventory, states, summaries
+from .inventory import release_order_stock
+from .stock import InsufficientStock, reserve_order_stock, reserve_stock
+from .views import claim_payment
+
+
+class CheckoutQueryCountTests(TestCase):
+    """checkout must cost the same number of queries whatever the cart size"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.address = ShippingAddress.objects.create(
+            user=self.customer, full_name='Ada Obi', phone='0800', address_line='1 Marina', city='Lagos', state='Lagos')
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def fill_cart(self, lines):
+        """creates a cart with the given number of lines, one product per line"""
+        cart, _ = Cart.objects.get_or_create(user=self.customer)
+        products = Product.objects.bulk_create([
+            Product(vendor=self.vendor, name=f'Item {i}', slug=f'item-{lines}-{i}', description='', price=Decimal('10.00'), stock=5)
+            for i in range(lines)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2, price=product.price) for product in products
+        ])
+
+    def checkout(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/orders/checkout/', {'shipping_address_id': self.address.id}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response, len(ctx.captured_queries)
+
+    def test_checkout_creates_order_and_clears_cart(self):
+        self.fill_cart(3)
+        response, _ = self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual(order.total, Decimal('60.00'))
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(set(OrderItem.objects.values_list('vendor', flat=True)), {self.vendor.email})
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_query_count_is_constant(self):
+        counts = {}
+        for lines in (1, 50, 500):
+            self.fill_cart(lines)
+            _, counts[lines] = self.checkout()
+
+        # the only growth allowed is the backend splitting bulk_create into batches,
+        # for the order items and for the holds of the lines
+        batch_sizes = [
+            connection.ops.bulk_batch_size([f for f in model._meta.concrete_fields if not f.primary_key], range(500))
+            for model in (OrderItem, StockHold)
+        ]
+        for lines, count in counts.items():
+            self.assertEqual(count, counts[1] + sum(math.ceil(lines / size) - 1 for size in batch_sizes), counts)
+
+
+class VerifyPaymentTests(TestCase):
+    """payment verification decrements stock exactly once per reference"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.product = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.other = Product.objects.create(vendor=self.vendor, name='Case', description='', price=Decimal('5.00'), stock=1)
+        self.order = Order.objects.create(user=self.customer, total=Decimal('0'), payment_reference='txn_1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def verify(self, reference='txn_1'):
+        return self.client.get(f'/api/{self.order.id}/verify-payment/', {'reference': reference})
+
+    def test_retried_callback_does_not_decrement_twice(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=self.product.price)
+
+        self.assertEqual(self.verify().data['message'], 'Payment verified successfully')
+        self.assertEqual(self.verify().data['message'], 'Payment already verified')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_unknown_reference_is_rejected(self):
+        self.assertEqual(self.verify('txn_other').status_code, 400)
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price=self.product.price)
+        OrderItem.objects.create(order=self.order, product=self.other, quantity=3, price=self.other.price)
+
+        self.assertEqual(self.verify().status_code, 409)
+
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertFalse(self.order.is_paid)
+        self.assertEqual(self.product.stock, 5)
+
+
+class StockReservationStressTests(TransactionTestCase):
+    """many threads reserving one hot product never oversell it"""
+
+    def test_hot_product_is_never_oversold(self):
+        vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        product = Product.objects.create(vendor=vendor, name='Flash sale', description='', price=Decimal('1.00'), stock=20)
+        results = []
+        start = threading.Barrier(50)
+
+        def buyer():
+            start.wait()
+            try:
+                reserve_stock({product.id: 1})
+                results.append(True)
+            except InsufficientStock:
+                results.append(False)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buyer) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), 20)
+        self.assertEqual(product.stock, 0)
+
+
+class VendorDashboardTests(TestCase):
+    """the dashboard aggregates in the database and pages by cursor"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        other_vendor = CustomUser.objects.create_user('other@example.com', 'pass', role='vendor')
+        customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        product = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('100.00'))
+        other_product = Product.objects.create(vendor=other_vendor, name='Case', description='', price=Decimal('5.00'))
+        for i in range(15):
+            order = Order.objects.create(user=customer, total=Decimal('0'), is_paid=i < 12)
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price, vendor=self.vendor.email)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price, vendor=self.vendor.email)
+            OrderItem.objects.create(order=order, product=other_product, quantity=1, price=other_product.price, vendor=other_vendor.email)
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def test_totals_and_pages(self):
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get('/api/vendor-dashboard/')
+        data = response.data
+        self.assertEqual(data['total_earnings'], Decimal('3600.00'))
+        self.assertEqual(data['total_orders'], 12)
+        self.assertEqual(len(data['orders']), 10)
+        self.assertEqual(data['orders'][0]['order_total'], '300.00')
+        self.assertEqual(data['orders'][0]['item_count'], 2)
+        self.assertEqual(len(data['orders'][0]['items']), 2)
+
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(data['next'])
+        self.assertEqual(len(response.data['orders']), 2)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(first.captured_queries), len(second.captured_queries))
+
+        seen = [o['order_id'] for o in data['orders'] + response.data['orders']]
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+
+class KeysetPaginationTests(TestCase):
+    """walking the cursor visits every product once in the requested order"""
+
+    def setUp(self):
+        vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        Product.objects.bulk_create([
+            Product(vendor=vendor, name=f'Item {i}', slug=f'item-{i}', description='', price=Decimal(i % 7), stock=1)
+            for i in range(35)
+        ])
+        # bulk_create skips the signals that invalidate cached product lists
+        invalidate_all()
+        self.client = APIClient()
+
+    def walk(self, url):
+        seen = []
+        while url:
+            data = self.client.get(url).data
+            self.assertLessEqual(len(data['results']), 10)
+            seen += data['results']
+            url = data['next']
+        return seen
+
+    def test_default_ordering_is_newest_first(self):
+        seen = self.walk('/api/products/')
+        self.assertEqual([p['id'] for p in seen], list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_ordering_fields_still_apply(self):
+        seen = self.walk('/api/products/?ordering=price')
+        expected = Product.objects.order_by('price', '-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual([p['id'] for p in seen], list(expected))
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        cursor = self.client.get('/api/products/').data['next']
+        self.assertEqual(self.client.get(cursor + '&ordering=price').status_code, 404)
+
+
+class ProductSearchTests(TestCase):
+    """?search= is served from the full text index and combines with ProductFilter"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.laptop = Product.objects.create(vendor=self.vendor, name='HP Laptop', description='Fast notebook', price=Decimal('900.00'))
+        self.bag = Product.objects.create(vendor=self.vendor, name='Carry bag', description='Fits any laptop', price=Decimal('40.00'))
+        self.phone = Product.objects.create(vendor=self.vendor, name='iPhone 16', description='Phone', price=Decimal('1200.00'))
+        self.client = APIClient()
+
+    def search(self, query, **params):
+        return [p['id'] for p in self.client.get('/api/products/', {'search': query, **params}).data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('laptop'), [self.laptop.id, self.bag.id])
+
+    def test_prefix_and_every_token_must_match(self):
+        self.assertEqual(self.search('lap note'), [self.laptop.id])
+        self.assertEqual(self.search('iph'), [self.phone.id])
+
+    def test_respects_product_filter(self):
+        self.assertEqual(self.search('laptop', max_price='100'), [self.bag.id])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.phone.name = 'Galaxy tablet'
+        self.phone.save()
+        self.assertEqual(self.search('iphone'), [])
+        self.assertEqual(self.search('galaxy'), [self.phone.id])
+        self.laptop.delete()
+        self.assertEqual(self.search('laptop'), [self.bag.id])
+
+    def test_memory_index_matches_database_index(self):
+        index = MemoryIndex()
+        for query in ('laptop', 'lap note', 'iph', 'nothing'):
+            self.assertEqual(index.search(query, 10), get_search_index().search(query, 10))
+        cheap = Product.objects.filter(price__lt=100)
+        self.assertEqual(index.search('laptop', 10, cheap), get_search_index().search('laptop', 10, cheap))
+
+    def test_filters_apply_before_the_hits_are_cut(self):
+        bags = Category.objects.create(name='Bags', slug='bags')
+        Product.objects.bulk_create([
+            Product(vendor=self.vendor, name=f'Phone {i}', slug=f'phone-{i}', description='', price=Decimal('10.00'))
+            for i in range(ProductSearchFilter.max_results + 50)
+        ])
+        pouch = Product.objects.create(vendor=self.vendor, category=bags, name='Pouch', description='holds a phone', price=Decimal('5.00'))
+        get_search_index().rebuild()
+        self.assertEqual(self.search('phone', category=bags.id), [pouch.id])
+
+
+class QueryPlanTests(TestCase):
+    """the main endpoints must not regress to full table scans"""
+
+    def test_no_full_scans(self):
+        call_command('explain_queries', '--fail-on-scan', stdout=StringIO())
+
+
+class SlugAllocationTests(TestCase):
+    """new product slugs take the next free suffix in a single lookup"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        Product.objects.bulk_create(
+            [Product(vendor=self.vendor, name='iPhone 16', slug='iphone-16', description='', price=1)]
+            + [Product(vendor=self.vendor, name='iPhone 16', slug=f'iphone-16-{i}', description='', price=1) for i in range(1, 120)]
+            + [Product(vendor=self.vendor, name='iPhone 16 Pro', slug='iphone-16-pro', description='', price=1)]
+        )
+
+    def create(self, name):
+        return Product.objects.create(vendor=self.vendor, name=name, description='', price=1)
+
+    def test_next_suffix_in_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            product = self.create('iPhone 16')
+        lookups = [q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(product.slug, 'iphone-16-120')
+        self.assertEqual(self.create('iPhone 16 Pro').slug, 'iphone-16-pro-1')
+        self.assertEqual(self.create('Galaxy S24').slug, 'galaxy-s24')
+
+    def test_lost_race_retries_with_a_fresh_slug(self):
+        with mock.patch('products.models.next_slug', side_effect=['iphone-16-5', 'iphone-16-120']):
+            product = self.create('iPhone 16')
+        self.assertEqual(product.slug, 'iphone-16-120')
+
+    def test_bulk_assignment(self):
+        products = assign_slugs(Product, [
+            Product(vendor=self.vendor, name=name, description='', price=1)
+            for name in ('iPhone 16', 'iPhone 16', 'Galaxy S24', 'Galaxy S24')
+        ])
+        self.assertEqual([p.slug for p in products], ['iphone-16-120', 'iphone-16-121', 'galaxy-s24', 'galaxy-s24-1'])
+
+
+class CartTotalsTests(TestCase):
+    """cart totals are stored and moved incrementally by every cart action"""
+
+    def setUp(self):
+        vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.phone = Product.objects.create(vendor=vendor, name='Phone', description='', price=Decimal('100.00'), stock=10)
+        self.case = Product.objects.create(vendor=vendor, name='Case', description='', price=Decimal('5.50'), stock=10)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def cart(self):
+        return Cart.objects.get(user=self.customer)
+
+    def test_actions_keep_totals_in_step(self):
+        self.client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': 2})
+        self.client.post('/api/cart/add/', {'product': self.case.id, 'quantity': 1})
+        self.client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': 1})
+        cart = self.cart()
+        self.assertEqual((cart.total, cart.item_count), (Decimal('305.50'), 4))
+
+        case_item = CartItem.objects.get(product=self.case)
+        self.client.patch(f'/api/cart/{case_item.id}/update/', {'quantity': 3})
+        cart = self.cart()
+        self.assertEqual((cart.total, cart.item_count), (Decimal('316.50'), 6))
+
+        self.client.delete(f'/api/cart/{case_item.id}/remove/')
+        cart = self.cart()
+        self.assertEqual((cart.total, cart.item_count), (Decimal('300.00'), 3))
+
+    def test_retrieve_serves_stored_total_with_one_prefetch(self):
+        self.client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': 2})
+        self.client.post('/api/cart/add/', {'product': self.case.id, 'quantity': 2})
+        cart = self.cart()
+        with self.assertNumQueries(2): # cart, items joined to product
+            data = self.client.get(f'/api/cart/{cart.id}/').data
+        self.assertEqual(data['total'], '211.00')
+        self.assertEqual([item['product_name'] for item in data['items']], ['Phone', 'Case'])
+
+    def test_reconcile_repairs_drift(self):
+        self.client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': 2})
+        Cart.objects.update(total=1, item_count=9)
+        call_command('reconcile_cart_totals', stdout=StringIO())
+        cart = self.cart()
+        self.assertEqual((cart.total, cart.item_count), (Decimal('200.00'), 2))
+
+
+class EndpointQueryBudgetTests(EndpointQueryBudgetMixin, TestCase):
+    """query budgets for the main endpoints against a realistically sized marketplace"""
+    query_budgets = [
+        ('product list', 'anonymous', '/api/products/', 1),
+        ('product list filtered', 'anonymous', '/api/products/?min_price=10&max_price=2000&ordering=price', 1),
+        ('product search', 'anonymous', '/api/products/?search=phone', 2),
+        ('product detail', 'anonymous', '/api/products/{self.product.id}/', 1),
+        ('cart', 'customer', '/api/cart/{self.cart.id}/', 2),
+        ('order history', 'customer', '/api/orders/', 2), # orders joined to address, items joined to product
+        ('vendor order items', 'vendor', '/api/order-items/', 1),
+        ('vendor dashboard', 'vendor', '/api/vendor-dashboard/', 3),
+        ('category tree', 'anonymous', '/api/categories/', 1), # categories joined to their summaries
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        vendors, customers, products = seed_marketplace(vendors=5, products_per_vendor=40, customers=20, orders_per_customer=5)
+        cls.vendor_user, cls.customer_user, cls.product = vendors[0], customers[0], products[0]
+        cls.cart = Cart.objects.get(user=cls.customer_user)
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.customer = APIClient()
+        self.customer.force_authenticate(self.customer_user)
+        self.vendor = APIClient()
+        self.vendor.force_authenticate(self.vendor_user)
+
+
+class QueryStatsMiddlewareTests(TestCase):
+    """the middleware reports query count, time and repeated statements"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.product = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('1.00'))
+
+    def test_headers_in_debug(self):
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(response['X-Query-Count'], '1')
+        self.assertEqual(response['X-Query-Duplicates'], '0')
+        self.assertIn('X-Query-Time-Ms', response)
+
+    def test_structured_log_in_production(self):
+        with self.settings(QUERY_STATS_HEADERS=False), self.assertLogs('karakata.queries') as logs:
+            # the middleware reads the setting when it is built, which happens on this test's first request
+            response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertNotIn('X-Query-Count', response)
+        self.assertIn('"query_count": 1', logs.output[0])
+
+
+class BenchmarkScenarioTests(TransactionTestCase):
+    """every load scenario runs cleanly against seeded data"""
+
+    def test_scenarios_run_without_errors(self):
+        seed_marketplace(vendors=2, products_per_vendor=30, customers=2, orders_per_customer=3)
+        call_command('rebuild_search_index', stdout=StringIO())
+        out = StringIO()
+        call_command('bench_api', '--iterations', '2', '--concurrency', '2', stdout=out)
+        report = out.getvalue()
+        for line in report.splitlines():
+            columns = line.split()
+            # request rows end with n, err, rps, p50, p95, p99, queries
+            if len(columns) > 7 and columns[-7].isdigit():
+                self.assertEqual(columns[-6], '0', line)
+        self.assertIn('vendor dashboard', report)
+
+    def test_flash_sale_is_not_oversold(self):
+        out = StringIO()
+        call_command('bench_flash_sale', '--buyers', '300', '--units', '20', '--concurrency', '12', stdout=out)
+        self.assertIn('units held 20, available 0', out.getvalue())
+        self.assertIn('not oversold', out.getvalue())
+        self.assertFalse(CustomUser.objects.filter(email__startswith='flash-').exists())
+
+    def test_asgi_comparison_runs_without_errors(self):
+        seed_marketplace(vendors=2, products_per_vendor=10, customers=2, orders_per_customer=2)
+        out = StringIO()
+        call_command('bench_asgi', '--requests', '20', '--concurrency', '10', '--gateway-latency', '0.001', stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(sorted(columns[-7] for columns in rows), sorted(['sync', 'async'] * 6))
+        for columns in rows:
+            self.assertEqual(columns[-5], '0', columns)
+
+
+class ProductResponseCacheTests(TestCase):
+    """product list and detail are cached and invalidated per product and category"""
+
+    def setUp(self):
+        get_response_cache().clear()
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.bags = Category.objects.create(name='Bags', slug='bags')
+        self.phone = Product.objects.create(vendor=self.vendor, category=self.phones, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.bag = Product.objects.create(vendor=self.vendor, category=self.bags, name='Bag', description='', price=Decimal('20.00'), stock=5)
+        self.client = APIClient()
+
+    def test_repeat_reads_are_served_without_queries(self):
+        first = self.client.get('/api/products/?ordering=price')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/?ordering=price&utm_source=mail')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+    def test_matching_etag_gets_304(self):
+        etag = self.client.get(f'/api/products/{self.phone.id}/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/products/{self.phone.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_write_invalidates_only_affected_entries(self):
+        urls = [f'/api/products/{self.phone.id}/', f'/api/products/{self.bag.id}/',
+                f'/api/products/?category={self.phones.id}', f'/api/products/?category={self.bags.id}']
+        for url in urls:
+            self.client.get(url)
+
+        vendor = APIClient()
+        vendor.force_authenticate(self.vendor)
+        vendor.patch(f'/api/products/{self.phone.id}/', {'price': '90.00'})
+
+        self.assertEqual([self.client.get(url)['X-Cache'] for url in urls], ['MISS', 'HIT', 'MISS', 'HIT'])
+        self.assertEqual(self.client.get(urls[0]).data['price'], '90.00')
+
+    def test_new_product_shows_in_cached_list(self):
+        self.client.get('/api/products/')
+        Product.objects.create(vendor=self.vendor, category=self.bags, name='Tote', description='', price=Decimal('5.00'))
+        self.assertEqual(len(self.client.get('/api/products/').data['results']), 3)
+
+    def test_stock_reservation_refreshes_cached_product(self):
+        self.client.get(f'/api/products/{self.phone.id}/')
+        reserve_stock({self.phone.id: 2})
+        self.assertEqual(self.client.get(f'/api/products/{self.phone.id}/').data['stock'], 3)
+
+    def test_local_cache_evicts_least_recently_used_and_expired(self):
+        cache = LocalLRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+        cache.set('d', 4, timeout=0)
+        self.assertIsNone(cache.get('d'))
+
+
+class LeanOrderSerializerTests(TestCase):
+    """the order list matches OrderSerializer, with a compact product per item"""
+
+    def setUp(self):
+        _, customers, _ = seed_marketplace(vendors=2, products_per_vendor=5, customers=1, orders_per_customer=4, items_per_order=3)
+        self.customer = customers[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_matches_order_serializer(self):
+        results = self.client.get('/api/orders/').data['results']
+        orders = Order.objects.filter(user=self.customer).order_by('-created_at', '-id').select_related('shipping_address').prefetch_related('items__product')
+        expected = OrderSerializer(orders, many=True).data
+        self.assertEqual(len(results), 4)
+        for lean, full in zip(results, expected):
+            self.assertEqual({k: v for k, v in lean.items() if k != 'items'}, {k: v for k, v in full.items() if k != 'items'})
+            for lean_item, full_item in zip(lean['items'], sorted(full['items'], key=lambda item: item['id'])):
+                product = full_item.pop('product')
+                self.assertEqual(lean_item.pop('product'), {key: product[key] for key in ('id', 'name', 'slug', 'price')})
+                self.assertEqual(lean_item, full_item)
+
+    def test_filter_backends_apply(self):
+        totals = [Decimal(order['total']) for order in self.client.get('/api/orders/', {'ordering': 'total'}).data['results']]
+        self.assertEqual(totals, sorted(Order.objects.filter(user=self.customer).values_list('total', flat=True)))
+
+    def test_product_summaries_are_shared_within_a_request(self):
+        rows = Order.objects.filter(user=self.customer).values(*LeanOrderSerializer.columns())
+        request = mock.Mock(spec=[])
+        first = LeanOrderSerializer(request).to_representation(rows)
+        second = LeanOrderSerializer(request).to_representation(rows)
+        self.assertIs(first[0]['items'][0]['product'], second[0]['items'][0]['product'])
+
+
+@override_settings(PRODUCT_IMAGE_WORKERS=0)
+class ImageVariantTests(TestCase):
+    """uploads get resized, content addressed copies listed by the serializer"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_response_cache().clear()
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+
+    def upload(self, name='phone.png', color='red'):
+        out = BytesIO()
+        Image.new('RGB', (1200, 800), color).save(out, 'PNG')
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(vendor=self.vendor, name='Phone', description='', price=1,
+                                          image=SimpleUploadedFile(name, out.getvalue(), content_type='image/png'))
+
+    def test_upload_builds_every_variant(self):
+        product = self.upload()
+        variants = self.client.get(f'/api/products/{product.id}/').json()['image_variants']
+        self.assertEqual(set(variants), {'thumbnail', 'card', 'zoom'})
+        name = Product.objects.get(pk=product.id).image_variants['variants']['thumbnail']['webp']
+        self.assertTrue(variants['thumbnail']['webp'].endswith(name))
+        with default_storage.open(name) as f:
+            self.assertEqual(Image.open(f).size, (160, 107))
+
+    def test_same_content_shares_variants(self):
+        first, second = self.upload('a.png'), self.upload('b.png')
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_variants['variants'], second.image_variants['variants'])
+        other = self.upload('c.png', 'blue')
+        other.refresh_from_db()
+        self.assertNotEqual(other.image_variants['variants'], first.image_variants['variants'])
+
+    def test_missing_variants_are_built_on_first_read(self):
+        product = self.upload()
+        Product.objects.filter(pk=product.pk).update(image_variants={})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(f'/api/products/{product.id}/').json()['image_variants'], {})
+        self.assertIn('card', self.client.get(f'/api/products/{product.id}/').json()['image_variants'])
+
+
+class CartBatchTests(TestCase):
+    """a batch of cart operations is validated and applied with a fixed number of queries"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.products = Product.objects.bulk_create([
+            Product(vendor=self.vendor, name=f'Item {i}', slug=f'item-{i}', description='', price=Decimal('2.50'), stock=10)
+            for i in range(60)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def batch(self, operations):
+        return self.client.post('/api/cart/batch/', {'operations': operations}, format='json')
+
+    def test_operations_apply_in_order(self):
+        a, b, c = (p.id for p in self.products[:3])
+        self.client.post('/api/cart/add/', {'product': c, 'quantity': 2})
+        response = self.batch([
+            {'op': 'add', 'product': a, 'quantity': 2},
+            {'op': 'add', 'product': a},
+            {'op': 'set', 'product': b, 'quantity': 4},
+            {'op': 'remove', 'product': b},
+            {'op': 'set', 'product': c, 'quantity': 5},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual({item['product']: item['quantity'] for item in response.data['items']}, {a: 3, c: 5})
+        self.assertEqual((response.data['total'], response.data['item_count']), ('20.00', 8))
+
+    def test_remove_ignores_a_quantity(self):
+        a = self.products[0].id
+        self.client.post('/api/cart/add/', {'product': a, 'quantity': 2})
+        response = self.batch([{'op': 'remove', 'product': a, 'quantity': 5}])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['items'], [])
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        counts = []
+        for products in (self.products[:5], self.products[5:60]):
+            self.client.post('/api/cart/add/', {'product': products[0].id})
+            operations = [{'op': 'add', 'product': p.id, 'quantity': 2} for p in products]
+            operations.append({'op': 'remove', 'product': products[0].id})
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.batch(operations).status_code, 200)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_stock_is_checked_before_anything_is_written(self):
+        a, b = self.products[0].id, self.products[1].id
+        response = self.batch([{'op': 'add', 'product': a, 'quantity': 3}, {'op': 'add', 'product': b, 'quantity': 11}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['products'], [b])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_unknown_products_and_bad_operations_are_rejected(self):
+        self.assertEqual(self.batch([{'op': 'add', 'product': 0}]).status_code, 404)
+        self.assertEqual(self.batch([{'op': 'set', 'product': self.products[0].id}]).status_code, 400)
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/batch/', [1, 2], format='json').status_code, 400)
+
+
+class VendorExportTests(TestCase):
+    """vendor exports stream csv and ndjson rows of the vendor's own sales"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        other = CustomUser.objects.create_user('other@example.com', 'pass', role='vendor')
+        customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        phone = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('100.00'))
+        case = Product.objects.create(vendor=other, name='Case', description='', price=Decimal('5.00'))
+        for day, paid in ((1, True), (2, False), (3, True)):
+            order = Order.objects.create(user=customer, total=Decimal('0'), is_paid=paid)
+            Order.objects.filter(pk=order.pk).update(created_at=f'2026-03-0{day}T10:00:00Z')
+            OrderItem.objects.create(order=order, product=phone, quantity=day, price=phone.price, vendor=self.vendor.email)
+            OrderItem.objects.create(order=order, product=case, quantity=1, price=case.price, vendor=other.email)
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def export(self, path, **params):
+        response = self.client.get(f'/api/vendor-exports/{path}', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_items_with_date_range(self):
+        rows = list(csv.DictReader(StringIO(self.export('items.csv', **{'from': '2026-03-02', 'to': '2026-03-03'}))))
+        self.assertEqual([(row['quantity'], row['line_total'], row['is_paid']) for row in rows], [('2', '200.00', 'False'), ('3', '300.00', 'True')])
+
+    def test_ndjson_orders_and_sales(self):
+        orders = [json.loads(line) for line in self.export('orders.ndjson').splitlines()]
+        self.assertEqual([(o['lines'], o['subtotal']) for o in orders], [(1, '100.00'), (1, '200.00'), (1, '300.00')])
+        sales = [json.loads(line) for line in self.export('sales.ndjson').splitlines()]
+        self.assertEqual(sales, [{'product_id': sales[0]['product_id'], 'product_name': 'Phone', 'orders': 2, 'units': 4, 'revenue': '400.00'}])
+
+    def test_cancelled_lines_are_not_sales(self):
+        OrderItem.objects.filter(vendor=self.vendor.email, quantity=3).update(status='cancelled')
+        orders = [json.loads(line) for line in self.export('orders.ndjson').splitlines()]
+        self.assertEqual([(o['lines'], o['units'], o['subtotal']) for o in orders], [(1, 1, '100.00'), (1, 2, '200.00'), (0, 0, '0.00')])
+        sales = [json.loads(line) for line in self.export('sales.ndjson').splitlines()]
+        self.assertEqual([(s['orders'], s['units'], s['revenue']) for s in sales], [(1, 1, '100.00')])
+        dashboard = self.client.get('/api/vendor-dashboard/').data
+        self.assertEqual((dashboard['total_earnings'], dashboard['total_orders'], dashboard['total_items']), (Decimal('100.00'), 1, 1))
+        self.assertEqual([order['order_total'] for order in dashboard['orders']], ['100.00'])
+
+    def test_header_is_sent_before_the_query(self):
+        response = self.client.get('/api/vendor-exports/items.csv')
+        content = iter(response.streaming_content)
+        with self.assertNumQueries(0):
+            self.assertTrue(next(content).startswith(b'id,order_id,'))
+        with self.assertNumQueries(1):
+            list(content)
+
+    def test_bad_dates_and_customers_are_rejected(self):
+        self.assertEqual(self.client.get('/api/vendor-exports/items.csv', {'from': 'yesterday'}).status_code, 400)
+        customer = APIClient()
+        customer.force_authenticate(CustomUser.objects.get(email='customer@example.com'))
+        self.assertEqual(customer.get('/api/vendor-exports/items.csv').status_code, 403)
+
+
+class ProductImportTests(TestCase):
+    """bulk imports upsert by sku then slug, report bad rows and round trip with the export"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.other = CustomUser.objects.create_user('other@example.com', 'pass', role='vendor')
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.phone = Product.objects.create(vendor=self.vendor, sku='PH-1', name='Phone', description='', price=Decimal('100.00'))
+        Product.objects.create(vendor=self.other, name='Case', slug='case', description='', price=Decimal('5.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.vendor)
+
+    def run_import(self, text, fmt='csv', chunk_size=2):
+        return ProductImporter(self.vendor, chunk_size).run(parse_rows(StringIO(text), fmt))
+
+    def test_upserts_creates_and_reports_errors(self):
+        report = self.run_import(
+            "sku,slug,name,description,price,stock,category\n"
+            "PH-1,,Phone Pro,new,120.50,4,phones\n"
+            ",,Charger,,9.99,10,\n"
+            "CH-2,,Charger,,9.99,3,\n"
+            ",case,Stolen,,1.00,1,\n"
+            ",,Broken,,-1,1,\n"
+            ",,Cable,,2.00,1,cables\n"
+        )
+        self.assertEqual((report.created, report.updated, report.error_count), (2, 1, 3))
+        self.assertEqual([line for line, _ in report.errors], [5, 6, 7])
+
+        self.phone.refresh_from_db()
+        self.assertEqual((self.phone.name, self.phone.price, self.phone.stock, self.phone.category, self.phone.slug),
+                         ('Phone Pro', Decimal('120.50'), 4, self.phones, 'phone'))
+        self.assertEqual(sorted(Product.objects.filter(name='Charger').values_list('slug', flat=True)), ['charger', 'charger-1'])
+        self.assertEqual(Product.objects.get(slug='case').name, 'Case')
+
+    def test_imported_products_are_searchable_and_uncached(self):
+        self.assertEqual(self.client.get('/api/products/').data['results'][0]['name'], 'Case')
+        self.run_import('{"name": "Solar Lamp", "price": "30.00"}\nnot json\n', fmt='ndjson')
+        response = self.client.get('/api/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['name'], 'Solar Lamp')
+        self.assertEqual([p['name'] for p in self.client.get('/api/products/', {'search': 'solar'}).data['results']], ['Solar Lamp'])
+
+    def test_api_export_then_import_round_trips(self):
+        exported = b''.join(self.client.get('/api/vendor-catalogue.ndjson').streaming_content)
+        self.assertEqual([json.loads(line)['sku'] for line in exported.splitlines()], ['PH-1'])
+
+        upload = SimpleUploadedFile('products.ndjson', exported.replace(b'Phone', b'Phone 2'))
+        response = self.client.post('/api/vendor-catalogue.ndjson', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'created': 0, 'updated': 1, 'error_count': 0, 'errors': []})
+        self.assertEqual(Product.objects.get(pk=self.phone.pk).name, 'Phone 2')
+
+    def test_chunk_queries_do_not_grow_with_rows(self):
+        rows = ''.join(f'SKU-{n},,Item {n},,1.00,1,phones\n' for n in range(200))
+        with CaptureQueriesContext(connection) as queries:
+            report = self.run_import('sku,slug,name,description,price,stock,category\n' + rows, chunk_size=200)
+        self.assertEqual(report.created, 200)
+        self.assertLess(len(queries), 20)
+
+    def test_command_reads_the_file_extension(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('sku,name,price\nLAMP,Lamp,3.00\n')
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('import_products', 'vendor@example.com', f.name, stdout=out)
+        self.assertIn('created 1, updated 0', out.getvalue())
+        out = StringIO()
+        call_command('export_products', 'vendor@example.com', stdout=out)
+        self.assertEqual([row['sku'] for row in csv.DictReader(StringIO(out.getvalue()))], ['PH-1', 'LAMP'])
+
+    def test_unreadable_files_are_reported_not_raised(self):
+        header = b"sku,slug,name,description,price,stock,category\n"
+        for content, line in (
+            (b'\xff\xfe' + header, 1),
+            (header + b",,Charger,,9.99,10,\n,,Cable," + b'x' * (csv.field_size_limit() + 1) + b",2.00,1,\n", 3),
+        ):
+            upload = SimpleUploadedFile('products.csv', content, content_type='text/csv')
+            response = self.client.post('/api/vendor-catalogue.csv', {'file': upload}, format='multipart')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['error_count'], 1)
+            self.assertEqual(response.data['errors'][0]['line'], line)
+
+
+class CategorySummaryTests(TestCase):
+    """category paths follow their parents and summaries follow product writes"""
+
+    def setUp(self):
+        invalidate_all()
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.electronics = Category.objects.create(name='Electronics', slug='electronics')
+        self.phones = Category.objects.create(name='Phones', slug='phones', parent=self.electronics)
+        self.smartphones = Category.objects.create(name='Smartphones', slug='smartphones', parent=self.phones)
+        self.client = APIClient()
+
+    def product(self, category, price, stock=1):
+        return Product.objects.create(vendor=self.vendor, category=category, name='Item', description='', price=Decimal(price), stock=stock)
+
+    def figures(self, category):
+        summary = CategorySummary.objects.get(category=category)
+        return summary.product_count, summary.in_stock_count, summary.min_price, summary.max_price
+
+    def test_moving_a_category_moves_its_subtree(self):
+        gadgets = Category.objects.create(name='Gadgets', slug='gadgets')
+        self.phones.parent = gadgets
+        self.phones.save()
+        self.smartphones.refresh_from_db()
+        self.assertEqual(self.smartphones.path, f'{gadgets.id:08d}/{self.phones.id:08d}/{self.smartphones.id:08d}/')
+        self.assertEqual(self.smartphones.depth, 2)
+
+        staff = CustomUser.objects.create_user('staff@example.com', 'pass')
+        self.client.force_authenticate(staff)
+        response = self.client.patch(f'/api/categories/{self.phones.id}/', {'parent': self.smartphones.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_summaries_follow_saves_deletes_and_sell_outs(self):
+        phone = self.product(self.smartphones, '300.00', stock=2)
+        self.product(self.smartphones, '100.00', stock=0)
+        self.assertEqual(self.figures(self.smartphones), (2, 1, Decimal('100.00'), Decimal('300.00')))
+
+        phone.category = self.phones
+        phone.save()
+        self.assertEqual(self.figures(self.smartphones), (1, 0, Decimal('100.00'), Decimal('100.00')))
+        self.assertEqual(self.figures(self.phones), (1, 1, Decimal('300.00'), Decimal('300.00')))
+
+        reserve_stock({phone.id: 2})
+        self.assertEqual(self.figures(self.phones)[:2], (1, 0))
+        phone.delete()
+        self.assertEqual(self.figures(self.phones), (0, 0, None, None))
+
+    def test_tree_is_public_cached_and_rolled_up(self):
+        self.product(self.smartphones, '300.00')
+        self.product(self.phones, '50.00', stock=0)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/categories/')
+        self.assertEqual((response['X-Cache'], response['Cache-Control']), ('MISS', 'public, max-age=60'))
+        root = response.data[0]
+        self.assertEqual([c['slug'] for c in response.data], ['electronics', 'phones', 'smartphones'])
+        self.assertEqual(root['summary']['product_count'], 0)
+        self.assertEqual(root['subtree'], {'product_count': 2, 'in_stock_count': 1, 'min_price': Decimal('50.00'), 'max_price': Decimal('300.00')})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/categories/')['X-Cache'], 'HIT')
+        self.product(self.electronics, '10.00')
+        response = self.client.get('/api/categories/')
+        self.assertEqual((response['X-Cache'], response.data[0]['subtree']['product_count']), ('MISS', 3))
+
+        detail = self.client.get(f'/api/categories/{self.phones.id}/')
+        self.assertEqual(detail.data['subtree'], response.data[1]['subtree'])
+
+    def test_rebuild_repairs_bulk_created_categories(self):
+        bulk = Category.objects.bulk_create([Category(name='Bulk', slug='bulk', parent=self.smartphones)])[0]
+        Product.objects.bulk_create([Product(vendor=self.vendor, category=bulk, name='Bulk', slug='bulk', description='', price=Decimal('5.00'), stock=3)])
+        summaries.rebuild()
+        bulk.refresh_from_db()
+        self.assertEqual((bulk.path, bulk.depth), (self.smartphones.path + f'{bulk.id:08d}/', 3))
+        self.assertEqual(self.figures(bulk), (1, 1, Decimal('5.00'), Decimal('5.00')))
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica'], 'MAX_LAG': 5, 'HEALTH_CHECK_INTERVAL': 30})
+class ReplicaRoutingTests(TransactionTestCase):
+    """safe reads of opted in views go to the replica until the client writes"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        # the test replica mirrors the test database, so it sees committed rows
+        invalidate_all()
+        health.reset()
+        self.addCleanup(health.reset)
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.product = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def aliases(self, method, url, data=None):
+        used = []
+        with ExitStack() as stack:
+            for alias in ('default', 'replica'):
+                stack.enter_context(connections[alias].execute_wrapper(
+                    lambda execute, sql, params, many, context, alias=alias: used.append(alias) or execute(sql, params, many, context)))
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.content[:300])
+        return response, set(used)
+
+    def test_replicas_are_never_migrated(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'products'))
+        with override_settings(DATABASE_REPLICAS={'ALIASES': []}):
+            self.assertFalse(router.allow_migrate('replica', 'products'))
+            self.assertTrue(router.allow_migrate('default', 'products'))
+
+    def test_reads_go_to_the_replica_and_writes_pin_the_client(self):
+        self.assertEqual(self.aliases('get', '/api/products/')[1], {'replica'})
+        self.assertEqual(self.aliases('get', '/api/orders/')[1], {'replica'})
+        # the cart is not a replica view
+        self.assertEqual(self.aliases('get', '/api/cart/')[1], {'default'})
+
+        response, used = self.aliases('post', '/api/cart/add/', {'product': self.product.id, 'quantity': 1})
+        self.assertEqual(used, {'default'})
+        self.assertIn(PRIMARY_COOKIE, response.cookies)
+        self.assertEqual(self.aliases('get', '/api/orders/')[1], {'default'})
+
+        self.client.cookies[PRIMARY_COOKIE] = '0'
+        self.assertEqual(self.aliases('get', '/api/orders/')[1], {'replica'})
+
+    def test_unhealthy_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(health, 'check', return_value=False) as check:
+            self.assertEqual(self.aliases('get', '/api/orders/')[1], {'default'})
+            self.assertEqual(self.aliases('get', '/api/orders/')[1], {'default'})
+        # checked once per HEALTH_CHECK_INTERVAL, not per query
+        self.assertEqual(check.call_count, 1)
+
+    def test_replica_cache_entries_expire_with_the_lag(self):
+        with mock.patch.object(get_response_cache().backend, 'set', wraps=get_response_cache().backend.set) as cache_set:
+            self.aliases('get', f'/api/products/{self.product.id}/')
+        self.assertEqual(cache_set.call_args.args[2], 5)
+
+
+class AsyncEndpointTests(TestCase):
+    """the async twins answer like the sync views they mirror"""
+
+    def setUp(self):
+        invalidate_all()
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.phone = Product.objects.create(vendor=self.vendor, category=self.phones, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.bag = Product.objects.create(vendor=self.vendor, name='Bag', description='', price=Decimal('20.00'), stock=5)
+        self.order = Order.objects.create(user=self.customer, total=Decimal('100.00'))
+        OrderItem.objects.create(order=self.order, product=self.phone, quantity=1, price=self.phone.price)
+        token = CustomTokenObtainPairSerializer.get_token(self.customer).access_token
+        self.auth = {'headers': {'Authorization': f'Bearer {token}'}}
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    async def test_reads_match_the_sync_views(self):
+        for sync_url, async_url in [
+            ('/api/products/?ordering=price&max_price=50', '/api/async/products/?ordering=price&max_price=50'),
+            (f'/api/products/{self.phone.id}/', f'/api/async/products/{self.phone.id}/'),
+            ('/api/categories/', '/api/async/categories/'),
+            ('/api/orders/', '/api/async/orders/'),
+        ]:
+            expected = (await sync_to_async(self.client.get)(sync_url)).json()
+            response = await self.async_client.get(async_url, **self.auth)
+            self.assertEqual(response.status_code, 200, async_url)
+            self.assertEqual(response.json(), expected, async_url)
+
+    async def test_cart_is_private(self):
+        cart = await Cart.objects.acreate(user=self.customer)
+        await CartItem.objects.acreate(cart=cart, product=self.bag, quantity=2, price=self.bag.price)
+        response = await self.async_client.get(f'/api/async/cart/{cart.id}/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'][0]['product_name'], 'Bag')
+        self.assertEqual((await self.async_client.get(f'/api/async/cart/{cart.id}/')).status_code, 401)
+
+    async def test_errors_keep_the_drf_shape(self):
+        response = await self.async_client.get('/api/async/products/0/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('detail', response.json())
+        response = await self.async_client.get('/api/async/products/?min_price=cheap')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('min_price', response.json())
+        self.assertEqual((await self.async_client.post('/api/async/products/')).status_code, 405)
+
+    async def test_payment_is_claimed_once(self):
+        response = await self.async_client.post(f'/api/async/{self.order.id}/init-payment/', **self.auth)
+        self.assertEqual(response.status_code, 200, response.content)
+        url = f"/api/async/{self.order.id}/verify-payment/?reference={response.json()['reference']}"
+        self.assertEqual((await self.async_client.get(url, **self.auth)).json()['message'], 'Payment verified successfully')
+        self.assertEqual((await self.async_client.get(url, **self.auth)).json()['message'], 'Payment already verified')
+        await self.phone.arefresh_from_db()
+        self.assertEqual(self.phone.stock, 4)
+
+    async def test_retried_payment_with_a_key_initialises_once(self):
+        headers = {**self.auth['headers'], 'Idempotency-Key': 'pay-1'}
+        url = f'/api/async/{self.order.id}/init-payment/'
+        with mock.patch('products.payments.FakeGateway.initialize', return_value={'reference': 'txn_1', 'authorization_url': 'http://pay'}) as initialize:
+            first = await self.async_client.post(url, headers=headers)
+            second = await self.async_client.post(url, headers=headers)
+        self.assertEqual(initialize.call_count, 1)
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+
+
+class InventoryLedgerTests(TestCase):
+    """every stock change lands in the ledger and snapshots keep reads short"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.phones = Category.objects.create(name='Phones', slug='phones')
+        self.phone = Product.objects.create(vendor=self.vendor, category=self.phones, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.order = Order.objects.create(user=self.customer, total=Decimal('500.00'), payment_reference='txn_1')
+        OrderItem.objects.create(order=self.order, product=self.phone, quantity=5, price=self.phone.price)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def kinds(self):
+        return list(InventoryEvent.objects.filter(product=self.phone).order_by('id').values_list('kind', 'quantity'))
+
+    def test_sales_cancellations_and_vendor_changes_are_recorded(self):
+        self.phone.stock = 7
+        self.phone.save()
+        self.assertEqual(self.client.get(f'/api/{self.order.id}/verify-payment/', {'reference': 'txn_1'}).status_code, 200)
+        self.assertEqual(summaries.own_figures(Category.objects.get(pk=self.phones.pk))['in_stock_count'], 1)
+
+        release_order_stock(self.order)
+        # a second cancellation finds nothing held
+        self.assertEqual(release_order_stock(self.order), {})
+
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 7)
+        self.assertEqual(self.kinds(), [('restock', 5), ('restock', 2), ('sale', -5), ('cancellation', 5)])
+        self.assertEqual(inventory.stock_levels([self.phone.id]), {self.phone.id: 7})
+        self.assertEqual(inventory.vendor_stock(self.vendor), 7)
+
+    def test_snapshots_cover_settled_events(self):
+        Product.objects.create(vendor=self.vendor, name='Case', description='', price=Decimal('5.00'), stock=3)
+        self.phone.stock = 2
+        self.phone.save()
+        with mock.patch.object(inventory, 'SETTLE_SECONDS', -60):
+            self.assertEqual(inventory.compact(batch_size=1), 2)
+        self.assertEqual(InventorySnapshot.objects.get(product=self.phone).stock, 2)
+        self.phone.stock = 4
+        self.phone.save()
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(inventory.stock_levels([self.phone.id]), {self.phone.id: 4})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(inventory.vendor_stock(self.vendor), 7)
+        # the event after the snapshot is too fresh to settle
+        self.assertEqual(inventory.compact(), 0)
+
+    def test_reconciliation_records_drift_as_adjustments(self):
+        Product.objects.filter(pk=self.phone.pk).update(stock=2)
+        out = StringIO()
+        call_command('reconcile_inventory', '--dry-run', stdout=out)
+        self.assertIn(f'product {self.phone.id} drifted by -3', out.getvalue())
+        call_command('reconcile_inventory', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(self.kinds()[-1], ('adjustment', -3))
+        self.assertEqual(inventory.drift([self.phone.id]), {})
+
+    def test_imports_record_stock_changes(self):
+        self.phone.sku = 'PH-1'
+        self.phone.save()
+        rows = [(1, {'sku': 'PH-1', 'name': 'Phone', 'price': '100.00', 'stock': '9'}),
+                (2, {'sku': 'CS-1', 'name': 'Case', 'price': '5.00', 'stock': '4'})]
+        ProductImporter(self.vendor).run(rows)
+        self.assertEqual(self.kinds()[-1], ('restock', 4))
+        self.assertEqual(inventory.drift(Product.objects.values_list('id', flat=True)), {})
+
+
+class StockHoldTests(TestCase):
+    """cart lines hold their units until checkout, payment or expiry"""
+
+    def setUp(self):
+        self.vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.phone = Product.objects.create(vendor=self.vendor, name='Phone', description='', price=Decimal('100.00'), stock=3)
+        self.clients = []
+        for name in ('ada', 'bola'):
+            user = CustomUser.objects.create_user(f'{name}@example.com', 'pass')
+            ShippingAddress.objects.create(user=user, full_name=name, phone='0800', address_line='1 Marina', city='Lagos', state='Lagos')
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+        self.ada, self.bola = self.clients
+
+    def add(self, client, quantity):
+        return client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': quantity})
+
+    def available(self):
+        return self.ada.get('/api/products/availability/', {'ids': str(self.phone.id)}).data[0]['available']
+
+    def test_held_units_can_not_be_added_by_others(self):
+        self.assertEqual(self.add(self.ada, 2).status_code, 200)
+        self.assertEqual(self.available(), 1)
+        self.assertEqual(self.add(self.bola, 2).status_code, 400)
+        self.assertEqual(self.add(self.bola, 1).status_code, 200)
+        # raising a line needs free units, lowering it never does
+        item = CartItem.objects.get(cart__user__email='ada@example.com')
+        self.assertEqual(self.ada.patch(f'/api/cart/{item.id}/update/', {'quantity': 3}).status_code, 400)
+        self.assertEqual(self.ada.patch(f'/api/cart/{item.id}/update/', {'quantity': 1}).status_code, 200)
+        self.assertEqual(self.available(), 1)
+        self.ada.delete(f'/api/cart/{item.id}/remove/')
+        self.assertEqual(self.available(), 2)
+
+    def test_expired_holds_stop_counting_and_are_swept(self):
+        self.add(self.ada, 3)
+        StockHold.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.available(), 3)
+        self.assertEqual(self.add(self.bola, 3).status_code, 200)
+        # ada's lapsed line can not be checked out any more
+        address = ShippingAddress.objects.get(user__email='ada@example.com')
+        response = self.ada.post('/api/orders/checkout/', {'shipping_address_id': address.id}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['products'], [self.phone.id])
+        self.assertEqual(holds.sweep(batch_size=1), 1)
+        self.assertEqual(StockHold.objects.get().cart.user.email, 'bola@example.com')
+
+    def test_checkout_moves_holds_to_the_order_until_paid_or_cancelled(self):
+        self.add(self.ada, 2)
+        address = ShippingAddress.objects.get(user__email='ada@example.com')
+        order_id = self.ada.post('/api/orders/checkout/', {'shipping_address_id': address.id}, format='json').data['id']
+        self.assertEqual(StockHold.objects.get().order_id, order_id)
+        self.assertEqual(self.available(), 1)
+        self.assertEqual(self.add(self.bola, 2).status_code, 400)
+
+        reference = self.ada.post(f'/api/{order_id}/init-payment/').data['reference']
+        self.assertEqual(self.ada.get(f'/api/{order_id}/verify-payment/', {'reference': reference}).status_code, 200)
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.stock, 1)
+        self.assertFalse(StockHold.objects.exists())
+
+        self.add(self.bola, 1)
+        address = ShippingAddress.objects.get(user__email='bola@example.com')
+        order_id = self.bola.post('/api/orders/checkout/', {'shipping_address_id': address.id}, format='json').data['id']
+        self.assertEqual(self.bola.post(f'/api/orders/{order_id}/cancel/').status_code, 200)
+        self.assertEqual(self.available(), 1)
+
+    def test_payment_can_not_take_units_held_by_others(self):
+        order = Order.objects.create(user=self.vendor, total=Decimal('300.00'))
+        OrderItem.objects.create(order=order, product=self.phone, quantity=3, price=self.phone.price)
+        self.add(self.ada, 1)
+        with self.assertRaises(InsufficientStock):
+            reserve_order_stock(order)
+
+
+class IdempotencyTests(TransactionTestCase):
+    """retries sent with an Idempotency-Key replay the first response"""
+
+    def setUp(self):
+        vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.phone = Product.objects.create(vendor=vendor, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.user = CustomUser.objects.create_user('ada@example.com', 'pass')
+        self.address = ShippingAddress.objects.create(user=self.user, full_name='Ada', phone='0800', address_line='1 Marina', city='Lagos', state='Lagos')
+        self.client = self.client_for()
+        self.client.post('/api/cart/add/', {'product': self.phone.id, 'quantity': 2})
+
+    def client_for(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def checkout(self, key=None, client=None, address_id=None):
+        headers = {'Idempotency-Key': key} if key else {}
+        return (client or self.client).post('/api/orders/checkout/', {'shipping_address_id': address_id or self.address.id}, format='json', headers=headers)
+
+    def test_retried_checkout_replays_the_first_order(self):
+        first = self.checkout('retry-1')
+        second = self.checkout('retry-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_refused(self):
+        self.checkout('retry-1')
+        other = ShippingAddress.objects.create(user=self.user, full_name='Ada', phone='0800', address_line='2 Marina', city='Lagos', state='Lagos')
+        self.assertEqual(self.checkout('retry-1', address_id=other.id).status_code, 422)
+        self.assertEqual(self.checkout('x' * 256).status_code, 400)
+
+    def test_requests_without_a_key_are_not_stored(self):
+        self.assertEqual(self.checkout().status_code, 201)
+        self.assertEqual(self.checkout().status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_retried_payment_initialises_once(self):
+        order_id = self.checkout().data['id']
+        with mock.patch('products.payments.FakeGateway.initialize', return_value={'reference': 'txn_1', 'authorization_url': 'http://pay'}) as initialize:
+            first = self.client.post(f'/api/{order_id}/init-payment/', headers={'Idempotency-Key': 'pay-1'})
+            second = self.client.post(f'/api/{order_id}/init-payment/', headers={'Idempotency-Key': 'pay-1'})
+        self.assertEqual(initialize.call_count, 1)
+        self.assertEqual(second.json(), first.json())
+
+    def test_concurrent_duplicates_create_one_order(self):
+        results = []
+        start = threading.Barrier(8)
+
+        def retry():
+            client = self.client_for()
+            start.wait()
+            try:
+                response = self.checkout('burst', client=client)
+                results.append((response.status_code, response.json()['id']))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=retry) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(set(results), {(201, Order.objects.get().id)})
+
+    def test_expired_keys_are_purged_and_free_again(self):
+        self.checkout('retry-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertEqual(idempotency.purge(batch_size=1), 1)
+        self.checkout('retry-2')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        # an expired key not purged yet runs the view again
+        self.assertEqual(self.checkout('retry-2').status_code, 400)
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('purged 0', out.getvalue())
+
+
+class OrderStateTests(TestCase):
+    """vendors move their order items along the allowed statuses, orders follow their items"""
+
+    def setUp(self):
+        self.ada = CustomUser.objects.create_user('ada@example.com', 'pass', role='vendor')
+        self.bola = CustomUser.objects.create_user('bola@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        self.phone = Product.objects.create(vendor=self.ada, name='Phone', description='', price=Decimal('100.00'), stock=50)
+        self.case = Product.objects.create(vendor=self.bola, name='Case', description='', price=Decimal('5.00'), stock=50)
+        self.clients = {}
+        for user in (self.ada, self.bola):
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients[user] = client
+
+    def order(self, *products):
+        order = Order.objects.create(user=self.customer, total=Decimal('0'))
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price, vendor=product.vendor.email)
+        return order
+
+    def bulk(self, user, items, target):
+        return self.clients[user].post('/api/order-items/bulk-status/', {'ids': [item.id for item in items], 'status': target}, format='json')
+
+    def test_order_follows_the_items_of_every_vendor(self):
+        order = self.order(self.phone, self.case)
+        phone_line, case_line = order.items.order_by('id')
+        # ada's items only, bola's line is not hers to move
+        self.assertEqual(self.bulk(self.ada, [phone_line, case_line], 'shipped').data, {'requested': 2, 'moved': 1})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.bulk(self.bola, [case_line], 'shipped')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'shipped')
+
+        self.assertEqual(self.clients[self.ada].post(f'/api/order-items/{phone_line.id}/update_delivery/', {'is_delivered': True}, format='json').status_code, 200)
+        self.bulk(self.bola, [case_line], 'delivered')
+        order.refresh_from_db()
+        phone_line.refresh_from_db()
+        self.assertEqual(order.status, 'delivered')
+        self.assertTrue(order.is_delivered)
+        self.assertIsNotNone(order.delivered_at)
+        self.assertIsNotNone(phone_line.delivered_at)
+
+    def test_transitions_not_allowed_are_refused(self):
+        item = self.order(self.phone).items.get()
+        client = self.clients[self.ada]
+        self.assertEqual(client.post(f'/api/order-items/{item.id}/update-item-status/', {'status': 'delivered'}).status_code, 409)
+        self.assertEqual(client.post(f'/api/order-items/{item.id}/update-item-status/', {'status': 'lost'}).status_code, 400)
+        self.assertEqual(client.post(f'/api/order-items/{item.id}/update-item-status/', {'status': 'shipped'}).status_code, 200)
+        self.assertEqual(client.post(f'/api/order-items/{item.id}/update-item-status/', {'status': 'pending'}).status_code, 409)
+        for body in ({'is_delivered': False}, {'is_delivered': [1]}, {'is_delivered': {}}, [1, 2]):
+            self.assertEqual(client.post(f'/api/order-items/{item.id}/update_delivery/', body, format='json').status_code, 400)
+        self.assertEqual(self.bulk(self.ada, [item], 'cancelled').data['moved'], 0)
+
+    def test_plain_updates_can_not_change_statuses(self):
+        order = self.order(self.phone)
+        item = order.items.get()
+        self.clients[self.ada].patch(f'/api/order-items/{item.id}/', {'status': 'lost'}, format='json')
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'pending')
+        customer = APIClient()
+        customer.force_authenticate(self.customer)
+        customer.patch(f'/api/orders/{order.id}/', {'status': 'delivered', 'is_paid': True, 'cancelled': True}, format='json')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.is_paid, order.cancelled), ('pending', False, False))
+
+    def test_bulk_moves_cost_the_same_for_any_number_of_items(self):
+        few = [self.order(self.phone).items.get() for _ in range(2)]
+        many = [self.order(self.phone).items.get() for _ in range(20)]
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.bulk(self.ada, few, 'shipped').data['moved'], 2)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.bulk(self.ada, many, 'shipped').data['moved'], 20)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Order.objects.filter(status='shipped').count(), 22)
+
+    def test_cancelled_lines_give_back_their_stock(self):
+        order = self.order(self.phone, self.case)
+        reserve_order_stock(order)
+        Order.objects.filter(pk=order.pk).update(is_paid=True)
+        self.bulk(self.ada, order.items.filter(product=self.phone), 'cancelled')
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((self.phone.stock, self.case.stock), (50, 48))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.bulk(self.bola, order.items.filter(product=self.case), 'cancelled')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.cancelled), ('cancelled', True))
+        self.assertEqual(inventory.held_by_order(order.id), {})
+
+    def test_partly_shipped_order_is_not_cancelled(self):
+        order = self.order(self.phone, self.case)
+        self.bulk(self.ada, order.items.filter(product=self.phone), 'shipped')
+        self.assertFalse(states.cancel_order(order))
+        self.assertEqual(sorted(order.items.values_list('status', flat=True)), ['pending', 'shipped'])
+        customer = APIClient()
+        customer.force_authenticate(self.customer)
+        self.assertEqual(customer.post(f'/api/orders/{order.id}/cancel/').status_code, 409)
+        self.assertEqual(order.items.get(product=self.case).status, 'pending')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.cancelled), ('pending', False))
+
+    def test_payment_skips_lines_cancelled_before_it(self):
+        order = self.order(self.phone, self.case)
+        Order.objects.filter(pk=order.pk).update(total=Decimal('210.00'), payment_reference='txn_1')
+        self.bulk(self.bola, order.items.filter(product=self.case), 'cancelled')
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal('200.00'))
+        self.assertTrue(claim_payment(order, 'txn_1'))
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((self.phone.stock, self.case.stock), (48, 50))
+        self.assertEqual(inventory.held_by_order(order.id), {self.phone.id: 2})
@@ -1,6 +1,8 @@
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, CartViewSet, OrderViewSet, OrderItemViewSet, VendorDashboardView, InitPaymentView, VerifyPaymentView, CategoryViewset
+from .views import ProductViewSet, CartViewSet, OrderViewSet, OrderItemViewSet, VendorDashboardView, VendorExportView, VendorCatalogueView, InitPaymentView, VerifyPaymentView, CategoryViewset
 from rest_framework.urls import path
+from django.urls import re_path
+from . import async_views
 router = DefaultRouter()
 router.register(r'products', ProductViewSet, basename='product')
 router.register(r'cart', CartViewSet, basename='cart')
@@ -11,6 +13,16 @@ router.register(r'order-items', OrderItemViewSet, basename='order-items')
 urlpatterns = router.urls 
 urlpatterns += [
     path('vendor-dashboard/', VendorDashboardView.as_view()),
+    re_path(r'^vendor-exports/(?P<kind>orders|items|sales)\.(?P<fmt>csv|ndjson)$', VendorExportView.as_view(), name='vendor_export'),
+    re_path(r'^vendor-catalogue\.(?P<fmt>csv|ndjson)$', VendorCatalogueView.as_view(), name='vendor_catalogue'),
     path('<int:order_id>/init-payment/', InitPaymentView.as_view(), name='initialize_payment'),
     path('<int:order_id>/verify-payment/', VerifyPaymentView.as_view(), name='verify_payment'),
+    # async twins for ASGI deployments
+    path('async/products/', async_views.product_list, name='async_product_list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async_product_detail'),
+    path('async/categories/', async_views.category_list, name='async_category_list'),
+    path('async/cart/<int:pk>/', async_views.cart_detail, name='async_cart_detail'),
+    path('async/orders/', async_views.order_history, name='async_order_history'),
+    path('async/<int:order_id>/init-payment/', async_views.init_payment, name='async_init_payment'),
+    path('async/<int:order_id>/verify-payment/', async_views.verify_payment, name='async_verify_payment'),
 ]
\ No newline at end of file
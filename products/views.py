@@ -1,6 +1,6 @@
 from django.shortcuts import render
 from .models import Product, Cart, CartItem, Order, OrderItem, Category
-from .serializers import ProductSerializer, CartSerializer, OrderSerializer, OrderItemSerializer, VendorOrderItemSerializer, VendorOrderSerializer, CategorySerializer
+from .serializers import ProductSerializer, CartSerializer, OrderSerializer, OrderItemSerializer, ItemStatusSerializer, DeliverySerializer, VendorOrderItemSerializer, VendorOrderSerializer, CategorySerializer, LeanOrderSerializer, CartBatchSerializer, MAX_CART_OPERATIONS
 from .permissions import IsVendorUser
 from rest_framework import viewsets, permissions, status
 from rest_framework.permissions  import IsAuthenticated 
@@ -11,17 +11,75 @@ from django.db import transaction
 from shipping.models import ShippingAddress
 from django.utils import timezone
 from .filters import ProductFilter
+from .search import ProductSearchFilter
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import OrderingFilter
+from .stock import InsufficientStock, reserve_order_stock
+from . import holds, states
+from .idempotency import idempotent
+from .pagination import KeysetPagination, OrderItemPagination
+from .cache import ALL, CATEGORIES, CachedResponseMixin
+from KaraKata.db import ReplicaReadMixin
+from .payments import PaymentDeclined, get_gateway
+from .tasks import notify_vendors, send_order_confirmation, send_payment_receipt
+from .exports import FORMATS, export_lines, vendor_items
+from .imports import COLUMNS as CATALOGUE_COLUMNS, ProductImporter, export_rows, parse_rows, text_stream
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Prefetch, Sum
+
+
+def user_carts(user):
+    """the user's carts as the cart views return them"""
+    # totals are stored on the cart, items and their product names come in one prefetch
+    return Cart.objects.filter(user=user).prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product').only('id', 'cart_id', 'product_id', 'product__name', 'quantity', 'price')))
+
+
+def claim_payment(order, reference):
+    """marks the order paid and takes its stock once the gateway confirmed reference
+
+    returns False when another callback got there first. only the first callback
+    for a reference flips is_paid, retries and concurrent callbacks match no row.
+    raises InsufficientStock, rolling the claim back, when the stock ran out.
+    """
+    with transaction.atomic():
+        claimed = Order.objects.filter(id=order.id, payment_reference=reference, is_paid=False).update(is_paid=True, paid_at=timezone.now())
+        if claimed:
+            reserve_order_stock(order)
+            send_payment_receipt.delay(order.id)
+            notify_vendors.delay(order.id, 'paid')
+    return bool(claimed)
+
+
+def start_payment(request, order_id, callback_url):
+    """initialises the payment of one of the user's orders with the gateway, returns (data, status)"""
+    try:
+        order = Order.objects.get(id=order_id, user=request.user)
+    except Order.DoesNotExist:
+        return {"error":"Order not found"}, status.HTTP_404_NOT_FOUND
+    if order.is_paid:
+        return {'message': 'Order already paid'}, status.HTTP_400_BAD_REQUEST
+
+    payment = get_gateway().initialize(order, callback_url)
+    order.payment_reference = payment['reference']
+    order.save(update_fields=['payment_reference'])
+    return {"message":"Payment initialized succesfully", "reference":payment['reference'], "amount":order.total,
+            "callback_url":callback_url, "authorization_url":payment['authorization_url']}, status.HTTP_200_OK
+
 
 # Create your views here.
-class ProductViewSet(viewsets.ModelViewSet):
-    """Product viewset (create, list, delete)"""
+class ProductViewSet(ReplicaReadMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    """Product viewset (create, list, delete), list and retrieve are served from the response cache"""
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     look_up_field = 'slug'
     filterset_fields = ['category', 'vendor']
     filterset_class = ProductFilter
-    search_fields = ['name', 'description']
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     ordering_fields = ['price', 'created_at']
+    pagination_class = KeysetPagination
     
     def get_permissions(self):
         """checks if user is authorised to perform some actions"""
@@ -32,6 +90,18 @@ class ProductViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """set the vendor to the current user when creating a product"""
         serializer.save(vendor=self.request.user)
+
+    @action(detail=False, methods=['get'], url_path='availability')
+    def availability(self, request):
+        """units left to add to a cart for ?ids=1,2,3, stock less what carts and unpaid orders hold, never cached"""
+        try:
+            ids = [int(pid) for pid in request.query_params.get('ids', '').split(',') if pid]
+        except ValueError:
+            return Response({'error':'ids must be product ids separated by commas'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < len(ids) <= MAX_CART_OPERATIONS:
+            return Response({'error':f'between 1 and {MAX_CART_OPERATIONS} ids are required'}, status=status.HTTP_400_BAD_REQUEST)
+        free = holds.available(ids)
+        return Response([{'product': pid, 'available': max(free[pid], 0)} for pid in ids if pid in free])
     
 
 class CartViewSet(viewsets.ModelViewSet):
@@ -39,10 +109,11 @@ class CartViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
+    pagination_class = None # a user only has one cart
 
     def get_queryset(self):
         """helper function to get or create cart if not exist"""
-        return Cart.objects.filter(user=self.request.user)
+        return user_carts(self.request.user)
     
     
     @action(detail=False, methods=['post'], url_path='add') # custom view in viewset
@@ -58,91 +129,181 @@ class CartViewSet(viewsets.ModelViewSet):
         except Product.DoesNotExist:
             return Response({'error':'Product does not exist'}, status=status.HTTP_404_NOT_FOUND)
         
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={'price': product.price, 'quantity': quantity})
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(user=request.user)
+            # the whole line is held, what is already in the cart and what is added
+            in_cart = CartItem.objects.filter(cart=cart, product=product).values_list('quantity', flat=True).first() or 0
+            if holds.hold(cart, {product.id: in_cart + quantity}):
+                return Response({'error':'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
+
+            cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product, defaults={'price': product.price, 'quantity': quantity})
+            if not created:
+                CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+            cart.adjust_totals(quantity, quantity * cart_item.price)
         return Response({'Message':'Item added to cart'})
 
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """applies a list of add, set and remove operations in one transaction and returns the cart
+
+        operations are applied in order, so the same product can appear more than
+        once. the queries do not grow with the batch: the products and the cart
+        lines are each read once and written back with bulk statements.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        product_ids = {op['product'] for op in operations}
+
+        with transaction.atomic():
+            # the cart row lock queues concurrent batches of the same user
+            cart, _ = Cart.objects.select_for_update().get_or_create(user=request.user)
+            products = {row['id']: row for row in Product.objects.filter(id__in=product_ids).values('id', 'price')}
+            missing = sorted(product_ids - set(products))
+            if missing:
+                return Response({'error':'Products do not exist', 'products': missing}, status=status.HTTP_404_NOT_FOUND)
+            items = {item.product_id: item for item in CartItem.objects.filter(cart=cart, product_id__in=product_ids)}
+
+            quantities = {pid: item.quantity for pid, item in items.items()}
+            for op in operations:
+                current = quantities.get(op['product'], 0)
+                quantities[op['product']] = current + op['quantity'] if op['op'] == 'add' else op['quantity']
+
+            # lines that only shrink are let through even when stock fell below them
+            shrinking = {pid for pid, quantity in quantities.items() if quantity <= getattr(items.get(pid), 'quantity', 0)}
+            short = holds.hold(cart, quantities, shrinking)
+            if short:
+                return Response({'error':'Insufficient stock', 'products': short}, status=status.HTTP_400_BAD_REQUEST)
+
+            created, changed, removed = [], [], []
+            count_delta, total_delta = 0, 0
+            for pid, quantity in quantities.items():
+                item = items.get(pid)
+                if item is None:
+                    if quantity:
+                        created.append(CartItem(cart=cart, product_id=pid, quantity=quantity, price=products[pid]['price']))
+                        count_delta += quantity
+                        total_delta += quantity * products[pid]['price']
+                    continue
+                if quantity == item.quantity:
+                    continue
+                count_delta += quantity - item.quantity
+                total_delta += (quantity - item.quantity) * item.price
+                if quantity:
+                    item.quantity = quantity
+                    changed.append(item)
+                else:
+                    removed.append(item.id)
+
+            CartItem.objects.bulk_create(created)
+            CartItem.objects.bulk_update(changed, ['quantity'])
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+            if count_delta or total_delta:
+                cart.adjust_totals(count_delta, total_delta)
+
+        return Response(CartSerializer(self.get_queryset().get(pk=cart.pk)).data)
+
     @action(detail=True, methods=['patch'], url_path='update')
     def update_quantity(self, request, pk=None):
         """updates the quntity of a product in cart""" 
-        try:
-            cart_item = CartItem.objects.get(id=pk, cart__user=request.user)
-        except CartItem.DoesNotExist:
-            return Response({'error':'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
-        
         try:
             quantity = int(request.data.get('quantity',1))
         except (ValueError, TypeError):
             return Response({'error':'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
         if quantity <= 0:
             return Response({'error':'Quantity must be greater than 0'}, status=status.HTTP_400_BAD_REQUEST)
-        if quantity > cart_item.product.stock:
-            return Response({'error':'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
-        # update the quantity of the cart item
-        cart_item.quantity = quantity
-        cart_item.save()
-        return Response({'message':f'Item quantity updated to {cart_item.quantity}'})
+
+        with transaction.atomic():
+            try:
+                cart_item = CartItem.objects.select_for_update().select_related('cart', 'product').get(id=pk, cart__user=request.user)
+            except CartItem.DoesNotExist:
+                return Response({'error':'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
+            shrinking = {cart_item.product_id} if quantity <= cart_item.quantity else ()
+            if holds.hold(cart_item.cart, {cart_item.product_id: quantity}, shrinking):
+                return Response({'error':'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
+            # update the quantity of the cart item and move the cart totals by the difference
+            delta = quantity - cart_item.quantity
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=quantity)
+            cart_item.cart.adjust_totals(delta, delta * cart_item.price)
+        return Response({'message':f'Item quantity updated to {quantity}'})
 
     @action(detail=True, methods=['delete'], url_path='remove')
     def remove_item(self, request, pk):
         """removes the item from cart"""
-        try:
-            cart_item = CartItem.objects.get(id=pk, cart__user=request.user)
+        with transaction.atomic():
+            try:
+                cart_item = CartItem.objects.select_for_update().select_related('cart').get(id=pk, cart__user=request.user)
+            except CartItem.DoesNotExist:
+                return Response({'error':'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
             cart_item.delete()
-            return Response({'message':'Item removed from cart'})
-        except CartItem.DoesNotExist:
-            return Response({'error':'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
+            holds.hold(cart_item.cart, {cart_item.product_id: 0})
+            cart_item.cart.adjust_totals(-cart_item.quantity, -cart_item.quantity * cart_item.price)
+        return Response({'message':'Item removed from cart'})
         
 class OrderItemViewSet(viewsets.ModelViewSet):
     """order viewset"""
     permission_classes = [IsAuthenticated]
     serializer_class = OrderItemSerializer
+    pagination_class = OrderItemPagination
     def get_queryset(self):
         """gets vendors orders"""
-        return OrderItem.objects.filter(product__vendor=self.request.user)
+        return OrderItem.objects.filter(product__vendor=self.request.user).select_related('product')
     
+    def move(self, items, order_status):
+        """moves items to order_status, returns the error response when that is not a status or they can not go there"""
+        if order_status not in dict(OrderItem.STATUS_CHOICES):
+            return Response({'error':'Invalid order status choice'}, status=status.HTTP_400_BAD_REQUEST)
+        if not states.move_items(items, order_status):
+            return Response({'error':f'Order item can not be moved to {order_status}'}, status=status.HTTP_409_CONFLICT)
+        return None
+
     @action(detail=True, methods=['post'], url_path='update-item-status')
     def update_item_status(self, request, pk=None):
         """update the order item status of the product"""
-        order_item = self.get_object() # gets the model object
-
-        if not request.user.is_staff and not order_item.filter(product__vendor=request.user).exists():
-            return Response({"error":"You are not authorised to do this"}, status=status.HTTP_404_NOT_FOUND)
-        order_status = request.data.get('status')
-        if order_status not in dict(OrderItem.STATUS_CHOICES):
-            return Response({'error':'Invalid order status choice'}, status=status.HTTP_400_BAD_REQUEST)
-        order_item.status = order_status
-        order_item.save()
+        order_item = self.get_object() # gets the model object, only the vendor's own items are found
+        error = self.move(self.get_queryset().filter(pk=order_item.pk), request.data.get('status'))
+        if error:
+            return error
         return Response({'message':f'Order item {order_item.id} status updated successfully'})
-    
+
     @action(detail=True, methods=['post'], url_path='update_delivery')
     def update_is_delivered(self, request, pk=None):
         """Update delivery status"""
         order_item = self.get_object() # gets the model object
+        DeliverySerializer(data=request.data).is_valid(raise_exception=True)
+        error = self.move(self.get_queryset().filter(pk=order_item.pk), 'delivered')
+        if error:
+            return error
+        return Response({'message':f'Order item {order_item.id} delivery status updated successfully'})
 
-        if not request.user.is_staff and not order_item.filter(product__vendor=request.user).exists():
-            return Response({"error":"You are not authorised to do this"}, status=status.HTTP_404_NOT_FOUND)
-        is_delivered = request.data.get('is_delivered')
-        order_item.is_delivered = is_delivered
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """moves many of the vendor's order items to one status, items that can not go there are skipped"""
+        serializer = ItemStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+        moved = states.move_items(self.get_queryset().filter(id__in=ids), serializer.validated_data['status'])
+        return Response({'requested': len(ids), 'moved': moved})
 
-        order_item.save()
-        return Response({'message':f'Order item {order_item.id} delivery status updated successfully'})
-    
-        
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """order viewset"""
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     def get_queryset(self):
         """gets user orders"""
-        return Order.objects.filter(user=self.request.user).prefetch_related('items__product')
+        return Order.objects.filter(user=self.request.user).select_related('shipping_address').prefetch_related('items__product')
+
+    def list(self, request, *args, **kwargs):
+        """order history, serialized from .values() rows with a compact product summary per item"""
+        queryset = self.filter_queryset(Order.objects.filter(user=request.user)).values(*LeanOrderSerializer.columns())
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(LeanOrderSerializer(request).to_representation(page))
 
     @action(detail=False, methods=['post'], url_path='checkout')
+    @idempotent # retries with the same Idempotency-Key get the first order back
     @transaction.atomic # to ensure DB interury in case error occur when ceating order 
     def checkout(self, request):
         """checkout user's cart to order"""
@@ -154,8 +315,8 @@ class OrderViewSet(viewsets.ModelViewSet):
         except Cart.DoesNotExist:
             return Response({'error':'Cart not found'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # gets the items in cart
-        cart_items = cart.items.all()
+        # gets the items in cart with their product and vendor in one joined read
+        cart_items = list(cart.items.select_related('product__vendor'))
         if not cart_items:
             return Response({'error':'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -164,23 +325,35 @@ class OrderViewSet(viewsets.ModelViewSet):
              address = ShippingAddress.objects.get(id=address_id, user=user)
         except ShippingAddress.DoesNotExist:
             return Response({'error':'Invalid shipping address'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        order = Order.objects.create(user=user, shipping_address=address, total=0)
-        total_price = 0
 
-        # changes the cart items to order items for each 
-        for item in cart_items:
-            subtotal = item.quantity * item.price
-            total_price += subtotal
+        # lines whose hold lapsed are held again, the order can not take units other carts hold
+        short = holds.hold(cart, {item.product_id: item.quantity for item in cart_items})
+        if short:
+            return Response({'error':'Insufficient stock', 'products': short}, status=status.HTTP_409_CONFLICT)
+
+        # total is computed in a single pass so the order is written once
+        total_price = sum(item.quantity * item.price for item in cart_items)
+        order = Order.objects.create(user=user, shipping_address=address, total=total_price)
+
+        # changes the cart items to order items in one bulk insert
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item.product, quantity=item.quantity, price=item.price, vendor=item.product.vendor.email, status='pending')
+            for item in cart_items
+        ])
+
+        # the holds stay with the order until it is paid or they expire
+        holds.check_out(cart, order)
 
-            OrderItem.objects.create(order=order, product=item.product, quantity=item.quantity, price=item.price, vendor=item.product.vendor, status='pending')
-        order.total = total_price
-        order.save()
-        
         # clears the cart
-        cart.items.all().delete()
+        CartItem.objects.filter(cart=cart).delete()
+        Cart.objects.filter(pk=cart.pk).update(total=0, item_count=0)
 
-        # turns the order into JSON
+        # mails go out from the task workers once the order is committed
+        send_order_confirmation.delay(order.id)
+        notify_vendors.delay(order.id, 'ordered')
+
+        # turns the order into JSON, loading the nested items in a fixed number of queries
+        order = Order.objects.select_related('shipping_address').prefetch_related('items__product').get(pk=order.pk)
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -196,7 +369,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'], url_path='update-status')
     def update_status(self, request, pk=None):
-        """update the order status of the product"""
+        """update the order status of the product, staff move every item of the order and vendors their own"""
         order = self.get_object() # gets the model object
 
         if not request.user.is_staff and not order.items.filter(product__vendor=request.user).exists():
@@ -204,9 +377,15 @@ class OrderViewSet(viewsets.ModelViewSet):
         order_status = request.data.get('status')
         if order_status not in dict(Order.STATUS_CHOICES):
             return Response({'error':'Invalid order status choice'}, status=status.HTTP_400_BAD_REQUEST)
-        order.status = order_status
-        order.save()
-        return Response({'message':f'Order {order.id} status updated successfully'})
+        if request.user.is_staff and order_status == 'cancelled':
+            moved = states.cancel_order(order)
+        else:
+            items = order.items.all() if request.user.is_staff else order.items.filter(product__vendor=request.user)
+            moved = states.move_items(items, order_status)
+        if not moved:
+            return Response({'error':f'Order {order.id} can not be moved to {order_status}'}, status=status.HTTP_409_CONFLICT)
+        order.refresh_from_db(fields=['status'])
+        return Response({'message':f'Order {order.id} status updated successfully', 'status': order.status})
     
 
     @action(detail=True, methods=['post'], url_path='cancel')
@@ -223,71 +402,126 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({"error":"Cannot cancel a paid order"}, status=status.HTTP_400_BAD_REQUEST)
         if order.cancelled:
             return Response({"error":"Order already cancelled"}, status=status.HTTP_400_BAD_REQUEST)
-        order.cancelled = True
-        order.cancelled_at = timezone.now()
-        order.save()
+        if not states.cancel_order(order):
+            return Response({"error":"Order has already shipped"}, status=status.HTTP_409_CONFLICT)
         return Response({"message":"Order cancelled successfully"})
 
 
-class VendorDashboardView(APIView):
-    """vENDOR DASHBOARD VIEW"""
+class VendorDashboardView(ReplicaReadMixin, APIView):
+    """vendor dashboard view, paid orders containing the vendor's items newest first"""
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    replica_actions = ('get',)
 
     def get(self, request):
-        vendor_items = OrderItem.objects.filter(vendor=request.user, order__is_paid=True).select_related('order','product', 'order__user')
-        print(vendor_items)
-        order_map = {}
-
-        for item in vendor_items:
-            order = item.order
-            quantity = item.quantity
-            price = item.price
-
-            if order.id not in order_map:
-                order_map[order.id] = {
-                    'order_id': order.id,
-                    'customer': order.user.email,
-                    'order_status': order.status,
-                    'quantity': quantity,
-                    'price':price,
-                    'created_at': order.created_at,
-                    'shipping_address': order.shipping_address,
-                    'items': []
-                }
-            order_map[order.id]['items'].append(item) # adds vendor items tothe item array in order
-
-        response_data = []
-        for order_data in order_map.values():
-            item_serializer = VendorOrderItemSerializer(order_data['items'], many=True)
-            order_data['items'] = item_serializer.data
-
-            order_data = VendorOrderSerializer(order_data)
-
-            response_data.append(order_data.data)
-        return Response({'orders': response_data}, status=status.HTTP_200_OK)
-# To Do: implement order total and total earnng forvendor
+        # order items store the vendor's email, cancelled lines earn nothing
+        vendor_items = OrderItem.objects.filter(vendor=request.user.email, order__is_paid=True).exclude(status='cancelled')
+        line_total = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        earnings = vendor_items.aggregate(total_earnings=Sum(line_total), total_items=Count('id'), total_orders=Count('order', distinct=True))
+
+        # per order totals for this vendor's lines only, grouped in the database
+        orders = (
+            Order.objects.filter(is_paid=True, items__vendor=request.user.email, items__status__in=states.ACTIVE_ITEM_STATUSES)
+            .annotate(
+                order_total=Sum(F('items__quantity') * F('items__price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+                item_count=Count('items'),
+            )
+            .select_related('user', 'shipping_address')
+        )
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(orders, request, view=self)
+
+        # vendor items of the orders on this page in one query
+        items_by_order = {}
+        for item in vendor_items.filter(order_id__in=[order.id for order in page]).select_related('product').order_by('id'):
+            items_by_order.setdefault(item.order_id, []).append(item)
+
+        order_data = [
+            {
+                'order_id': order.id,
+                'customer': order.user.email,
+                'order_status': order.status,
+                'order_total': order.order_total,
+                'item_count': order.item_count,
+                'created_at': order.created_at,
+                'shipping_address': order.shipping_address,
+                'items': items_by_order.get(order.id, []),
+            }
+            for order in page
+        ]
+        return Response({
+            'orders': VendorOrderSerializer(order_data, many=True).data,
+            'next': paginator.get_next_link(),
+            'total_earnings': earnings['total_earnings'] or 0,
+            'total_orders': earnings['total_orders'],
+            'total_items': earnings['total_items'],
+        }, status=status.HTTP_200_OK)
+
+class VendorExportView(APIView):
+    """streams the vendor's orders, order items or product sales as csv or ndjson
+
+    ?from= and ?to= take dates or datetimes and bound the order creation time,
+    a plain date for to includes that whole day.
+    """
+    permission_classes = [IsAuthenticated, IsVendorUser]
+
+    def get(self, request, kind, fmt):
+        try:
+            start = self.parse_bound(request.query_params.get('from'), end=False)
+            end = self.parse_bound(request.query_params.get('to'), end=True)
+        except ValueError:
+            return Response({'error':'from and to must be dates or datetimes'}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = export_lines(kind, fmt, vendor_items(request.user.email, start, end))
+        response = StreamingHttpResponse(lines, content_type=FORMATS[fmt][1])
+        response['Content-Disposition'] = f'attachment; filename="{kind}-{timezone.localdate():%Y%m%d}.{fmt}"'
+        return response
+
+    def parse_bound(self, value, end):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is not None:
+            moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+        else:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError(value)
+        return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+class VendorCatalogueView(APIView):
+    """the vendor's products as csv or ndjson, GET exports them and POST imports a file in the same format
+
+    the upload goes in a multipart 'file' field. rows are upserted by sku, then
+    by slug, and the response reports the rows that failed with their line numbers.
+    """
+    permission_classes = [IsAuthenticated, IsVendorUser]
+
+    def get(self, request, fmt):
+        write, content_type = FORMATS[fmt]
+        response = StreamingHttpResponse(write(CATALOGUE_COLUMNS, export_rows(request.user)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products-{timezone.localdate():%Y%m%d}.{fmt}"'
+        return response
+
+    def post(self, request, fmt):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error':'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        upload.seek(0)
+        report = ProductImporter(request.user).run(parse_rows(text_stream(upload.file), fmt))
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
 
 #payment viewss
 class InitPaymentView(APIView):
     """Initialise payment"""
     permission_classes = [IsAuthenticated]
     
+    @idempotent
     def post(self, request, order_id):
         """gets order create new payment"""
-        try:
-            order = Order.objects.get(id=order_id, user=request.user)
-            if order.is_paid:
-                return Response({'message': 'Order already paid'}, status=400)
-            
-            # Fake transcatiomn ref we later generate from paysatck init call
-            fake_ref = f"txn_{order_id}_{timezone.now().timestamp()}"
-            order.payment_reference = fake_ref
-            order.save()
-
-            # when addinfg payment return redirectt url
-            return Response({"message":"Payment initialized succesfully", "reference":fake_ref, "amount":order.total, "callback_url":f"http://localhost:8000/api/{order.id}/verify-payment/"})
-        except Order.DoesNotExist:
-            return Response({"error":"Order not found"}, status=404)
+        data, code = start_payment(request, order_id, request.build_absolute_uri(f"/api/{order_id}/verify-payment/"))
+        return Response(data, status=code)
 
 class VerifyPaymentView(APIView):
     """verify payment (simulated for now)"""
@@ -297,21 +531,49 @@ class VerifyPaymentView(APIView):
         """gets order and verify payment"""
         try:
             order = Order.objects.get(id=order_id, user=request.user)
-            if not order.is_paid:
-                #add real payment api call later
-                order.is_paid = True
-                order.paid_at = timezone.now()
-                order.save()
-            for item in order.items.all():
-                item.product.stock -= item.quantity
-                item.product.save()
-            # call the payment gateway API to verify the payment
-
-            return Response({'message': 'Payment verified successfully'}, status=status.HTTP_200_OK)
         except Order.DoesNotExist:
             return Response({'error':'Order not found'}, status=404)
+
+        # paystack sends the reference back on the callback url
+        reference = request.query_params.get('reference', order.payment_reference)
+        if not order.payment_reference or reference != order.payment_reference:
+            return Response({'error':'Invalid payment reference'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            get_gateway().verify(reference)
+        except PaymentDeclined:
+            return Response({'error':'Payment was not successful'}, status=status.HTTP_402_PAYMENT_REQUIRED)
+
+        try:
+            claimed = claim_payment(order, reference)
+        except InsufficientStock:
+            return Response({'error':'Insufficient stock to fulfil this order'}, status=status.HTTP_409_CONFLICT)
+
+        if not claimed:
+            return Response({'message': 'Payment already verified'}, status=status.HTTP_200_OK)
+        return Response({'message': 'Payment verified successfully'}, status=status.HTTP_200_OK)
         
-class CategoryViewset(viewsets.ModelViewSet):
-    permission_classes = [IsAuthenticated]
+class CategoryViewset(ReplicaReadMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    """the category tree with product figures, reads are public and served from the response cache"""
     serializer_class = CategorySerializer
-    queryset = Category.objects.all()
\ No newline at end of file
+    queryset = Category.objects.select_related('summary').order_by('path')
+    # the storefront draws the whole tree at once
+    pagination_class = None
+    cache_control = 'public, max-age=60'
+
+    def get_permissions(self):
+        if self.action in ['list', 'retrieve']:
+            return [permissions.AllowAny()]
+        return [permissions.IsAuthenticated()]
+
+    def cache_query_params(self):
+        return set()
+
+    def list_cache_scopes(self, request):
+        return [ALL, CATEGORIES]
+
+    def detail_cache_scopes(self, pk):
+        return [ALL, CATEGORIES]
+
+    def row_cache_scopes(self, data):
+        return []
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-17 16:16
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shipping', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shippingaddress',
+            index=models.Index(fields=['user', 'is_default'], name='address_user_default_idx'),
+        ),
+    ]
@@ -12,5 +12,11 @@ class ShippingAddress(models.Model):
     is_default = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # finding a user's default address
+            models.Index(fields=['user', 'is_default'], name='address_user_default_idx'),
+        ]
+
     def __str__(self):
         return f"{self.address_line}, {self.city}, {self.state}, {self.country}"
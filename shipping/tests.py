@@ -1,3 +1,23 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from KaraKata.testing import EndpointQueryBudgetMixin
+from products.seed import seed_marketplace
+
+
+class AddressQueryBudgetTests(EndpointQueryBudgetMixin, TestCase):
+    """address endpoints stay within their query budgets"""
+    query_budgets = [
+        ('address list', 'customer', '/api/addresses/', 2), # count, page
+        ('address detail', 'customer', '/api/addresses/{self.address.id}/', 1),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        _, customers, _ = seed_marketplace(vendors=2, products_per_vendor=10, customers=20)
+        cls.customer_user = customers[0]
+        cls.address = cls.customer_user.addresses.get()
+
+    def setUp(self):
+        self.customer = APIClient()
+        self.customer.force_authenticate(self.customer_user)
@@ -10,4 +10,4 @@ class ShippingAddressViewset(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """ensures only users' adresses can be CRUD by user"""
-        return ShippingAddress.objects.filter(user=self.request.user)
\ No newline at end of file
+        return ShippingAddress.objects.filter(user=self.request.user).order_by('-is_default', '-created_at')
\ No newline at end of file
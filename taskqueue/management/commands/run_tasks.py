@@ -0,0 +1,36 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from taskqueue.worker import Worker
+
+
+class Command(BaseCommand):
+    help = "Runs queued background tasks until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="jobs run in parallel")
+        parser.add_argument('--pool', choices=['thread', 'process', 'inline'], default='thread')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="seconds to wait when the queue is empty")
+        parser.add_argument('--lease', type=int, default=600, help="seconds after which a running job is assumed lost and requeued")
+        parser.add_argument('--once', action='store_true', help="run the jobs due now and exit")
+
+    def handle(self, *args, **options):
+        pool = None if options['pool'] == 'inline' else options['pool']
+        worker = Worker(options['workers'], pool, options['lease'])
+        try:
+            if options['once']:
+                total = 0
+                while ran := worker.run_once():
+                    total += ran
+                self.stdout.write(f"ran {total} tasks")
+                return
+            stop = threading.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                # finish the running batch, then exit
+                signal.signal(sig, lambda *_: stop.set())
+            self.stdout.write(f"worker {worker.id} running {options['workers']} {options['pool']} workers")
+            worker.run(options['poll_interval'], stop)
+        finally:
+            worker.shutdown()
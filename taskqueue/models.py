@@ -0,0 +1,29 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """one durable job, the table is the queue"""
+    STATUS_CHOICES = [('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the due jobs oldest first, and look for expired leases
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+            models.Index(fields=['status', 'locked_at'], name='task_status_locked_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
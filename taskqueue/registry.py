@@ -0,0 +1,45 @@
+import random
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Task
+
+# name -> TaskFunction, filled by @task as the tasks modules are imported
+registry = {}
+
+
+class TaskFunction:
+    """a function that can be run later by a worker, made by @task"""
+
+    def __init__(self, func, max_attempts, backoff, max_backoff):
+        self.func = func
+        self.name = f"{func.__module__}.{func.__name__}"
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """queues a run once the current transaction commits, nothing is queued if it rolls back"""
+        transaction.on_commit(lambda: self.enqueue(*args, **kwargs))
+
+    def enqueue(self, *args, **kwargs):
+        return Task.objects.create(name=self.name, args=list(args), kwargs=kwargs, max_attempts=self.max_attempts)
+
+    def retry_at(self, attempts):
+        """exponential backoff with jitter, so failures that happened together retry apart"""
+        delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+        return timezone.now() + timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def task(func=None, *, max_attempts=5, backoff=10, max_backoff=3600):
+    """registers func as a task, retried up to max_attempts times waiting backoff seconds, doubled each time"""
+    def register(func):
+        wrapped = TaskFunction(func, max_attempts, backoff, max_backoff)
+        registry[wrapped.name] = wrapped
+        return wrapped
+    return register(func) if func is not None else register
@@ -0,0 +1,109 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import CustomUser
+from products.models import Cart, CartItem, Product
+from products.payments import get_gateway
+from shipping.models import ShippingAddress
+from .models import Task
+from .registry import task
+from .worker import Worker, claim
+
+calls = []
+
+
+@task(max_attempts=2, backoff=60)
+def flaky(value):
+    calls.append(value)
+    if value == 'fail':
+        raise ValueError(value)
+
+
+class TaskQueueTests(TestCase):
+    """jobs are queued on commit, run once, and retried with backoff"""
+
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker(pool=None)
+
+    def test_delay_queues_on_commit_only(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            flaky.delay('ok')
+            self.assertFalse(Task.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.worker.run_once(), 1)
+        self.assertEqual(calls, ['ok'])
+        self.assertEqual(Task.objects.get().status, 'done')
+        self.assertEqual(self.worker.run_once(), 0)
+
+    def test_failures_back_off_then_give_up(self):
+        job = flaky.enqueue('fail')
+        with self.assertLogs('karakata.tasks', 'WARNING'):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=25))
+        self.assertEqual(self.worker.run_once(), 0)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('karakata.tasks', 'WARNING'):
+            self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('ValueError', job.last_error)
+
+    def test_claimed_jobs_are_not_claimed_twice(self):
+        flaky.enqueue('ok')
+        self.assertEqual(len(claim('a', 10)), 1)
+        self.assertEqual(claim('b', 10), [])
+
+    def test_lost_jobs_are_requeued_after_the_lease(self):
+        job = flaky.enqueue('ok')
+        claim('dead worker', 10)
+        Task.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.worker.run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+
+
+class PaymentSideEffectTests(TestCase):
+    """checkout and payment leave their mails to the task queue"""
+
+    def setUp(self):
+        vendor = CustomUser.objects.create_user('vendor@example.com', 'pass', role='vendor')
+        self.customer = CustomUser.objects.create_user('customer@example.com', 'pass')
+        product = Product.objects.create(vendor=vendor, name='Phone', description='', price=Decimal('100.00'), stock=5)
+        self.address = ShippingAddress.objects.create(user=self.customer, full_name='Ada', phone='0', address_line='1', city='Lagos', state='Lagos')
+        cart = Cart.objects.create(user=self.customer)
+        CartItem.objects.create(cart=cart, product=product, quantity=1, price=product.price)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer)
+
+    def test_mails_are_sent_by_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order_id = self.client.post('/api/orders/checkout/', {'shipping_address_id': self.address.id}, format='json').data['id']
+        reference = self.client.post(f'/api/{order_id}/init-payment/').data['reference']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(f'/api/{order_id}/verify-payment/', {'reference': reference})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+
+        Worker(pool=None).run_once()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['customer@example.com'] * 2 + ['vendor@example.com'] * 2)
+        self.assertFalse(Task.objects.exclude(status='done').exists())
+
+    def test_declined_payment_is_not_verified(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order_id = self.client.post('/api/orders/checkout/', {'shipping_address_id': self.address.id}, format='json').data['id']
+        reference = self.client.post(f'/api/{order_id}/init-payment/').data['reference']
+        with mock.patch.object(get_gateway(), 'declined', {reference}):
+            response = self.client.get(f'/api/{order_id}/verify-payment/', {'reference': reference})
+        self.assertEqual(response.status_code, 402)
+        self.assertEqual(Task.objects.filter(name__endswith='send_payment_receipt').count(), 0)
@@ -0,0 +1,115 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Task
+from .registry import registry
+
+logger = logging.getLogger('karakata.tasks')
+
+
+def claim(worker_id, limit):
+    """marks up to limit due jobs as running for worker_id and returns their ids
+
+    the UPDATE only matches rows still queued, so two workers picking the same
+    ids split them instead of both running them. skip_locked keeps postgres
+    workers off each other's rows, sqlite takes its write lock for the block.
+    """
+    with transaction.atomic():
+        due = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=timezone.now())
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not due:
+            return []
+        Task.objects.filter(id__in=due, status='queued').update(status='running', locked_by=worker_id, locked_at=timezone.now())
+        return list(Task.objects.filter(id__in=due, status='running', locked_by=worker_id).values_list('id', flat=True))
+
+
+def requeue_expired(lease):
+    """puts back jobs whose worker died while running them"""
+    return Task.objects.filter(status='running', locked_at__lt=timezone.now() - timedelta(seconds=lease)).update(
+        status='queued', locked_by='', locked_at=None)
+
+
+def execute(task_id):
+    """runs one claimed job and records the outcome, a failure is retried with backoff until max_attempts"""
+    job = Task.objects.get(id=task_id)
+    attempts = job.attempts + 1
+    try:
+        func = registry[job.name]
+    except KeyError:
+        Task.objects.filter(id=job.id).update(status='failed', attempts=attempts, last_error=f"unknown task {job.name}", finished_at=timezone.now())
+        return False
+    try:
+        func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts < job.max_attempts:
+            Task.objects.filter(id=job.id).update(status='queued', attempts=attempts, last_error=error,
+                                                  run_at=func.retry_at(attempts), locked_by='', locked_at=None)
+        else:
+            Task.objects.filter(id=job.id).update(status='failed', attempts=attempts, last_error=error, finished_at=timezone.now())
+        logger.warning("task %s %s failed on attempt %s", job.id, job.name, attempts)
+        return False
+    Task.objects.filter(id=job.id).update(status='done', attempts=attempts, last_error='', finished_at=timezone.now())
+    return True
+
+
+def execute_in_worker(task_id):
+    try:
+        return execute(task_id)
+    finally:
+        connections.close_all()
+
+
+class Worker:
+    """claims due jobs and runs them in a thread or process pool
+
+    pool is 'thread', 'process', or None to run the jobs in the calling thread.
+    """
+
+    def __init__(self, workers=4, pool='thread', lease=600):
+        self.workers = workers
+        self.lease = lease
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        if pool == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tasks')
+        elif pool == 'process':
+            # spawned, not forked, so no process shares the parent's database connections
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            self.executor = None
+
+    def run_once(self):
+        """runs one batch of due jobs, returns how many were run"""
+        requeue_expired(self.lease)
+        claimed = claim(self.id, max(self.workers, 1) * 2)
+        if self.executor is None:
+            for task_id in claimed:
+                execute(task_id)
+        else:
+            wait([self.executor.submit(execute_in_worker, task_id) for task_id in claimed])
+        return len(claimed)
+
+    def run(self, poll_interval=1.0, stop=None):
+        """runs batches until stop is set, sleeping poll_interval whenever the queue is empty"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(poll_interval)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)